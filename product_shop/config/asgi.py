@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+from shop.warmup import warm_up  # noqa: E402
+
+# Маршруты и сериализаторы прогреваются до первого запроса, индекс подсказок
+# строится в фоне с первого запроса процесса (после fork воркера)
+warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.MetricsMiddleware',
+    'shop.middleware.ProfilingMiddleware',
+    'shop.middleware.CompressionMiddleware',
+    'shop.middleware.DatabaseRoutingMiddleware',
+    'shop.middleware.RelationLoaderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -85,6 +91,59 @@ DATABASES = {
     }
 }
 
+# Профиль БД для продакшена (DB_PROFILE=production): pragmas на каждом новом соединении,
+# BEGIN IMMEDIATE вместо отложенного захвата блокировки записи и постоянные соединения
+DB_PROFILE = os.environ.get('DB_PROFILE', 'default')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+if DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+
+# Реплика для чтений каталога (DB_READ_REPLICA): путь к копии БД SQLite или 'ro' —
+# та же БД, открытая только на чтение (file:...?mode=ro), для проверки маршрутизации локально
+DB_READ_REPLICA = os.environ.get('DB_READ_REPLICA')
+
+if DB_READ_REPLICA:
+    replica_name = f"file:{DATABASES['default']['NAME']}?mode=ro" if DB_READ_REPLICA == 'ro' else DB_READ_REPLICA
+    replica_options = {
+        key: value for key, value in DATABASES['default'].get('OPTIONS', {}).items() if key != 'transaction_mode'
+    }
+    if 'init_command' in replica_options:
+        # Соединение только на чтение не может менять режим журнала
+        replica_options['init_command'] = ';'.join(
+            f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items() if name != 'journal_mode'
+        )
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': replica_name,
+        'OPTIONS': replica_options,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['shop.routers.ReadReplicaRouter']
+
+# Маршрутизация чтений каталога: алиас реплики и сколько секунд после записи клиент читает с основной БД
+DB_ROUTING = {
+    'READ_ALIAS': 'replica' if DB_READ_REPLICA else None,
+    'STICKY_SECONDS': 10,
+    'STICKY_COOKIE': 'db_pinned',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -132,6 +191,113 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Metrics: каждый воркер пишет в свой mmap-файл в этом каталоге
+METRICS_DIR = os.environ.get('METRICS_DIR', BASE_DIR / 'var' / 'metrics')
+
+# OpenAPI: схема собирается один раз на версию кода (manage.py build_openapi_schema)
+OPENAPI_SCHEMA_DIR = BASE_DIR / 'var' / 'openapi'
+CODE_VERSION = os.environ.get('CODE_VERSION', '')
+
+# Кэш детальных ответов по slug: LRU процесса (LOCAL_TTL сек) поверх общего кэша Django
+DETAIL_CACHE = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 5,
+    'TTL': 300,
+}
+
+# Популярность продуктов: счетчик в памяти процесса, фоновый сброс в БД раз в FLUSH_INTERVAL сек (0 — только вручную)
+POPULARITY = {
+    'HALF_LIFE_HOURS': 168,
+    'FLUSH_INTERVAL': 30,
+    'TOP_K': 1000,
+    'VIEW_WEIGHT': 1,
+    'CART_WEIGHT': 5,
+}
+
+# Резервы остатков под корзины: срок жизни (сек) и размер порции для release_expired_reservations
+STOCK = {
+    'RESERVATION_TTL': 900,
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+# Outbox изменений каталога: обработчики (dotted path, вызываются порцией событий), размер порции
+# и срок аренды доставки (сек): порции доставляет только один процесс
+OUTBOX = {
+    'HANDLERS': ['shop.outbox.invalidate_detail_cache', 'shop.sync.record_catalog_changes'],
+    'BATCH_SIZE': 500,
+    'LEASE_TIMEOUT': 60,
+}
+
+# Очередь фоновых задач в БД: размер пула run_workers, режим (thread/process), таймаут видимости (сек)
+JOBS = {
+    'WORKERS': 2,
+    'MODE': 'thread',
+    'VISIBILITY_TIMEOUT': 300,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF': 10,
+}
+
+# Подсказки при вводе: размер ответа по умолчанию и предельный, период обновления из журнала
+# изменений и перечитывания рейтингов (сек), размер диапазона префикса, ответ для которого запоминается
+SUGGEST = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'REFRESH_INTERVAL': 5,
+    'SCORES_INTERVAL': 300,
+    'SCAN_LIMIT': 500,
+}
+
+# Профилирование запросов: каталог профилей, триггер для сотрудников (заголовок или параметр),
+# выборка 1 из SAMPLE_RATE запросов (0 — выключена), период сэмплов стека (сек), срок хранения (дней)
+PROFILING = {
+    'DIR': os.environ.get('PROFILES_DIR', BASE_DIR / 'var' / 'profiles'),
+    'HEADER': 'X-Profile',
+    'QUERY_PARAM': 'profile',
+    'SAMPLE_RATE': int(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    'SAMPLE_INTERVAL': 0.001,
+    'KEEP_DAYS': 7,
+}
+
+# Поток изменений корзин (SSE): доставка между воркерами (shop.events.LocalFanout — только свой процесс,
+# shop.events.UnixSocketFanout — все процессы хоста), период heartbeat (сек), очередь подписчика
+EVENTS = {
+    'FANOUT': 'shop.events.LocalFanout',
+    'SOCKET_DIR': None,
+    'HEARTBEAT': 15,
+    'MAX_QUEUE': 100,
+}
+
+# Групповая фиксация изменений корзин одним потоком-писателем (CART_GROUP_COMMIT=1):
+# ожидание порции (сек), размер порции и очереди, предельное ожидание результата запросом (сек)
+CART_WRITER = {
+    'ENABLED': os.environ.get('CART_GROUP_COMMIT') == '1',
+    'MAX_BATCH': 64,
+    'MAX_WAIT': 0.002,
+    'MAX_QUEUE': 1024,
+    'TIMEOUT': 5.0,
+}
+
+# Пакетная загрузка связей в рамках запроса (shop/loaders.py): включена ли, предельный размер порции
+# и списка значений в одном запросе IN
+RELATION_LOADER = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+}
+
+# Прогрев воркера при старте (WARMUP=0 — выключить): базовый адрес для абсолютных URL в кэше,
+# пути для внутренних GET-запросов, заполнять ли кэш (WARMUP_FILL_CACHES=1, удлиняет старт)
+# и сколько популярных продуктов и категорий в него положить
+WARMUP = {
+    'ENABLED': os.environ.get('WARMUP', '1') != '0',
+    'BASE_URL': os.environ.get('WARMUP_BASE_URL', 'http://localhost'),
+    'PATHS': ['/api/v1/products/', '/api/v1/categories/'],
+    'FILL_CACHES': os.environ.get('WARMUP_FILL_CACHES') == '1',
+    'PRODUCTS': 100,
+    'CATEGORIES': 50,
+}
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -148,6 +314,15 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'shop.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
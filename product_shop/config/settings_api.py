@@ -0,0 +1,41 @@
+"""
+Профиль только для API (/api/v1/, /metrics): DJANGO_SETTINGS_MODULE=config.settings_api.
+
+API без состояния и с JWT, поэтому воркеру не нужны админка, сессии,
+сообщения, CSRF, статика и генерация схемы OpenAPI: они не устанавливаются
+и не импортируются при старте. Админка и документация API обслуживаются
+отдельными воркерами с config.settings.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'rest_framework_simplejwt',
+    'corsheaders',
+    'shop',
+]
+
+# Тот же порядок, что в config.settings, без middleware браузерных сессий и форм
+MIDDLEWARE = [
+    name for name in MIDDLEWARE  # noqa: F405
+    if name not in {
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    }
+]
+
+ROOT_URLCONF = 'config.urls_api'
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    # Схема по умолчанию DRF вместо drf_spectacular
+    **{key: value for key, value in REST_FRAMEWORK.items() if key != 'DEFAULT_SCHEMA_CLASS'},  # noqa: F405
+    # Только JSON: браузерный рендерер тянет шаблоны и формы
+    'DEFAULT_RENDERER_CLASSES': ['shop.renderers.FastJSONRenderer'],
+}
@@ -0,0 +1,10 @@
+"""
+URL только для API-воркеров (config.settings_api): без админки и документации.
+"""
+from django.urls import path, include
+from shop.views import metrics_view
+
+urlpatterns = [
+    path('api/v1/', include('shop.urls')),
+    path('metrics', metrics_view, name='metrics'),
+]
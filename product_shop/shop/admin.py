@@ -1,14 +1,16 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group, User
-from .models import Category, SubCategory, Product, ProductImage, Cart, CartItem
+from .models import Category, SubCategory, Product, ProductImage, Cart, CartItem, Order, OrderLine, Job
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'created_at']
+    list_display = ['name', 'parent', 'depth', 'slug', 'created_at']
+    list_select_related = ['parent']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
-    list_filter = ['created_at']
+    list_filter = ['depth', 'created_at']
+    ordering = ['path']
 
 
 @admin.register(SubCategory)
@@ -26,7 +28,7 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'subcategory', 'price', 'is_available', 'created_at']
+    list_display = ['name', 'subcategory', 'price', 'stock', 'is_available', 'created_at']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'description']
     list_filter = ['is_available', 'subcategory__category', 'subcategory', 'created_at']
@@ -65,6 +67,28 @@ class CartItemAdmin(admin.ModelAdmin):
         return f"{obj.total_price:.2f} руб."
     total_price.short_description = 'Общая стоимость'
 
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    readonly_fields = ['product', 'name', 'price', 'quantity']
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'total_price', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['user', 'total_price']
+    inlines = [OrderLineInline]
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'status', 'priority', 'attempts', 'run_after', 'finished_at']
+    list_filter = ['status', 'task']
+    readonly_fields = ['locked_by', 'locked_until', 'last_error', 'finished_at']
+
 # Скрыть раздел Groups из админки
 from django.contrib.admin.sites import NotRegistered
 try:
@@ -86,7 +110,3 @@ class CustomUserAdmin(BaseUserAdmin):
 # Перерегистрируем модель User с русским названием
 admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
-
-# Изменяем verbose_name для User в админке
-User._meta.verbose_name = "Пользователь"
-User._meta.verbose_name_plural = "Пользователи"
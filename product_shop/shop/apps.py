@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from . import loaders, signals  # noqa: F401
+
+        loaders.install()
+
+        # Не при импорте shop/admin.py: в профиле settings_api админка не загружается
+        User._meta.verbose_name = 'Пользователь'
+        User._meta.verbose_name_plural = 'Пользователи'
@@ -0,0 +1,437 @@
+"""
+Нагрузочные сценарии для ``manage.py run_benchmark``.
+
+Сценарий — функция, которая по контексту и генератору случайных чисел
+возвращает следующий запрос. Запросы выполняются с фиксированной
+конкурентностью через тестовый клиент Django (в том же процессе, с подсчетом
+SQL-запросов) или по HTTP к уже запущенному серверу.
+
+Микробенчмарки (``MICROBENCHMARKS``) измеряют отдельные компоненты без HTTP.
+"""
+import io
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connections
+from django.test import Client
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .compression import available_encodings, compress
+from .middleware import QueryCounter
+from .models import Category, Product
+from .renderers import FastJSONParser, FastJSONRenderer
+from .stock import take
+
+BenchRequest = namedtuple('BenchRequest', 'method path data auth')
+
+
+class BenchmarkContext:
+    """Данные, по которым сценарии выбирают запросы"""
+
+    def __init__(self, user_prefix='bench_user_', slug_prefix='bench-'):
+        products = Product.objects.filter(slug__startswith=slug_prefix)
+        if not products.exists():
+            products = Product.objects.all()
+        self.product_slugs = list(products.values_list('slug', flat=True))
+        self.product_ids = list(products.values_list('id', flat=True))
+        self.category_slugs = list(Category.objects.values_list('slug', flat=True))
+        self.usernames = list(
+            User.objects.filter(username__startswith=user_prefix).values_list('username', flat=True)
+        )
+        page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or 20
+        self.product_pages = max(1, -(-Product.objects.count() // page_size))
+        self.password = 'bench-pass'
+
+
+def _product_list(ctx, rng):
+    return BenchRequest('GET', f'/api/v1/products/?page={rng.randint(1, ctx.product_pages)}', None, False)
+
+
+def _product_detail(ctx, rng):
+    return BenchRequest('GET', f'/api/v1/products/{rng.choice(ctx.product_slugs)}/', None, False)
+
+
+def _category_list(ctx, rng):
+    return BenchRequest('GET', '/api/v1/categories/', None, False)
+
+
+def _category_detail(ctx, rng):
+    return BenchRequest('GET', f'/api/v1/categories/{rng.choice(ctx.category_slugs)}/', None, False)
+
+
+def _cart(ctx, rng):
+    return BenchRequest('GET', '/api/v1/cart/', None, True)
+
+
+def _cart_add(ctx, rng):
+    data = {'product_id': rng.choice(ctx.product_ids), 'quantity': 1}
+    return BenchRequest('POST', '/api/v1/cart/items/', data, True)
+
+
+def _auth(ctx, rng):
+    data = {'username': rng.choice(ctx.usernames), 'password': ctx.password}
+    return BenchRequest('POST', '/api/v1/auth/token/', data, False)
+
+
+# Доля записей в смешанной нагрузке
+MIXED_WRITE_SHARE = 0.2
+
+
+def _mixed(ctx, rng):
+    """Чтение каталога вперемешку с добавлениями в корзину"""
+    if rng.random() < MIXED_WRITE_SHARE:
+        return _cart_add(ctx, rng)
+    return rng.choice([_product_list, _product_detail, _category_detail])(ctx, rng)
+
+
+SCENARIOS = {
+    'product-list': _product_list,
+    'product-detail': _product_detail,
+    'category-list': _category_list,
+    'category-detail': _category_detail,
+    'cart': _cart,
+    'cart-add': _cart_add,
+    'auth': _auth,
+    'mixed': _mixed,
+}
+
+
+class ClientTransport:
+    """Запросы через тестовый клиент Django в текущем процессе"""
+
+    counts_queries = True
+
+    def __init__(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host and '*' not in host]
+        host = hosts[0].lstrip('.') if hosts else 'localhost'
+        # Ошибки сервера считаются в errors, а не обрывают поток бенчмарка
+        self.client = Client(SERVER_NAME=host, raise_request_exception=False)
+        self.tokens = {}
+
+    def _token(self, username):
+        if username not in self.tokens:
+            user = User.objects.get(username=username)
+            self.tokens[username] = str(RefreshToken.for_user(user).access_token)
+        return self.tokens[username]
+
+    def send(self, request, username):
+        headers = {}
+        if request.auth:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {self._token(username)}'
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            if request.method == 'GET':
+                response = self.client.get(request.path, **headers)
+            else:
+                response = self.client.generic(
+                    request.method, request.path, json.dumps(request.data),
+                    content_type='application/json', **headers
+                )
+        return response.status_code, counter.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    """Запросы по HTTP к запущенному серверу"""
+
+    counts_queries = False
+
+    def __init__(self, base_url, password):
+        self.base_url = base_url.rstrip('/')
+        self.password = password
+        self.tokens = {}
+
+    def _request(self, method, path, data=None, headers=None):
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        req.add_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            req.add_header(name, value)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+
+    def _token(self, username):
+        if username not in self.tokens:
+            status, body = self._request(
+                'POST', '/api/v1/auth/token/', {'username': username, 'password': self.password}
+            )
+            self.tokens[username] = json.loads(body)['access']
+        return self.tokens[username]
+
+    def send(self, request, username):
+        headers = {}
+        if request.auth:
+            headers['Authorization'] = f'Bearer {self._token(username)}'
+        status, body = self._request(request.method, request.path, request.data, headers)
+        return status, None
+
+    def close(self):
+        pass
+
+
+def percentile(sorted_samples, p):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_samples:
+        return None
+    rank = max(1, -(-len(sorted_samples) * p // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def summarize(latencies, wall_time, queries, errors, concurrency):
+    """Сводка по прогону сценария"""
+    latencies = sorted(latencies)
+    total = len(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput_rps': round(total / wall_time, 2) if wall_time else None,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / total) if total else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if total else None,
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def run_scenario(scenario, ctx, transport_factory, requests=500, concurrency=8, warmup=20, seed=42):
+    """Выполнить сценарий с фиксированной конкурентностью"""
+    make_request = SCENARIOS[scenario]
+    lock = threading.Lock()
+    remaining = [requests]
+    latencies, queries = [], []
+    errors = [0]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        transport = transport_factory()
+        try:
+            for _ in range(warmup // concurrency):
+                transport.send(make_request(ctx, rng), rng.choice(ctx.usernames or [None]))
+        except Exception:
+            barrier.abort()
+            transport.close()
+            raise
+        barrier.wait()
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                request = make_request(ctx, rng)
+                username = rng.choice(ctx.usernames or [None])
+                start = time.perf_counter()
+                status, query_count = transport.send(request, username)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if query_count is not None:
+                        queries.append(query_count)
+                    if status >= 400:
+                        errors[0] += 1
+        finally:
+            transport.close()
+
+    barrier = threading.Barrier(concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    return summarize(latencies, wall_time, queries, errors[0], concurrency)
+
+
+def environment_info():
+    """Метаданные прогона для сравнения между коммитами"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    database = settings.DATABASES['default']
+    info = {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'database': database['ENGINE'],
+        'db_profile': settings.DB_PROFILE,
+        'conn_max_age': database.get('CONN_MAX_AGE', 0),
+    }
+    if connections['default'].vendor == 'sqlite':
+        with connections['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            info['journal_mode'] = cursor.fetchone()[0]
+    return info
+
+
+def _timed(func, repeat):
+    """Минимальное время выполнения в миллисекундах"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3)
+
+
+def _product_page(size):
+    """Страница списка продуктов в форме ответа ProductSerializer"""
+    created_at = datetime(2024, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    image = 'http://localhost:8000/media/products/{}/a924623775e4974eec8367db7989bafa.jpg'
+    return {
+        'count': size,
+        'next': 'http://localhost:8000/api/v1/products/?page=2',
+        'previous': None,
+        'results': [
+            {
+                'id': i,
+                'name': f'Продукт {i}',
+                'slug': f'product-{i}',
+                'category': 'Овощи',
+                'subcategory': 'Корнеплоды',
+                'price': f'{i % 1000}.99',
+                'total_price': Decimal(i) / 100,
+                'description': 'Свежий продукт с фермы, доставка в день заказа. ' * 3,
+                'images': [
+                    {size_name: image.format(size_name) for size_name in ('small', 'medium', 'large')}
+                    for _ in range(2)
+                ],
+                'is_available': True,
+                'created_at': created_at,
+            }
+            for i in range(size)
+        ],
+    }
+
+
+def render_microbenchmark(size=1000, repeat=20):
+    """Рендеринг, парсинг и сжатие большой страницы списка продуктов"""
+    data = _product_page(size)
+    standard, fast = JSONRenderer(), FastJSONRenderer()
+    body = standard.render(data)
+    result = {
+        'products': size,
+        'body_bytes': len(body),
+        'identical_output': fast.render(data) == body,
+        'render_ms': {
+            'json': _timed(lambda: standard.render(data), repeat),
+            'fast': _timed(lambda: fast.render(data), repeat),
+        },
+        'parse_ms': {
+            'json': _timed(lambda: JSONParser().parse(io.BytesIO(body)), repeat),
+            'fast': _timed(lambda: FastJSONParser().parse(io.BytesIO(body)), repeat),
+        },
+        'compression': {},
+    }
+    for encoding in available_encodings():
+        for static in (False, True):
+            compressed = compress(body, encoding, static=static)
+            name = f'{encoding}-precompressed' if static else encoding
+            result['compression'][name] = {
+                'ms': _timed(lambda: compress(body, encoding, static=static), max(1, repeat // 4)),
+                'bytes': len(compressed),
+                'ratio': round(len(body) / len(compressed), 2),
+            }
+    return result
+
+
+def _read_modify_write_take(product_id, quantity):
+    """Проверка и списание отдельными запросами — для сравнения с take()"""
+    current = Product.objects.filter(pk=product_id).values_list('stock', flat=True).get()
+    if current < quantity:
+        return False
+    Product.objects.without_outbox().filter(pk=product_id).update(stock=current - quantity)
+    return True
+
+
+def stock_contention_microbenchmark(threads=16, attempts=50, stock=200):
+    """
+    Параллельные резервы одного «горячего» продукта.
+
+    threads * attempts попыток по одной единице при остатке stock: успешных
+    резервов должно быть ровно stock, а списано — ровно столько же.
+    """
+    ctx = BenchmarkContext()
+    if not ctx.product_ids:
+        return {'error': 'Нет продуктов: выполните seed_benchmark'}
+    product_id = ctx.product_ids[0]
+    original = Product.objects.filter(pk=product_id).values_list('stock', flat=True).get()
+    strategies = {'conditional-update': take, 'read-modify-write': _read_modify_write_take}
+    result = {'threads': threads, 'attempts': threads * attempts, 'stock': stock}
+    try:
+        for name, func in strategies.items():
+            Product.objects.without_outbox().filter(pk=product_id).update(stock=stock)
+            counts = {'reserved': 0, 'rejected': 0, 'errors': 0}
+            lock = threading.Lock()
+            barrier = threading.Barrier(threads + 1)
+
+            def worker():
+                try:
+                    barrier.wait()
+                    for _ in range(attempts):
+                        try:
+                            outcome = 'reserved' if func(product_id, 1) else 'rejected'
+                        except DatabaseError:
+                            outcome = 'errors'
+                        with lock:
+                            counts[outcome] += 1
+                finally:
+                    connections.close_all()
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for thread in workers:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            final = Product.objects.filter(pk=product_id).values_list('stock', flat=True).get()
+            result[name] = {
+                **counts,
+                'ms': round(elapsed * 1000, 3),
+                'throughput_ops': round(threads * attempts / elapsed, 1),
+                'final_stock': final,
+                'oversold': max(0, counts['reserved'] - stock),
+                'lost_updates': counts['reserved'] - (stock - final),
+            }
+    finally:
+        Product.objects.without_outbox().filter(pk=product_id).update(stock=original)
+    return result
+
+
+MICROBENCHMARKS = {
+    'render': render_microbenchmark,
+    'stock-contention': stock_contention_microbenchmark,
+}
@@ -0,0 +1,153 @@
+"""
+Двухуровневый кэш детальных ответов по slug.
+
+Запись хранит данные сериализатора, готовое JSON-тело и его заранее сжатые
+варианты: попадание для JSON-клиента не рендерит и не сжимает ответ
+заново (см. ``DetailEntry.response``). Первый уровень — ограниченный LRU в памяти процесса с коротким TTL
+(он ограничивает устаревание в других воркерах после инвалидации),
+второй — общий кэш Django. Инвалидация выполняется сигналами при
+сохранении и удалении объектов (см. ``shop/signals.py``) — сразу и
+повторно после коммита. Промах заполняется чтением с основной БД: реплика
+может отставать от инвалидации, и устаревшая строка попала бы в кэш на TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import metrics, routers
+from .compression import MIN_LENGTH, precompress
+from .renderers import FastJSONRenderer
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 1024,
+    'LOCAL_TTL': 5,
+    'TTL': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DETAIL_CACHE', {})}
+
+
+class DetailEntry:
+    """Закэшированный ответ: данные, компактное JSON-тело и его сжатые варианты"""
+
+    __slots__ = ('data', 'body', 'precompressed')
+
+    def __init__(self, data):
+        self.data = data
+        self.body = FastJSONRenderer().render(data)
+        # Короткие тела middleware не сжимает
+        self.precompressed = precompress(self.body) if len(self.body) >= MIN_LENGTH else None
+
+    def __getstate__(self):
+        return (self.data, self.body, self.precompressed)
+
+    def __setstate__(self, state):
+        self.data, self.body, self.precompressed = state
+
+    def response(self, request):
+        """Готовое тело для компактного JSON; для остальных форматов (browsable API, indent) — Response"""
+        renderer = getattr(request, 'accepted_renderer', None)
+        if isinstance(renderer, JSONRenderer) and renderer.get_indent(request.accepted_media_type, {}) is None:
+            response = HttpResponse(self.body, content_type=renderer.media_type)
+            response.precompressed = self.precompressed
+            return response
+        return Response(self.data)
+
+
+class DetailCache:
+    """Кэш детальных ответов одного типа объектов"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+
+    def _key(self, slug):
+        return f'detail:{self.namespace}:{slug}'
+
+    def _get_local(self, slug, base_url):
+        with self.lock:
+            entry = self.local.get(slug)
+            if entry is None:
+                return None
+            expires_at, entry_base_url, detail = entry
+            if expires_at < time.monotonic() or entry_base_url != base_url:
+                del self.local[slug]
+                return None
+            self.local.move_to_end(slug)
+            return detail
+
+    def _set_local(self, slug, base_url, detail, config):
+        with self.lock:
+            self.local[slug] = (time.monotonic() + config['LOCAL_TTL'], base_url, detail)
+            self.local.move_to_end(slug)
+            while len(self.local) > config['MAX_ENTRIES']:
+                self.local.popitem(last=False)
+
+    def get_or_set(self, slug, request, loader):
+        """
+        Вернуть DetailEntry из кэша или построить его из данных loader().
+
+        В данных могут быть абсолютные URL, поэтому запись привязана к базовому
+        адресу запроса; для другого хоста она считается промахом.
+        """
+        config = get_config()
+        base_url = request.build_absolute_uri('/')
+
+        detail = self._get_local(slug, base_url)
+        if detail is not None:
+            metrics.cache_access(f'{self.namespace}_detail_local', True)
+            return detail
+        metrics.cache_access(f'{self.namespace}_detail_local', False)
+
+        shared = caches[config['ALIAS']]
+        entry = shared.get(self._key(slug))
+        if entry is not None and entry[0] == base_url:
+            metrics.cache_access(f'{self.namespace}_detail_shared', True)
+            detail = entry[1]
+        else:
+            metrics.cache_access(f'{self.namespace}_detail_shared', False)
+            with routers.primary():
+                detail = DetailEntry(loader())
+            shared.set(self._key(slug), (base_url, detail), config['TTL'])
+        self._set_local(slug, base_url, detail, config)
+        return detail
+
+    def invalidate(self, *slugs):
+        """Удалить записи на обоих уровнях"""
+        slugs = [slug for slug in slugs if slug]
+        if not slugs:
+            return
+        with self.lock:
+            for slug in slugs:
+                self.local.pop(slug, None)
+        caches[get_config()['ALIAS']].delete_many([self._key(slug) for slug in slugs])
+
+    def invalidate_on_commit(self, *slugs, using=None):
+        """
+        Удалить записи сейчас и еще раз после коммита транзакции.
+
+        Между сбросом и коммитом параллельный читатель может положить в кэш
+        строку до изменения; повторный сброс после коммита ее убирает, иначе
+        она отдавалась бы весь TTL.
+        """
+        self.invalidate(*slugs)
+        transaction.on_commit(lambda: self.invalidate(*slugs), using=using)
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+
+product_cache = DetailCache('product')
+category_cache = DetailCache('category')
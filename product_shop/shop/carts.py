@@ -0,0 +1,229 @@
+"""
+Изменения корзины и их групповая фиксация.
+
+SQLite допускает одного писателя: при всплеске изменений корзин запросы
+по очереди ждут блокировку БД, и каждый делает свой COMMIT. С
+``CART_WRITER['ENABLED']`` изменения передаются одному потоку-писателю
+процесса. Он забирает из очереди все, что накопилось, ждет новые изменения
+не дольше ``MAX_WAIT`` секунд (не больше ``MAX_BATCH`` в порции) и выполняет
+порцию в одной транзакции, каждое изменение — в своей точке сохранения:
+ошибка одного изменения откатывает только его. Результат возвращается
+запросу через future после COMMIT.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from . import metrics, stock
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_BATCH': 64,
+    'MAX_WAIT': 0.002,
+    'MAX_QUEUE': 1024,
+    'TIMEOUT': 5.0,
+}
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+Mutation = namedtuple('Mutation', 'fn args kwargs future')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CART_WRITER', {})}
+
+
+class Overloaded(APIException):
+    status_code = 503
+    default_detail = 'Запись корзин перегружена, повторите запрос позже'
+    default_code = 'cart_writer_overloaded'
+
+
+def get_cart(user, touch=False):
+    """
+    Корзина пользователя; с touch=True для последующей записи.
+
+    get_or_create не меняет updated_at, и purge_carts мог бы удалить старую
+    пустую корзину между чтением и вставкой позиции. Поэтому перед записью
+    updated_at обновляется; если корзину уже удалили, она создается заново.
+    """
+    while True:
+        cart, created = Cart.objects.get_or_create(user=user)
+        if created or not touch:
+            return cart
+        cart.updated_at = timezone.now()
+        if Cart.objects.filter(pk=cart.pk).update(updated_at=cart.updated_at):
+            return cart
+
+
+def add_item(cart, product, quantity):
+    """Добавить quantity единиц продукта в корзину и продлить резерв"""
+    cart_item, created = CartItem.objects.get_or_create(
+        cart=cart, product=product, defaults={'quantity': quantity}
+    )
+    if not created:
+        cart_item.quantity += quantity
+        cart_item.save()
+    stock.hold(cart_item, cart_item.quantity)
+    return cart_item
+
+
+def set_quantity(cart_item, quantity):
+    """Изменить количество позиции и резерв под нее"""
+    stock.hold(cart_item, quantity)
+    cart_item.quantity = quantity
+    cart_item.save()
+    return cart_item
+
+
+def remove_item(cart_item):
+    """Удалить позицию; резерв возвращает сигнал post_delete"""
+    cart_item.delete()
+    return cart_item
+
+
+class GroupCommitWriter:
+    """Поток-писатель, выполняющий изменения порциями в одной транзакции"""
+
+    def __init__(self, max_batch=DEFAULTS['MAX_BATCH'], max_wait=DEFAULTS['MAX_WAIT'],
+                 max_queue=DEFAULTS['MAX_QUEUE']):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._reset()
+        # Поток родителя не переживает fork: дочерний процесс запустит свой
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.queue = queue.Queue(maxsize=self.max_queue)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """Поставить изменение в очередь; вернуть future с его результатом"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='cart-writer', daemon=True)
+                self.thread.start()
+        future = Future()
+        try:
+            self.queue.put(Mutation(fn, args, kwargs, future), timeout=timeout)
+        except queue.Full:
+            metrics.inc('shop_cart_writer_rejected_total', reason='queue_full')
+            raise Overloaded()
+        return future
+
+    def close(self):
+        """Дописать очередь и остановить поток"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                # Накопившееся за время прошлого COMMIT забирается без ожидания
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                stopped = batch[-1] is None
+                if stopped:
+                    batch.pop()
+                if batch:
+                    close_old_connections()
+                    try:
+                        self.commit(batch)
+                    except Exception:
+                        logger.exception('Ошибка писателя корзин')
+                if stopped:
+                    break
+        finally:
+            connections.close_all()
+
+    def commit(self, batch):
+        """Выполнить порцию изменений в одной транзакции и разослать результаты"""
+        batch = [mutation for mutation in batch if mutation.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            with transaction.atomic():
+                for mutation in batch:
+                    try:
+                        with transaction.atomic():
+                            results.append((mutation.future, mutation.fn(*mutation.args, **mutation.kwargs), None))
+                    except Exception as exc:
+                        results.append((mutation.future, None, exc))
+        except Exception as exc:
+            # COMMIT не удался — не применилось ни одно изменение порции
+            for mutation in batch:
+                mutation.future.set_exception(exc)
+            metrics.inc('shop_cart_writer_commits_total', result='error')
+            return
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+        metrics.inc('shop_cart_writer_commits_total', result='ok')
+        metrics.observe('shop_cart_writer_batch_size', len(batch), BATCH_BUCKETS)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            config = get_config()
+            _writer = GroupCommitWriter(config['MAX_BATCH'], config['MAX_WAIT'], config['MAX_QUEUE'])
+        return _writer
+
+
+def run(fn, *args, **kwargs):
+    """
+    Выполнить изменение корзины.
+
+    Без писателя или внутри уже открытой транзакции вызывающего (изменение
+    должно попасть в нее же) — сразу в текущем потоке. Иначе ждет результат
+    писателя не дольше ``TIMEOUT``; если изменение за это время не начало
+    выполняться, оно отменяется с ошибкой 503.
+    """
+    config = get_config()
+    if not config['ENABLED'] or connection.in_atomic_block:
+        with transaction.atomic():
+            return fn(*args, **kwargs)
+    future = get_writer().submit(fn, *args, timeout=config['TIMEOUT'], **kwargs)
+    try:
+        return future.result(timeout=config['TIMEOUT'])
+    except FutureTimeout:
+        if future.cancel():
+            metrics.inc('shop_cart_writer_rejected_total', reason='timeout')
+            raise Overloaded()
+        # Уже выполняется: результат будет после ближайшего COMMIT
+        return future.result()
@@ -0,0 +1,101 @@
+"""
+Сжатие ответов: gzip всегда, brotli и zstd — если установлены пакеты
+``brotli`` и ``zstandard``.
+
+Кодировка выбирается по заголовку Accept-Encoding каждого запроса.
+Закэшированные ответы могут хранить заранее сжатые тела (``precompress``),
+тогда middleware отдает их без повторного сжатия.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Типы, которые имеет смысл сжимать: изображения, архивы и видео уже сжаты
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/vnd.oai.openapi',
+    'image/svg+xml',
+}
+
+# Более короткие тела не сжимаются: выигрыш меньше заголовков
+MIN_LENGTH = 200
+
+# Уровни для сжатия на лету и для заранее сжатых тел
+DYNAMIC_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'zstd': 19, 'gzip': 9}
+
+
+def is_compressible(content_type):
+    """Сжимаемый ли ответ с таким Content-Type"""
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    return (
+        media_type.startswith('text/')
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(('+json', '+xml'))
+    )
+
+
+def available_encodings():
+    """Доступные кодировки в порядке предпочтения сервера"""
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def parse_accept_encoding(header):
+    """Разобрать Accept-Encoding в словарь кодировка -> q"""
+    accepted = {}
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def negotiate(header, encodings=None):
+    """Выбрать лучшую кодировку для клиента или None"""
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in encodings or available_encodings():
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding, static=False):
+    """Сжать тело ответа"""
+    level = (STATIC_LEVELS if static else DYNAMIC_LEVELS)[encoding]
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def precompress(body):
+    """Сжать тело во всех доступных кодировках (для кэшируемых ответов)"""
+    return {encoding: compress(body, encoding, static=True) for encoding in available_encodings()}
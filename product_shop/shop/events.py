@@ -0,0 +1,232 @@
+"""
+Публикация изменений корзин подписчикам Server-Sent Events.
+
+``hub`` — pub/sub одного процесса: подписчик (открытый SSE-поток) получает
+сообщения своего канала через ``asyncio.Queue`` в цикле событий ASGI,
+публиковать можно из любого потока. Сообщение доставляется подписчикам
+всех воркеров через ``EVENTS['FANOUT']``: ``LocalFanout`` — только в своем
+процессе, ``UnixSocketFanout`` — всем процессам хоста через датаграммные
+сокеты в ``EVENTS['SOCKET_DIR']``; процесс начинает слушать свой сокет при
+первой подписке. Если очередь медленного подписчика переполнена,
+сообщения отбрасываются, а клиент получает событие ``resync`` и
+перечитывает корзину целиком.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FANOUT': 'shop.events.LocalFanout',
+    'SOCKET_DIR': None,
+    'HEARTBEAT': 15,
+    'MAX_QUEUE': 100,
+}
+
+# Предельный размер датаграммы с сообщением
+MAX_DATAGRAM = 64 * 1024
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'EVENTS', {})}
+
+
+def cart_channel(cart_id):
+    return f'cart:{cart_id}'
+
+
+class Subscription:
+    """Очередь сообщений одного подписчика"""
+
+    def __init__(self, hub, channel, max_queue):
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_queue)
+        self.overflow = False
+
+    def _put(self, message):
+        # Выполняется в цикле событий подписчика
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflow = True
+            metrics.inc('shop_events_dropped_total')
+
+    async def get(self, timeout=None):
+        """Следующее сообщение или None по таймауту; после переполнения — событие resync"""
+        if self.overflow:
+            self.overflow = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return {'event': 'resync'}
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """Подписчики каналов в текущем процессе"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def subscribe(self, channel, max_queue=None):
+        """Подписаться из корутины на сообщения канала"""
+        # Сообщения других процессов придут, только если сокет процесса уже слушает
+        get_fanout()
+        subscription = Subscription(self, channel, max_queue or get_config()['MAX_QUEUE'])
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        metrics.set_gauge('shop_events_subscribers', self.count())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.channels.pop(subscription.channel, None)
+        metrics.set_gauge('shop_events_subscribers', self.count())
+
+    def count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.channels.values())
+
+    def deliver(self, channel, message):
+        """Передать сообщение подписчикам канала в этом процессе (из любого потока)"""
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, message)
+            except RuntimeError:
+                # Цикл событий подписчика уже закрыт
+                self.unsubscribe(subscription)
+        return len(subscribers)
+
+
+class LocalFanout:
+    """Доставка только подписчикам своего процесса"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, message):
+        self.hub.deliver(channel, message)
+
+
+class UnixSocketFanout:
+    """
+    Доставка подписчикам всех процессов хоста.
+
+    Каждый процесс слушает датаграммный сокет ``<SOCKET_DIR>/<pid>-<id>.sock``;
+    публикация рассылает сообщение во все сокеты каталога, не блокируясь:
+    если буфер получателя полон, сообщение для него отбрасывается. Сокеты
+    завершившихся процессов удаляются.
+    """
+
+    def __init__(self, hub, directory=None):
+        self.hub = hub
+        self.directory = Path(
+            directory or get_config()['SOCKET_DIR'] or Path(tempfile.gettempdir()) / 'product_shop_events'
+        )
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Публикация идет из потока запроса: зависший получатель не должен его задерживать
+        self.sender.setblocking(False)
+        self.lock = threading.Lock()
+        self._listen()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Сокет родителя остается за ним: у процесса свой сокет и поток чтения
+        self.receiver.close()
+        self._listen()
+
+    def _listen(self):
+        self.path = self.directory / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock'
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(str(self.path))
+        threading.Thread(target=self._receive, args=(self.receiver,), name='events-fanout', daemon=True).start()
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                data = receiver.recv(MAX_DATAGRAM)
+            except OSError:
+                return
+            try:
+                channel, message = json.loads(data)
+            except ValueError:
+                continue
+            self.hub.deliver(channel, message)
+
+    def publish(self, channel, message):
+        data = json.dumps([channel, message]).encode()
+        for path in self.directory.glob('*.sock'):
+            try:
+                with self.lock:
+                    self.sender.sendto(data, str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Процесс завершился, не удалив сокет
+                path.unlink(missing_ok=True)
+            except BlockingIOError:
+                metrics.inc('shop_events_fanout_dropped_total')
+            except OSError:
+                logger.warning('Не удалось отправить событие в %s', path)
+
+    def close(self):
+        self.receiver.close()
+        self.path.unlink(missing_ok=True)
+
+
+hub = Hub()
+_fanout = None
+_fanout_lock = threading.Lock()
+
+
+def get_fanout():
+    global _fanout
+    with _fanout_lock:
+        if _fanout is None:
+            _fanout = import_string(get_config()['FANOUT'])(hub)
+        return _fanout
+
+
+def publish(channel, message):
+    """Опубликовать сообщение для подписчиков канала во всех воркерах"""
+    try:
+        get_fanout().publish(channel, message)
+    except Exception:
+        # Вызывается после коммита: ошибка доставки не должна ломать запрос
+        logger.exception('Не удалось опубликовать событие %s', channel)
+        return
+    metrics.inc('shop_events_published_total')
+
+
+def format_event(message, event_id=None):
+    """Сообщение в формате text/event-stream"""
+    message = dict(message)
+    lines = [f'event: {message.pop("event", "message")}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(message, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,165 @@
+"""
+Очередь фоновых задач в основной БД, без внешнего брокера.
+
+Задача — вызываемый объект по dotted path с именованными аргументами
+(JSON). Воркер забирает задачу условным ``UPDATE ... WHERE status = ...``:
+если его выиграл другой воркер, обновится ноль строк и берется следующий
+кандидат. Взятая задача видна другим воркерам снова по истечении
+``VISIBILITY_TIMEOUT`` (например, если процесс воркера упал), если у нее
+остались попытки; иначе она помечается как ``failed``. Ошибка задачи
+приводит к повтору с экспоненциальной задержкой до ``max_attempts``.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 2,
+    'MODE': 'thread',
+    'VISIBILITY_TIMEOUT': 300,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_BACKOFF': 10,
+}
+
+# Сколько кандидатов перебрать, если их забирают параллельные воркеры
+CLAIM_ATTEMPTS = 5
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JOBS', {})}
+
+
+def enqueue(task, priority=0, delay=0, max_attempts=None, **kwargs):
+    """Поставить задачу в очередь; kwargs должны сериализоваться в JSON"""
+    import_string(task)
+    return Job.objects.create(
+        task=task,
+        kwargs=kwargs,
+        priority=priority,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or get_config()['MAX_ATTEMPTS'],
+    )
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def _ready(now):
+    """Задачи, которые можно взять: в очереди и пора, или взятые, но с истекшим сроком и попытками"""
+    return Q(status=Job.QUEUED, run_after__lte=now) | Q(
+        status=Job.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')
+    )
+
+
+def fail_expired(now=None):
+    """Пометить как failed взятые задачи с истекшим сроком и без попыток; вернуть их число"""
+    now = now or timezone.now()
+    expired = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts'))
+    # Сначала чтение: пустой UPDATE в SQLite все равно берет блокировку записи
+    if not expired.exists():
+        return 0
+    failed = expired.update(
+        status=Job.FAILED, locked_until=None, finished_at=now,
+        last_error='Срок выполнения последней попытки истек (воркер не завершил задачу)',
+    )
+    metrics.inc('shop_jobs_expired_total', failed)
+    return failed
+
+
+def claim(worker, visibility_timeout=None):
+    """Атомарно взять следующую задачу по приоритету; None, если очередь пуста"""
+    visibility_timeout = visibility_timeout or get_config()['VISIBILITY_TIMEOUT']
+    fail_expired()
+    for _ in range(CLAIM_ATTEMPTS):
+        now = timezone.now()
+        pk = Job.objects.filter(_ready(now)).order_by('-priority', 'run_after', 'pk').values_list(
+            'pk', flat=True
+        ).first()
+        if pk is None:
+            return None
+        # Уникальный токен захвата: по нему отличаем свою попытку от повторного захвата после таймаута.
+        # Случайная часть первой, чтобы обрезка длинного имени хоста ее не съела
+        token = f'{uuid.uuid4().hex[:8]}:{worker}'
+        claimed = Job.objects.filter(_ready(now), pk=pk).update(
+            status=Job.RUNNING,
+            locked_by=token[:64],
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+        metrics.inc('shop_jobs_claim_conflicts_total')
+    return None
+
+
+def _finish(job, **fields):
+    """Записать результат, только если задача все еще за этим воркером"""
+    return Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=Job.RUNNING).update(**fields)
+
+
+def execute(job):
+    """Выполнить взятую задачу и записать результат"""
+    start = time.perf_counter()
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Задача %s (%s) завершилась ошибкой, попытка %s', job.pk, job.task, job.attempts)
+        if job.attempts < job.max_attempts:
+            backoff = get_config()['RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+            _finish(
+                job, status=Job.QUEUED, locked_by='', locked_until=None, last_error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff),
+            )
+            result = 'retry'
+        else:
+            _finish(job, status=Job.FAILED, locked_until=None, last_error=error, finished_at=timezone.now())
+            result = 'failed'
+    else:
+        _finish(job, status=Job.DONE, locked_until=None, finished_at=timezone.now())
+        result = 'done'
+    metrics.inc('shop_jobs_total', task=job.task, result=result)
+    metrics.observe('shop_job_duration_seconds', time.perf_counter() - start, task=job.task)
+    return result
+
+
+def work(stop=None, burst=False, poll_interval=None, visibility_timeout=None):
+    """
+    Цикл одного воркера: брать и выполнять задачи до stop.
+
+    В режиме burst выходит, как только очередь опустела. Возвращает число
+    выполненных задач.
+    """
+    poll_interval = poll_interval or get_config()['POLL_INTERVAL']
+    stop = stop or threading.Event()
+    worker = worker_id()
+    processed = 0
+    while not stop.is_set():
+        close_old_connections()
+        job = claim(worker, visibility_timeout)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+            continue
+        execute(job)
+        processed += 1
+    return processed
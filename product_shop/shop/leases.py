@@ -0,0 +1,50 @@
+"""
+Аренда (lease) для процессов, которые должны работать в одном экземпляре.
+
+Аренда захватывается условным ``UPDATE`` строки ``Lease``: он проходит,
+только если прежняя аренда освобождена, истекла или уже принадлежит этому
+владельцу. Упавший владелец блокирует работу не дольше ``ttl`` секунд.
+"""
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Lease
+
+
+def owner_id():
+    """Уникальный владелец: случайная часть первой, чтобы ее не обрезало ограничение длины"""
+    return f'{uuid.uuid4().hex[:8]}:{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'[:64]
+
+
+def acquire(name, owner, ttl):
+    """Захватить или продлить аренду name на ttl секунд; True, если она за owner"""
+    now = timezone.now()
+    Lease.objects.get_or_create(name=name)
+    free = Q(expires_at__isnull=True) | Q(expires_at__lt=now) | Q(owner=owner)
+    return bool(
+        Lease.objects.filter(free, name=name).update(owner=owner, expires_at=now + timedelta(seconds=ttl))
+    )
+
+
+def release(name, owner):
+    """Освободить аренду, если она все еще за owner"""
+    Lease.objects.filter(name=name, owner=owner).update(owner='', expires_at=None)
+
+
+@contextmanager
+def held(name, ttl):
+    """Выполнить блок под арендой name; в блок передается True, если аренда захвачена"""
+    owner = owner_id()
+    acquired = acquire(name, owner, ttl)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            release(name, owner)
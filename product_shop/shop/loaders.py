@@ -0,0 +1,259 @@
+"""
+Пакетная загрузка связей в рамках запроса (паттерн DataLoader).
+
+Объекты, загруженные одним запросом ``LoaderQuerySet``, образуют порцию
+(до ``RELATION_LOADER['BATCH_SIZE']`` объектов). Когда сериализатор,
+``__str__`` или свойство модели впервые обращается к незагруженной связи
+одного объекта порции, связь загружается сразу для всей порции: внешний
+ключ из ``FORWARD`` — одним запросом ``IN`` по значениям ключей, обратная
+связь из ``REVERSE`` — как ``prefetch_related`` для порции. Загруженные
+связанные объекты образуют свою порцию, поэтому цепочка вроде
+``Product.category`` (подкатегория → категория) стоит по запросу на
+уровень, сколько бы продуктов ни было в ответе.
+
+Загрузка работает только внутри ``scope()``: его открывают
+``RelationLoaderMiddleware`` для каждого HTTP-запроса (API и админка) и
+выгрузка синхронизации каталога. Внутри области загруженные объекты
+запоминаются по ключу и повторно не запрашиваются; сохранение или удаление
+объекта забывает его, а массовые ``update()`` и ``bulk_update()`` — все
+запомненные объекты модели. Вне области поведение Django не меняется.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django.db.models import prefetch_related_objects
+from django.db.models.query import ModelIterable
+from django.db.models.signals import post_delete, post_save
+
+from . import metrics
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,
+}
+
+# Внешние ключи, загружаемые порциями: (модель, поле)
+FORWARD = [
+    ('shop.Category', 'parent'),
+    ('shop.SubCategory', 'category'),
+    ('shop.Product', 'subcategory'),
+    ('shop.ProductImage', 'product'),
+    ('shop.Cart', 'user'),
+    ('shop.CartItem', 'cart'),
+    ('shop.CartItem', 'product'),
+    ('shop.Order', 'user'),
+    ('shop.OrderLine', 'product'),
+]
+
+# Обратные связи, загружаемые порциями: (модель, имя связи)
+REVERSE = [
+    ('shop.Category', 'subcategories'),
+    ('shop.Product', 'images'),
+    ('shop.Cart', 'items'),
+    ('shop.Order', 'lines'),
+]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'RELATION_LOADER', {})}
+
+
+class Batch(list):
+    """Объекты, загруженные вместе; при копировании и pickle не переносится"""
+
+    def __reduce__(self):
+        return (Batch, ())
+
+
+class LoaderScope:
+    """Загруженные в области объекты: (модель, БД, поле, значение) -> объект"""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.objects = {}
+        # Связи, prefetch которых идет сейчас: prefetch_related_objects сам читает дескриптор
+        self.prefetching = set()
+
+    def load_forward(self, descriptor, instance):
+        """Загрузить внешний ключ для порции instance"""
+        field = descriptor.field
+        target = field.target_field.attname
+        label = field.related_model._meta.label
+        db = instance._state.db
+        peers = [
+            peer for peer in getattr(instance, '_loader_batch', None) or [instance]
+            if peer._state.db == db and getattr(peer, field.attname) is not None and not field.is_cached(peer)
+        ]
+        keys = {getattr(peer, field.attname) for peer in peers}
+        missing = [key for key in keys if (label, db, target, key) not in self.objects]
+        hits = len(keys) - len(missing)
+        if hits:
+            metrics.inc('shop_relation_loader_memo_hits_total', hits)
+        if missing:
+            # Порядок объектов не важен: сортировка по умолчанию не нужна
+            queryset = descriptor.get_queryset(instance=instance).order_by()
+            for start in range(0, len(missing), self.batch_size):
+                batch = Batch(queryset.filter(**{f'{target}__in': missing[start:start + self.batch_size]}))
+                for obj in batch:
+                    obj._loader_batch = batch
+                    self.objects[(label, db, target, getattr(obj, target))] = obj
+                metrics.inc('shop_relation_loader_queries_total', relation=f'{field.model._meta.label}.{field.name}')
+        for peer in peers:
+            obj = self.objects.get((label, db, target, getattr(peer, field.attname)))
+            if obj is None:
+                # Связанного объекта нет: ошибку даст обычный доступ к полю
+                continue
+            field.set_cached_value(peer, obj)
+            if not field.remote_field.multiple:
+                field.remote_field.set_cached_value(obj, peer)
+
+    def load_reverse(self, descriptor, instance):
+        """Загрузить обратную связь для порции instance"""
+        name = descriptor.rel.cache_name
+        batch = getattr(instance, '_loader_batch', None)
+        if not batch or len(batch) < 2 or name in getattr(instance, '_prefetched_objects_cache', {}):
+            # Для одного объекта ленивый запрос не дороже, а менеджер может понадобиться для filter()
+            return
+        key = (descriptor.rel.model._meta.label, name)
+        if key in self.prefetching:
+            return
+        peers = [peer for peer in batch if peer._state.db == instance._state.db]
+        self.prefetching.add(key)
+        try:
+            prefetch_related_objects(peers, name)
+        finally:
+            self.prefetching.discard(key)
+        metrics.inc(
+            'shop_relation_loader_queries_total', relation=f'{descriptor.rel.model._meta.label}.{name}'
+        )
+
+    def forget(self, instance):
+        """Забыть измененный или удаленный объект (и его копию, прочитанную с реплики)"""
+        label = instance._meta.label
+        stale = [
+            key for key in self.objects
+            if key[0] == label and getattr(instance, key[2], None) == key[3]
+        ]
+        for key in stale:
+            del self.objects[key]
+
+    def forget_model(self, model):
+        """Забыть все объекты модели: массовое изменение не сообщает, какие строки затронуты"""
+        label = model._meta.label
+        for key in [key for key in self.objects if key[0] == label]:
+            del self.objects[key]
+
+
+_scope = ContextVar('relation_loader_scope', default=None)
+
+
+@contextmanager
+def scope():
+    """Область пакетной загрузки и запоминания; вложенная область использует внешнюю"""
+    current = _scope.get()
+    config = get_config()
+    if current is not None or not config['ENABLED']:
+        yield current
+        return
+    current = LoaderScope(config['BATCH_SIZE'])
+    token = _scope.set(current)
+    try:
+        yield current
+    finally:
+        _scope.reset(token)
+
+
+class BatchIterable(ModelIterable):
+    """Объекты запроса размечаются порциями, пока открыта область загрузки"""
+
+    def __iter__(self):
+        objects = super().__iter__()
+        current = _scope.get()
+        if current is None:
+            yield from objects
+            return
+        # iterator() отдает строки по мере чтения: порция набирается заранее
+        while True:
+            batch = Batch(islice(objects, current.batch_size))
+            if not batch:
+                return
+            for obj in batch:
+                obj._loader_batch = batch
+            yield from batch
+
+
+class LoaderQuerySet(models.QuerySet):
+    """QuerySet, объекты которого загружают связи порциями"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterable_class = BatchIterable
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        _forget_model(self.model)
+        return rows
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        _forget_model(self.model)
+        return rows
+
+
+class BatchedForwardDescriptor:
+    """Примесь к дескриптору внешнего ключа: загрузка для всей порции"""
+
+    def __get__(self, instance, cls=None):
+        if instance is not None and not self.field.is_cached(instance):
+            current = _scope.get()
+            if current is not None and getattr(instance, self.field.attname) is not None:
+                current.load_forward(self, instance)
+        return super().__get__(instance, cls)
+
+
+class BatchedReverseDescriptor:
+    """Примесь к дескриптору обратной связи: prefetch для всей порции"""
+
+    def __get__(self, instance, cls=None):
+        if instance is not None:
+            current = _scope.get()
+            if current is not None:
+                current.load_reverse(self, instance)
+        return super().__get__(instance, cls)
+
+
+def _batched(descriptor, mixin):
+    base = type(descriptor)
+    cls = type(f'Batched{base.__name__}', (mixin, base), {})
+    return cls(descriptor.field if mixin is BatchedForwardDescriptor else descriptor.rel)
+
+
+def _forget_model(model):
+    current = _scope.get()
+    if current is not None:
+        current.forget_model(model)
+
+
+def _forget(sender, instance, **kwargs):
+    current = _scope.get()
+    if current is not None:
+        current.forget(instance)
+
+
+def install():
+    """Заменить дескрипторы связей FORWARD и REVERSE (из ShopConfig.ready)"""
+    for relations, mixin in ((FORWARD, BatchedForwardDescriptor), (REVERSE, BatchedReverseDescriptor)):
+        for label, name in relations:
+            model = apps.get_model(label)
+            descriptor = model.__dict__[name]
+            if not isinstance(descriptor, mixin):
+                setattr(model, name, _batched(descriptor, mixin))
+    # Запоминаются только цели внешних ключей FORWARD. Обработчик без sender
+    # отключил бы быстрое удаление (без выборки строк) для всех моделей
+    for model in {apps.get_model(label)._meta.get_field(name).related_model for label, name in FORWARD}:
+        post_save.connect(_forget, sender=model, dispatch_uid='relation_loader_forget_saved')
+        post_delete.connect(_forget, sender=model, dispatch_uid='relation_loader_forget_deleted')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop import schema
+
+
+class Command(BaseCommand):
+    help = 'Сгенерировать схему OpenAPI для текущей версии кода'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перегенерировать, даже если файлы уже есть')
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        paths = schema.build(version, force=options['force'])
+        for path in paths.values():
+            self.stdout.write(str(path))
+        self.stdout.write(self.style.SUCCESS(f'Схема OpenAPI для версии {version} готова'))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.outbox import HandlerError, dispatch
+
+
+class Command(BaseCommand):
+    help = 'Доставить события изменения каталога из outbox обработчикам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Строк outbox в одной порции')
+        parser.add_argument(
+            '--interval', type=float,
+            help='Опрашивать outbox каждые N секунд (фоновый режим); без него — выбрать все и выйти'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            delivered = 0
+            try:
+                while True:
+                    rows = dispatch(batch_size=options['batch_size'])
+                    delivered += rows
+                    if not rows:
+                        break
+            except HandlerError as exc:
+                if not options['interval']:
+                    raise CommandError(str(exc))
+                # Порция осталась в outbox и будет доставлена повторно
+                self.stderr.write(str(exc))
+            if delivered:
+                self.stdout.write(f'Доставлено событий: {delivered}')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
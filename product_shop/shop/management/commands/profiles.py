@@ -0,0 +1,108 @@
+import pstats
+import time
+from collections import Counter
+from datetime import datetime
+from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.profiling import get_config, get_profiles_dir, load_profiles
+
+SORT_KEYS = ['cumulative', 'tottime', 'ncalls']
+
+
+class Command(BaseCommand):
+    help = 'Список, сводка и очистка сохраненных профилей запросов'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        list_parser = subparsers.add_parser('list', help='Список профилей, новые первыми')
+        list_parser.add_argument('--route', help='Только профили маршрута (например, product-list)')
+        list_parser.add_argument('--limit', type=int, default=50)
+
+        aggregate = subparsers.add_parser('aggregate', help='Сводка по нескольким профилям')
+        aggregate.add_argument('ids', nargs='*', help='Идентификаторы профилей; по умолчанию — все')
+        aggregate.add_argument('--route', help='Только профили маршрута')
+        aggregate.add_argument('--sort', choices=SORT_KEYS, default='cumulative')
+        aggregate.add_argument('--lines', type=int, default=30, help='Строк статистики функций')
+        aggregate.add_argument('--collapsed', help='Записать объединенные стеки для flamegraph в файл')
+
+        prune = subparsers.add_parser('prune', help='Удалить старые профили')
+        prune.add_argument('--days', type=float, help='Старше N дней (по умолчанию PROFILING["KEEP_DAYS"])')
+        prune.add_argument('--keep', type=int, help='Оставить не больше N последних')
+
+    def handle(self, *args, **options):
+        getattr(self, f'handle_{options["action"]}')(options)
+
+    def handle_list(self, options):
+        for meta in load_profiles(options['route'])[:options['limit']]:
+            created = datetime.fromtimestamp(meta['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(
+                f"{meta['id']}  {created}  {meta['method']} {meta['route']} {meta['status']}  "
+                f"{meta['duration_ms']:.1f} мс, SQL: {meta['sql']['count']} за {meta['sql']['time_ms']:.1f} мс"
+                f"  [{meta['reason']}]"
+            )
+
+    def _selected(self, options):
+        profiles = load_profiles(options['route'])
+        if options['ids']:
+            wanted = set(options['ids'])
+            profiles = [meta for meta in profiles if meta['id'] in wanted]
+            missing = wanted - {meta['id'] for meta in profiles}
+            if missing:
+                raise CommandError(f'Профили не найдены: {", ".join(sorted(missing))}')
+        if not profiles:
+            raise CommandError('Нет профилей для сводки')
+        return profiles
+
+    def handle_aggregate(self, options):
+        profiles = self._selected(options)
+        directory = get_profiles_dir()
+        total_ms = sum(meta['duration_ms'] for meta in profiles)
+        sql_ms = sum(meta['sql']['time_ms'] for meta in profiles)
+        self.stdout.write(
+            f'Профилей: {len(profiles)}, среднее время {total_ms / len(profiles):.1f} мс, '
+            f'из них SQL {sql_ms / len(profiles):.1f} мс'
+        )
+
+        queries = Counter()
+        query_counts = Counter()
+        for meta in profiles:
+            for query in meta['sql']['top']:
+                queries[query['sql']] += query['time_ms']
+                query_counts[query['sql']] += query['count']
+        if queries:
+            self.stdout.write('\nСамые долгие SQL-запросы (суммарно, мс / число):')
+            for sql, time_ms in queries.most_common(10):
+                self.stdout.write(f'  {time_ms:9.1f} / {query_counts[sql]:<5} {sql[:150]}')
+
+        output = StringIO()
+        stats = pstats.Stats(*[str(directory / f"{meta['id']}.prof") for meta in profiles], stream=output)
+        stats.sort_stats(options['sort']).print_stats(options['lines'])
+        self.stdout.write(output.getvalue())
+
+        if options['collapsed']:
+            stacks = Counter()
+            for meta in profiles:
+                path = directory / f"{meta['id']}.collapsed"
+                for line in path.read_text().splitlines() if path.exists() else []:
+                    stack, _, count = line.rpartition(' ')
+                    stacks[stack] += int(count)
+            with open(options['collapsed'], 'w') as output_file:
+                for stack, count in stacks.most_common():
+                    output_file.write(f'{stack} {count}\n')
+            self.stdout.write(f'Стеки записаны в {options["collapsed"]}')
+
+    def handle_prune(self, options):
+        days = options['days'] if options['days'] is not None else get_config()['KEEP_DAYS']
+        profiles = load_profiles()
+        cutoff = time.time() - days * 86400
+        stale = [meta for meta in profiles if meta['created_at'] < cutoff]
+        if options['keep'] is not None:
+            stale += [meta for meta in profiles[options['keep']:] if meta['created_at'] >= cutoff]
+        directory = get_profiles_dir()
+        for meta in stale:
+            for suffix in ('json', 'prof', 'collapsed'):
+                (directory / f"{meta['id']}.{suffix}").unlink(missing_ok=True)
+        self.stdout.write(f'Удалено профилей: {len(stale)}')
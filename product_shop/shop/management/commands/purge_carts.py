@@ -0,0 +1,84 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from shop import metrics
+from shop.models import Cart, CartItem, IdempotencyKey
+from shop.orders import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Удалить заброшенные и пустые корзины небольшими порциями по диапазонам pk и устаревшие ключи идемпотентности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Корзина с позициями не менялась N дней')
+        parser.add_argument(
+            '--empty-hours', type=int, default=1,
+            help='Пустая корзина старше N часов (свежие создаются get_or_create при каждом запросе)'
+        )
+        parser.add_argument(
+            '--keys-hours', type=int, default=24,
+            help='Ключ идемпотентности старше N часов (повтор заказа после этого не распознается)'
+        )
+        parser.add_argument('--batch-size', type=int, default=200, help='Корзин в одной транзакции')
+        parser.add_argument(
+            '--sleep', type=float, default=0.05,
+            help='Пауза между порциями, сек: дает пройти живым записям в корзины (важно для SQLite)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        now = timezone.now()
+        items = CartItem.objects.filter(cart=OuterRef('pk'))
+        # Активность корзины — последнее изменение ее самой или любой позиции
+        abandoned = (
+            Q(updated_at__lt=now - timedelta(days=options['days']))
+            & Exists(items)
+            & ~Exists(items.filter(updated_at__gte=now - timedelta(days=options['days'])))
+        )
+        empty = Q(updated_at__lt=now - timedelta(hours=options['empty_hours'])) & ~Exists(items)
+
+        totals = {'abandoned': 0, 'empty': 0, 'batches': 0}
+        start = time.perf_counter()
+        last_pk = 0
+        while True:
+            # Границы порции читаются вне транзакции; блокировка держится только на удаление
+            pks = list(
+                Cart.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+            batch = Cart.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+            counts = batch.aggregate(
+                abandoned=Count('pk', filter=abandoned), empty=Count('pk', filter=empty)
+            )
+            if not options['dry_run'] and (counts['abandoned'] or counts['empty']):
+                with transaction.atomic():
+                    batch.filter(abandoned | empty).delete()
+            totals['abandoned'] += counts['abandoned']
+            totals['empty'] += counts['empty']
+            totals['batches'] += 1
+            last_pk = pks[-1]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        keys_before = now - timedelta(hours=options['keys_hours'])
+        if options['dry_run']:
+            totals['keys'] = IdempotencyKey.objects.filter(created_at__lt=keys_before).count()
+        else:
+            totals['keys'] = purge_idempotency_keys(keys_before, options['batch_size'])
+            metrics.inc('shop_carts_purged_total', totals['abandoned'], kind='abandoned')
+            metrics.inc('shop_carts_purged_total', totals['empty'], kind='empty')
+            metrics.inc('shop_idempotency_keys_purged_total', totals['keys'])
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} корзин: заброшенных {totals["abandoned"]}, пустых {totals["empty"]} '
+            f'({totals["batches"]} порций, {time.perf_counter() - start:.1f} с); '
+            f'ключей идемпотентности: {totals["keys"]}'
+        ))
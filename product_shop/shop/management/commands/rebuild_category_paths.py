@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать материализованные пути дерева категорий (например, после loaddata)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Category.rebuild_paths()
+        self.stdout.write(self.style.SUCCESS('Пути категорий пересчитаны'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.stock import sweep_expired
+
+
+class Command(BaseCommand):
+    help = 'Вернуть на склад просроченные резервы корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Резервов в одной транзакции')
+        parser.add_argument(
+            '--interval', type=float,
+            help='Повторять каждые N секунд (фоновый режим); без него — один проход'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = sweep_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Снято резервов: {released}')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import (
+    MICROBENCHMARKS, SCENARIOS, BenchmarkContext, ClientTransport, HttpTransport, environment_info, run_scenario
+)
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон эндпоинтов API с отчетом в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            help=f'Сценарии (по умолчанию все): {", ".join(SCENARIOS)}'
+        )
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество параллельных клиентов')
+        parser.add_argument('--warmup', type=int, default=20, help='Прогревочных запросов на сценарий')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора случайных чисел')
+        parser.add_argument(
+            '--micro', action='append', default=[], choices=list(MICROBENCHMARKS),
+            help='Микробенчмарк компонента (можно указать несколько раз)'
+        )
+        parser.add_argument('--url', help='Адрес запущенного сервера; без него используется тестовый клиент')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        if options['micro'] and not options['scenarios']:
+            self.write_report({
+                'meta': environment_info(),
+                'micro': {name: MICROBENCHMARKS[name]() for name in options['micro']},
+            }, options['output'])
+            return
+
+        scenarios = options['scenarios'] or list(SCENARIOS)
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+
+        ctx = BenchmarkContext()
+        if not ctx.product_slugs:
+            raise CommandError('Каталог пуст, сначала выполните seed_benchmark')
+        if not ctx.usernames and {'cart', 'cart-add', 'auth'} & set(scenarios):
+            raise CommandError('Нет пользователей для бенчмарка, сначала выполните seed_benchmark')
+
+        if options['url']:
+            transport_factory = lambda: HttpTransport(options['url'], ctx.password)
+        else:
+            transport_factory = ClientTransport
+
+        report = {
+            'meta': {
+                **environment_info(),
+                'transport': 'http' if options['url'] else 'client',
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+            },
+            'results': {},
+        }
+        for scenario in scenarios:
+            self.stderr.write(f'{scenario}...')
+            report['results'][scenario] = run_scenario(
+                scenario, ctx, transport_factory,
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                warmup=options['warmup'],
+                seed=options['seed'],
+            )
+        if options['micro']:
+            report['micro'] = {name: MICROBENCHMARKS[name]() for name in options['micro']}
+        self.write_report(report, options['output'])
+
+    def write_report(self, report, path):
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,70 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from shop.jobs import get_config, work
+
+
+def _run_worker(stop, kwargs):
+    # У каждого потока и процесса свои соединения с БД
+    try:
+        work(stop=stop, **kwargs)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Запустить воркеры фоновых задач из очереди в БД'
+
+    def add_arguments(self, parser):
+        config = get_config()
+        parser.add_argument('--workers', type=int, default=config['WORKERS'], help='Размер пула')
+        parser.add_argument(
+            '--mode', choices=['thread', 'process'], default=config['MODE'],
+            help='Потоки (задачи с вводом-выводом) или процессы (задачи, нагружающие CPU)'
+        )
+        parser.add_argument('--poll-interval', type=float, help='Пауза при пустой очереди, сек')
+        parser.add_argument('--visibility-timeout', type=int, help='Через сколько секунд взятую задачу можно забрать снова')
+        parser.add_argument('--burst', action='store_true', help='Выйти, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers должен быть положительным')
+        kwargs = {
+            'burst': options['burst'],
+            'poll_interval': options['poll_interval'],
+            'visibility_timeout': options['visibility_timeout'],
+        }
+        if options['workers'] == 1:
+            # Один воркер работает в основном потоке
+            processed = work(**kwargs)
+            self.stdout.write(f'Выполнено задач: {processed}')
+            return
+
+        if options['mode'] == 'process':
+            # Дочерние процессы не должны унаследовать соединения родителя
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            stop = context.Event()
+            pool = [
+                context.Process(target=_run_worker, args=(stop, kwargs), daemon=True)
+                for _ in range(options['workers'])
+            ]
+        else:
+            stop = threading.Event()
+            pool = [threading.Thread(target=_run_worker, args=(stop, kwargs)) for _ in range(options['workers'])]
+
+        def shutdown(signum, frame):
+            # Текущие задачи дорабатывают, новые не берутся
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        for worker in pool:
+            worker.start()
+        for worker in pool:
+            worker.join()
+        self.stdout.write(f'Воркеры остановлены ({options["workers"]}, {options["mode"]})')
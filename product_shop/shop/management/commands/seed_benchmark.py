@@ -0,0 +1,138 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop.models import Category, SubCategory, Product, ProductImage, Cart, CartItem
+
+SLUG_PREFIX = 'bench-'
+USERNAME_PREFIX = 'bench_user_'
+PASSWORD = 'bench-pass'
+IMAGE_NAME = 'a924623775e4974eec8367db7989bafa.jpg'
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Сгенерировать синтетический каталог, пользователей и корзины для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10, help='Количество категорий')
+        parser.add_argument('--subcategories', type=int, default=5, help='Подкатегорий в каждой категории')
+        parser.add_argument('--products', type=int, default=2000, help='Общее количество продуктов')
+        parser.add_argument('--images', type=int, default=2, help='Изображений у каждого продукта')
+        parser.add_argument('--stock', type=int, default=1000000, help='Остаток каждого продукта')
+        parser.add_argument('--users', type=int, default=100, help='Количество пользователей')
+        parser.add_argument('--cart-items', type=int, default=5, help='Позиций в корзине каждого пользователя')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора случайных чисел')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированные данные')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if not options['clear'] and Category.objects.filter(slug__startswith=SLUG_PREFIX).exists():
+            raise CommandError('Данные для бенчмарка уже есть, используйте --clear')
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            categories = self.create_categories(options['categories'])
+            subcategories = self.create_subcategories(categories, options['subcategories'])
+            Category.rebuild_paths()
+            products = self.create_products(rng, subcategories, options['products'], options['stock'])
+            self.create_images(products, options['images'])
+            users = self.create_users(options['users'])
+            self.create_carts(rng, users, products, options['cart_items'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: категорий {len(categories)}, подкатегорий {len(subcategories)}, '
+            f'продуктов {len(products)}, пользователей {len(users)}'
+        ))
+
+    def clear(self):
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        Category.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+
+    def create_categories(self, count):
+        Category.objects.bulk_create(
+            [
+                Category(
+                    name=f'Категория {i}',
+                    slug=f'{SLUG_PREFIX}category-{i}',
+                    image='categories/bench.jpg',
+                )
+                for i in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        return list(Category.objects.filter(slug__startswith=SLUG_PREFIX).order_by('id'))
+
+    def create_subcategories(self, categories, per_category):
+        SubCategory.objects.bulk_create(
+            [
+                SubCategory(
+                    category=category,
+                    name=f'Подкатегория {category.pk}-{i}',
+                    slug=f'{SLUG_PREFIX}subcategory-{category.pk}-{i}',
+                    image='subcategories/bench.jpg',
+                )
+                for category in categories
+                for i in range(per_category)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        return list(SubCategory.objects.filter(slug__startswith=SLUG_PREFIX).order_by('id'))
+
+    def create_products(self, rng, subcategories, count, stock):
+        if not subcategories:
+            return []
+        Product.objects.bulk_create(
+            [
+                Product(
+                    subcategory=subcategories[i % len(subcategories)],
+                    name=f'Продукт {i}',
+                    slug=f'{SLUG_PREFIX}product-{i}',
+                    price=Decimal(rng.randint(100, 100000)) / 100,
+                    description=f'Описание продукта {i}',
+                    stock=stock,
+                )
+                for i in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        return list(Product.objects.filter(slug__startswith=SLUG_PREFIX).order_by('id'))
+
+    def create_images(self, products, per_product):
+        ProductImage.objects.bulk_create(
+            [
+                ProductImage(
+                    product=product,
+                    image_small=f'products/small/{IMAGE_NAME}',
+                    image_medium=f'products/medium/{IMAGE_NAME}',
+                    image_large=f'products/large/{IMAGE_NAME}',
+                    is_main=(i == 0),
+                )
+                for product in products
+                for i in range(per_product)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+    def create_users(self, count):
+        # Хэш пароля считается один раз: PBKDF2 на каждого пользователя слишком дорог
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            [User(username=f'{USERNAME_PREFIX}{i}', password=password) for i in range(count)],
+            batch_size=BATCH_SIZE,
+        )
+        return list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+
+    def create_carts(self, rng, users, products, items_per_cart):
+        Cart.objects.bulk_create([Cart(user=user) for user in users], batch_size=BATCH_SIZE)
+        carts = Cart.objects.filter(user__username__startswith=USERNAME_PREFIX).order_by('id')
+        items = []
+        for cart in carts:
+            for product in rng.sample(products, min(items_per_cart, len(products))):
+                items.append(CartItem(cart=cart, product=product, quantity=rng.randint(1, 5)))
+        CartItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
@@ -0,0 +1,361 @@
+"""
+Метрики приложения с агрегацией между процессами.
+
+Каждый воркер пишет значения в собственный mmap-файл в каталоге
+``settings.METRICS_DIR``. Файл состоит из слотов фиксированного размера:
+тип метрики (1 байт), имя серии (до 119 байт, более длинное имя —
+ошибка) и значение (double). Воркер — единственный писатель своего файла,
+поэтому запись не требует блокировок между процессами: инкремент — это
+``struct.pack_into`` в уже известное смещение. Имена серий и ключи
+бакетов гистограмм строятся один раз на набор меток и запоминаются, все
+серии одного наблюдения пишутся под одной блокировкой. Эндпоинт ``/metrics`` читает все файлы каталога и
+суммирует серии (gauge — берётся максимум). Файлы завершившихся процессов
+при сборе удаляются: их счетчики и гистограммы переносятся в общий архив
+``metrics_archive.db``, а gauge отбрасываются.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+COUNTER = b'c'
+GAUGE = b'g'
+# Бакеты, сумма и число наблюдений гистограммы: суммируются как счетчики
+HISTOGRAM = b'h'
+KINDS = (COUNTER, GAUGE, HISTOGRAM)
+
+SLOT_SIZE = 128
+KEY_SIZE = SLOT_SIZE - 1 - 8
+VALUE_FORMAT = '<d'
+_pack_value = struct.Struct(VALUE_FORMAT).pack_into
+INITIAL_SLOTS = 1024
+
+ARCHIVE_NAME = 'metrics_archive.db'
+LOCK_NAME = 'metrics.lock'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_metrics_dir():
+    """Каталог для файлов метрик воркеров"""
+    path = getattr(settings, 'METRICS_DIR', None)
+    if not path:
+        path = Path(tempfile.gettempdir()) / 'product_shop_metrics'
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def series(name, **labels):
+    """Имя серии в формате Prometheus: name{label="value",...}"""
+    if not labels:
+        return name
+    body = ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f'{name}{{{body}}}'
+
+
+# (имя, метки в порядке вызова) -> имя серии; число серий ограничено и так
+_series_cache = {}
+# (имя, бакеты, метки) -> (границы, ключи бакетов с +Inf, ключ суммы, ключ числа)
+_histogram_cache = {}
+
+
+def _series(name, labels):
+    cache_key = (name, tuple(labels.items()))
+    key = _series_cache.get(cache_key)
+    if key is None:
+        key = _series_cache[cache_key] = series(name, **labels)
+    return key
+
+
+def _histogram(name, buckets, labels):
+    cache_key = (name, buckets, tuple(labels.items()))
+    keys = _histogram_cache.get(cache_key)
+    if keys is None:
+        bounds = tuple(sorted(buckets))
+        bucket_keys = [series(f'{name}_bucket', le=repr(bound), **labels) for bound in bounds]
+        bucket_keys.append(series(f'{name}_bucket', le='+Inf', **labels))
+        keys = _histogram_cache[cache_key] = (
+            bounds,
+            tuple((key, 1.0) for key in bucket_keys),
+            series(f'{name}_sum', **labels),
+            series(f'{name}_count', **labels),
+        )
+    return keys
+
+
+class MetricsFile:
+    """mmap-файл метрик одного процесса"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.values = {}
+        self._open()
+
+    def _open(self):
+        exists = self.path.exists()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size < SLOT_SIZE * INITIAL_SLOTS:
+            os.ftruncate(self.fd, SLOT_SIZE * INITIAL_SLOTS)
+            size = SLOT_SIZE * INITIAL_SLOTS
+        self.mm = mmap.mmap(self.fd, size)
+        self.used = 0
+        if exists:
+            # PID мог быть переиспользован: продолжаем значения из файла
+            for kind, key, value, offset in _iter_slots(self.mm):
+                self.offsets[key] = offset
+                self.values[key] = value
+                self.used += 1
+
+    def _grow(self):
+        size = len(self.mm) * 2
+        self.mm.close()
+        os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size)
+
+    def _slot(self, kind, key):
+        offset = self.offsets.get(key)
+        if offset is not None:
+            return offset
+        encoded = key.encode('utf-8')
+        if len(encoded) > KEY_SIZE:
+            # Обрезанное имя дало бы другую, возможно некорректную серию
+            raise ValueError(f'Имя серии длиннее {KEY_SIZE} байт: {key}')
+        if (self.used + 1) * SLOT_SIZE > len(self.mm):
+            self._grow()
+        offset = self.used * SLOT_SIZE
+        # Значение пишется раньше ключа: читатель видит слот только с ключом
+        _pack_value(self.mm, offset + 1 + KEY_SIZE, 0.0)
+        self.mm[offset + 1:offset + 1 + len(encoded)] = encoded
+        self.mm[offset:offset + 1] = kind
+        self.used += 1
+        self.offsets[key] = offset
+        self.values[key] = 0.0
+        return offset
+
+    def inc(self, key, amount=1.0, kind=COUNTER):
+        with self.lock:
+            offset = self._slot(kind, key)
+            value = self.values[key] + amount
+            self.values[key] = value
+            _pack_value(self.mm, offset + 1 + KEY_SIZE, value)
+
+    def inc_many(self, kind, items):
+        """Увеличить несколько серий (ключ, приращение) под одной блокировкой"""
+        values = self.values
+        with self.lock:
+            for key, amount in items:
+                offset = self._slot(kind, key)
+                value = values[key] + amount
+                values[key] = value
+                _pack_value(self.mm, offset + 1 + KEY_SIZE, value)
+
+    def set(self, key, value):
+        with self.lock:
+            offset = self._slot(GAUGE, key)
+            self.values[key] = value
+            _pack_value(self.mm, offset + 1 + KEY_SIZE, value)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+def _iter_slots(buffer):
+    for offset in range(0, len(buffer) - SLOT_SIZE + 1, SLOT_SIZE):
+        kind = bytes(buffer[offset:offset + 1])
+        if kind not in KINDS:
+            break
+        raw_key = bytes(buffer[offset + 1:offset + 1 + KEY_SIZE]).rstrip(b'\x00')
+        value, = struct.unpack_from(VALUE_FORMAT, buffer, offset + 1 + KEY_SIZE)
+        yield kind, raw_key.decode('utf-8', 'replace'), value, offset
+
+
+_file = None
+_file_pid = None
+_file_lock = threading.Lock()
+
+
+def _get_file():
+    global _file, _file_pid
+    pid = os.getpid()
+    if _file is not None and _file_pid == pid:
+        return _file
+    with _file_lock:
+        if _file is None or _file_pid != pid:
+            # После fork() воркер обязан писать в собственный файл
+            _file = MetricsFile(get_metrics_dir() / f'metrics_{pid}.db')
+            _file_pid = pid
+    return _file
+
+
+def reset():
+    """Закрыть файл текущего процесса (используется в тестах)"""
+    global _file, _file_pid
+    with _file_lock:
+        if _file is not None:
+            _file.close()
+        _file = None
+        _file_pid = None
+
+
+def inc(name, amount=1.0, **labels):
+    """Увеличить счетчик"""
+    _get_file().inc(_series(name, labels), amount)
+
+
+def set_gauge(name, value, **labels):
+    """Установить значение gauge"""
+    _get_file().set(_series(name, labels), value)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Записать наблюдение в гистограмму (бакеты накопительные)"""
+    bounds, bucket_items, sum_key, count_key = _histogram(name, buckets, labels)
+    # Наблюдение попадает во все бакеты с границей >= value и в +Inf
+    items = bucket_items[bisect_left(bounds, value):] + ((sum_key, value), (count_key, 1.0))
+    _get_file().inc_many(HISTOGRAM, items)
+
+
+def cache_access(cache, hit):
+    """Учесть обращение к кэшу"""
+    inc('shop_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read()
+    except OSError:
+        return b''
+
+
+def _owner_pid(path):
+    """PID процесса-владельца файла или None для архива и чужих файлов"""
+    suffix = path.stem[len('metrics_'):]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def _write_archive(path, counters):
+    """counters: ключ -> (тип, значение); ключи уже прошли проверку длины"""
+    buffer = bytearray(SLOT_SIZE * max(len(counters), 1))
+    for index, (key, (kind, value)) in enumerate(sorted(counters.items())):
+        offset = index * SLOT_SIZE
+        encoded = key.encode('utf-8')
+        buffer[offset:offset + 1] = kind
+        buffer[offset + 1:offset + 1 + len(encoded)] = encoded
+        struct.pack_into(VALUE_FORMAT, buffer, offset + 1 + KEY_SIZE, value)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_bytes(bytes(buffer))
+    os.replace(tmp, path)
+
+
+def prune(directory=None):
+    """
+    Удалить файлы завершившихся процессов; вернуть их число.
+
+    Счетчики переносятся в архив, чтобы суммы не уменьшались, значения gauge
+    мертвого процесса больше не показываются. Пока идет перенос, сбор
+    метрик ждет (блокировка файла), чтобы не посчитать значения дважды.
+    """
+    directory = directory or get_metrics_dir()
+    dead = [
+        path for path in directory.glob('metrics_*.db')
+        if _owner_pid(path) is not None and not _alive(_owner_pid(path))
+    ]
+    if not dead:
+        return 0
+    with open(directory / LOCK_NAME, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Переносом уже занимается другой процесс
+            return 0
+        archive = directory / ARCHIVE_NAME
+        counters = {key: (kind, value) for kind, key, value, _ in _iter_slots(_read(archive))}
+        pruned = [path for path in dead if path.exists()]
+        for path in pruned:
+            for kind, key, value, _ in _iter_slots(_read(path)):
+                if kind != GAUGE:
+                    counters[key] = (kind, counters.get(key, (kind, 0.0))[1] + value)
+        _write_archive(archive, counters)
+        for path in pruned:
+            path.unlink(missing_ok=True)
+    return len(pruned)
+
+
+def collect():
+    """Собрать значения из файлов всех живых процессов и архива"""
+    directory = get_metrics_dir()
+    prune(directory)
+    totals = {}
+    kinds = {}
+    with open(directory / LOCK_NAME, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        for path in sorted(directory.glob('metrics_*.db')):
+            for kind, key, value, offset in _iter_slots(_read(path)):
+                kinds[key] = kind
+                if kind == GAUGE:
+                    totals[key] = max(totals.get(key, value), value)
+                else:
+                    totals[key] = totals.get(key, 0.0) + value
+    return totals, kinds
+
+
+def _family(key, kind):
+    """Семейство и тип серии по типу, с которым она записана"""
+    name = key.split('{', 1)[0]
+    if kind == HISTOGRAM:
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix):
+                return name[:-len(suffix)], 'histogram'
+    return name, 'gauge' if kind == GAUGE else 'counter'
+
+
+def _format_value(value):
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render():
+    """Отрисовать метрики в текстовом формате Prometheus"""
+    totals, kinds = collect()
+    families = {}
+    for key in sorted(totals):
+        family, family_type = _family(key, kinds[key])
+        families.setdefault(family, (family_type, []))[1].append(key)
+
+    lines = []
+    for family in sorted(families):
+        family_type, keys = families[family]
+        lines.append(f'# TYPE {family} {family_type}')
+        for key in keys:
+            lines.append(f'{key} {_format_value(totals[key])}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from . import loaders, metrics, profiling, routers
+from .compression import MIN_LENGTH, compress, is_compressible, negotiate
+
+
+class QueryCounter:
+    """Обертка для execute_wrapper: считает SQL-запросы"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Сбор метрик запросов: количество, статусы, латентность, число SQL-запросов"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.view_name if match is not None else 'unmatched'
+        metrics.inc(
+            'shop_http_requests_total',
+            route=route, method=request.method, status=response.status_code
+        )
+        metrics.observe('shop_http_request_duration_seconds', duration, route=route)
+        metrics.inc('shop_db_queries_total', counter.count, route=route)
+        return response
+
+
+class ProfilingMiddleware:
+    """Профилирование запроса по просьбе сотрудника или по выборке (см. shop/profiling.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = profiling.should_profile(request)
+        if reason is None:
+            return self.get_response(request)
+        return profiling.profile_request(request, self.get_response, reason)
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов с выбором кодировки по Accept-Encoding.
+
+    Сжимаются только текстовые типы (см. ``compression.is_compressible``).
+    Если у ответа есть атрибут ``precompressed`` (словарь кодировка -> тело),
+    используется готовое сжатое тело.
+    """
+    min_length = MIN_LENGTH
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not is_compressible(response.get('Content-Type', '')):
+            return response
+
+        precompressed = getattr(response, 'precompressed', None)
+        if not precompressed and len(response.content) < self.min_length:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accept_encoding = request.headers.get('Accept-Encoding', '')
+        if precompressed:
+            encoding = negotiate(accept_encoding, list(precompressed))
+            if encoding is None:
+                return response
+            body = precompressed[encoding]
+        else:
+            encoding = negotiate(accept_encoding)
+            if encoding is None:
+                return response
+            body = compress(response.content, encoding)
+            if len(body) >= len(response.content):
+                return response
+
+        response.content = body
+        response['Content-Length'] = str(len(body))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            # Сжатое представление не идентично побайтно — ETag становится слабым
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Границы запроса для ``shop.routers``: чтения каталога с реплики и
+    привязка клиента к основной БД после его записей.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = routers.get_config()
+        if not config['READ_ALIAS']:
+            return self.get_response(request)
+        pinned = config['STICKY_COOKIE'] in request.COOKIES
+        with routers.request_scope(pinned=pinned) as scope:
+            response = self.get_response(request)
+        if scope.wrote:
+            response.set_cookie(
+                config['STICKY_COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax'
+            )
+            metrics.inc('shop_db_sticky_pins_total')
+        return response
+
+
+class RelationLoaderMiddleware:
+    """Пакетная загрузка связей и запоминание объектов в рамках запроса (см. shop/loaders.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with loaders.scope():
+            return self.get_response(request)
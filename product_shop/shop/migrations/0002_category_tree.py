@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def path_segment(pk):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        encoded = digits[remainder] + encoded
+    return encoded.rjust(6, '0') + '/'
+
+
+def fill_paths(apps, schema_editor):
+    """Существующие категории становятся корнями дерева, подкатегории — их листьями"""
+    Category = apps.get_model('shop', 'Category')
+    SubCategory = apps.get_model('shop', 'SubCategory')
+
+    categories = list(Category.objects.only('pk'))
+    for category in categories:
+        category.path = path_segment(category.pk)
+        category.depth = 0
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
+
+    paths = {category.pk: category.path for category in categories}
+    subcategories = list(SubCategory.objects.only('pk', 'category_id'))
+    for subcategory in subcategories:
+        subcategory.path = paths[subcategory.category_id] + path_segment(subcategory.pk)
+    SubCategory.objects.bulk_update(subcategories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='shop.category', verbose_name='Родительская категория'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Остаток для продуктов, помеченных доступными до появления учета остатков
+INITIAL_STOCK = 100
+
+
+def fill_stock(apps, schema_editor):
+    """Доступные продукты получают начальный остаток, недоступные — нулевой"""
+    Product = apps.get_model('shop', 'Product')
+    Product.objects.filter(is_available=True).update(stock=INITIAL_STOCK)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_related_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock',
+            field=models.PositiveIntegerField(default=0, verbose_name='Остаток на складе'),
+        ),
+        migrations.RunPython(fill_stock, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='product',
+            name='is_available',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='is_available',
+            field=models.GeneratedField(db_persist=True, expression=models.ExpressionWrapper(models.Q(('stock__gt', 0)), output_field=models.BooleanField()), output_field=models.BooleanField(), verbose_name='Доступен'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Действует до')),
+                ('cart_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='shop.cartitem', verbose_name='Элемент корзины')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Резерв',
+                'verbose_name_plural': 'Резервы',
+                'ordering': ['expires_at'],
+            },
+        ),
+    ]
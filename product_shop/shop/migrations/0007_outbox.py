@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('action', models.CharField(choices=[('save', 'Сохранение'), ('delete', 'Удаление')], max_length=10, verbose_name='Действие')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Данные')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Событие каталога',
+                'verbose_name_plural': 'События каталога',
+                'ordering': ['pk'],
+            },
+        ),
+    ]
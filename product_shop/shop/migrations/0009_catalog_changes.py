@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:48
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Весь текущий каталог — в журнал, чтобы синхронизация с нуля получила все объекты"""
+    CatalogChange = apps.get_model('shop', 'CatalogChange')
+    for model_name in ('category', 'subcategory', 'product'):
+        model = apps.get_model('shop', model_name)
+        CatalogChange.objects.bulk_create(
+            [
+                CatalogChange(model=model_name, object_id=pk)
+                for pk in model.objects.order_by('pk').values_list('pk', flat=True)
+            ],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Удален')),
+                ('changed_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение каталога',
+                'verbose_name_plural': 'Изменения каталога',
+                'ordering': ['pk'],
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:35
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+
+def create_epoch(apps, schema_editor):
+    """Существующие рейтинги посчитаны от 2024-01-01"""
+    PopularityEpoch = apps.get_model('shop', 'PopularityEpoch')
+    PopularityEpoch.objects.create(pk=1, epoch=datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_catalog_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityEpoch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.FloatField(verbose_name='Точка отсчета (unix time)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Точка отсчета популярности',
+                'verbose_name_plural': 'Точки отсчета популярности',
+            },
+        ),
+        migrations.RunPython(create_epoch, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_popularity_epoch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Имя')),
+                ('owner', models.CharField(blank=True, default='', max_length=64, verbose_name='Владелец')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Действует до')),
+            ],
+            options={
+                'verbose_name': 'Аренда',
+                'verbose_name_plural': 'Аренды',
+            },
+        ),
+    ]
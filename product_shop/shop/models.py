@@ -1,14 +1,124 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
+from .loaders import LoaderQuerySet
 
-class Category(models.Model):
-    """Категория товаров"""
+# Материализованный путь: сегмент на каждый уровень — id в base36 фиксированной ширины.
+# Поддерево узла — диапазон [path, path + PATH_END) по индексу, независимо от глубины.
+PATH_SEGMENT_WIDTH = 6
+PATH_SEPARATOR = '/'
+PATH_END = '~'
+PATH_MAX_LENGTH = 255
+PATH_MAX_DEPTH = PATH_MAX_LENGTH // (PATH_SEGMENT_WIDTH + 1)
+
+
+def path_segment(pk):
+    """Сегмент материализованного пути для id"""
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    encoded = ''
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        encoded = digits[remainder] + encoded
+    return encoded.rjust(PATH_SEGMENT_WIDTH, '0') + PATH_SEPARATOR
+
+
+def subtree_q(prefix, field='path'):
+    """Условие «путь внутри поддерева» в виде диапазона по индексу"""
+    if isinstance(prefix, str):
+        upper = prefix + PATH_END
+    else:
+        upper = Concat(prefix, Value(PATH_END))
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+
+
+class CatalogQuerySet(LoaderQuerySet):
+    """
+    QuerySet моделей каталога.
+
+    Массовые update, bulk_create и bulk_update записывают события в OutboxEvent
+    в той же транзакции, что и само изменение. without_outbox() отключает
+    запись для изменений, которые не интересны подписчикам (например, остатка).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._outbox = True
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._outbox = self._outbox
+        return clone
+
+    def without_outbox(self):
+        clone = self._chain()
+        clone._outbox = False
+        return clone
+
+    def _record(self, pks):
+        OutboxEvent.record(self.model._meta.model_name, pks, OutboxEvent.SAVE)
+
+    def update(self, **kwargs):
+        if not self._outbox:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            self._record(pks)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not self._outbox:
+            return super().bulk_create(objs, *args, **kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            self._record([obj.pk for obj in objs if obj.pk is not None])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self._outbox:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            self._record([obj.pk for obj in objs])
+        return rows
+
+
+class CatalogModel(models.Model):
+    """Модель каталога: сохранение и событие outbox (сигнал post_save) в одной транзакции"""
+    objects = CatalogQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class Category(CatalogModel):
+    """Категория товаров (узел дерева произвольной глубины)"""
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='children',
+        verbose_name='Родительская категория'
+    )
     name = models.CharField(max_length=200, verbose_name='Наименование')
     slug = models.SlugField(max_length=200, unique=True, verbose_name='Slug')
     image = models.ImageField(upload_to='categories/', verbose_name='Изображение')
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH, db_index=True, editable=False, default='', verbose_name='Путь'
+    )
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
@@ -20,9 +130,66 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        if self.parent_id is None:
+            return
+        if self.pk and (self.parent_id == self.pk or self.parent.path.startswith(self.path or '-')):
+            raise ValidationError({'parent': 'Категория не может быть вложена в саму себя'})
+        if self.parent.depth + 1 >= PATH_MAX_DEPTH:
+            raise ValidationError({'parent': f'Максимальная глубина дерева — {PATH_MAX_DEPTH}'})
+
+    def save(self, *args, **kwargs):
+        parent_path = self.parent.path if self.parent_id else ''
+        if self.pk and self.path and parent_path.startswith(self.path):
+            raise ValueError('Категория не может быть вложена в саму себя')
+        super().save(*args, **kwargs)
+
+        old_path, old_depth = self.path, self.depth
+        self.path = parent_path + path_segment(self.pk)
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+        if self.path == old_path:
+            return
+        # Событие о самой категории уже записал post_save
+        Category.objects.without_outbox().filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        if old_path:
+            self._move_subtree(old_path, self.path, self.depth - old_depth)
+
+    def _move_subtree(self, old_path, new_path, depth_delta):
+        """Переписать пути потомков одним UPDATE на таблицу"""
+        tail = Substr('path', len(old_path) + 1)
+        Category.objects.filter(subtree_q(old_path)).exclude(pk=self.pk).update(
+            path=Concat(Value(new_path), tail), depth=F('depth') + depth_delta
+        )
+        SubCategory.objects.filter(subtree_q(old_path)).update(path=Concat(Value(new_path), tail))
+
+    @classmethod
+    def rebuild_paths(cls):
+        """Пересчитать пути всех категорий и подкатегорий (после bulk_create или loaddata)"""
+        nodes = list(cls.objects.order_by('pk').values_list('pk', 'parent_id'))
+        parents = dict(nodes)
+        paths = {}
+
+        def resolve(pk):
+            if pk not in paths:
+                parent_id = parents[pk]
+                paths[pk] = (resolve(parent_id) if parent_id else '') + path_segment(pk)
+            return paths[pk]
+
+        categories = []
+        for pk, parent_id in nodes:
+            path = resolve(pk)
+            categories.append(cls(pk=pk, path=path, depth=len(path) // (PATH_SEGMENT_WIDTH + 1) - 1))
+        cls.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
 
-class SubCategory(models.Model):
-    """Подкатегория товаров"""
+        subcategories = [
+            SubCategory(pk=pk, path=paths[category_id] + path_segment(pk))
+            for pk, category_id in SubCategory.objects.values_list('pk', 'category_id')
+        ]
+        SubCategory.objects.bulk_update(subcategories, ['path'], batch_size=500)
+
+
+class SubCategory(CatalogModel):
+    """Подкатегория товаров (лист дерева категорий, к которому привязаны продукты)"""
     category = models.ForeignKey(
         Category, 
         on_delete=models.CASCADE, 
@@ -32,6 +199,9 @@ class SubCategory(models.Model):
     name = models.CharField(max_length=200, verbose_name='Наименование')
     slug = models.SlugField(max_length=200, unique=True, verbose_name='Slug')
     image = models.ImageField(upload_to='subcategories/', verbose_name='Изображение')
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH, db_index=True, editable=False, default='', verbose_name='Путь'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
@@ -43,8 +213,15 @@ class SubCategory(models.Model):
     def __str__(self):
         return f"{self.category.name} > {self.name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        path = self.category.path + path_segment(self.pk)
+        if path != self.path:
+            self.path = path
+            SubCategory.objects.without_outbox().filter(pk=self.pk).update(path=path)
 
-class ProductImage(models.Model):
+
+class ProductImage(CatalogModel):
     """Изображения продуктов в разных размерах"""
     product = models.ForeignKey(
         'Product',
@@ -67,7 +244,7 @@ class ProductImage(models.Model):
         return f"Изображение для {self.product.name}"
 
 
-class Product(models.Model):
+class Product(CatalogModel):
     """Продукт"""
     subcategory = models.ForeignKey(
         SubCategory,
@@ -84,7 +261,14 @@ class Product(models.Model):
         verbose_name='Цена'
     )
     description = models.TextField(blank=True, null=True, verbose_name='Описание')
-    is_available = models.BooleanField(default=True, verbose_name='Доступен')
+    stock = models.PositiveIntegerField(default=0, verbose_name='Остаток на складе')
+    # Выводится из остатка; резервы в корзинах уже вычтены из stock
+    is_available = models.GeneratedField(
+        expression=models.ExpressionWrapper(Q(stock__gt=0), output_field=models.BooleanField()),
+        output_field=models.BooleanField(),
+        db_persist=True,
+        verbose_name='Доступен'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
@@ -104,6 +288,8 @@ class Product(models.Model):
 
 class Cart(models.Model):
     """Корзина пользователя"""
+    objects = LoaderQuerySet.as_manager()
+
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -134,6 +320,8 @@ class Cart(models.Model):
 
 class CartItem(models.Model):
     """Элемент корзины"""
+    objects = LoaderQuerySet.as_manager()
+
     cart = models.ForeignKey(
         Cart,
         on_delete=models.CASCADE,
@@ -166,3 +354,281 @@ class CartItem(models.Model):
     def total_price(self):
         """Общая стоимость элемента корзины"""
         return self.product.price * self.quantity
+
+
+class StockReservation(models.Model):
+    """Резерв остатка под позицию корзины; снимается при удалении позиции или по истечении срока"""
+    cart_item = models.OneToOneField(
+        CartItem,
+        on_delete=models.CASCADE,
+        related_name='reservation',
+        verbose_name='Элемент корзины'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Продукт'
+    )
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Действует до')
+
+    class Meta:
+        verbose_name = 'Резерв'
+        verbose_name_plural = 'Резервы'
+        ordering = ['expires_at']
+
+    def __str__(self):
+        return f"{self.product_id} x{self.quantity} до {self.expires_at:%Y-%m-%d %H:%M}"
+
+
+class ProductPopularity(models.Model):
+    """
+    Рейтинг популярности продукта.
+
+    score хранится в «прямом» затухании: вклад события умножается на
+    2 ** ((t - epoch) / half_life), поэтому сортировка по score эквивалентна
+    сортировке по затухающему рейтингу, а обновление — простое сложение.
+    Точка отсчета epoch хранится в PopularityEpoch.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Продукт'
+    )
+    score = models.FloatField(default=0, db_index=True, verbose_name='Рейтинг')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Популярность продукта'
+        verbose_name_plural = 'Популярность продуктов'
+        ordering = ['-score']
+
+    def __str__(self):
+        return f"{self.product_id}: {self.score:.2f}"
+
+
+class PopularityEpoch(models.Model):
+    """
+    Точка отсчета прямого затухания рейтингов (единственная строка).
+
+    Когда множитель 2 ** ((t - epoch) / half_life) становится слишком
+    большим, точка отсчета переносится вперед, а все рейтинги умножаются
+    на обратный множитель одним UPDATE.
+    """
+    epoch = models.FloatField(verbose_name='Точка отсчета (unix time)')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Точка отсчета популярности'
+        verbose_name_plural = 'Точки отсчета популярности'
+
+    def __str__(self):
+        return f"{self.epoch:.0f}"
+
+
+class RelatedProduct(models.Model):
+    """Продукт, который часто покупают вместе с данным (результат build_related_products)"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='related_links',
+        verbose_name='Продукт'
+    )
+    related = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Связанный продукт'
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name='Позиция')
+    score = models.FloatField(verbose_name='Оценка')
+
+    class Meta:
+        verbose_name = 'Связанный продукт'
+        verbose_name_plural = 'Связанные продукты'
+        unique_together = ['product', 'rank']
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id}"
+
+
+class Order(models.Model):
+    """Заказ, оформленный из корзины"""
+    objects = LoaderQuerySet.as_manager()
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='orders',
+        verbose_name='Пользователь'
+    )
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Сумма')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Заказ'
+        verbose_name_plural = 'Заказы'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Заказ №{self.pk}"
+
+
+class OrderLine(models.Model):
+    """Позиция заказа; название и цена зафиксированы на момент оформления"""
+    objects = LoaderQuerySet.as_manager()
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='lines',
+        verbose_name='Заказ'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+',
+        verbose_name='Продукт'
+    )
+    name = models.CharField(max_length=200, verbose_name='Наименование')
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Позиция заказа'
+        verbose_name_plural = 'Позиции заказа'
+        ordering = ['order', 'pk']
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+
+class IdempotencyKey(models.Model):
+    """Ответ на запрос с заголовком Idempotency-Key; повтор с тем же ключом получает его же"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Пользователь'
+    )
+    key = models.CharField(max_length=255, verbose_name='Ключ')
+    fingerprint = models.CharField(max_length=64, verbose_name='Отпечаток запроса')
+    response_status = models.PositiveSmallIntegerField(null=True, verbose_name='Код ответа')
+    response_body = models.JSONField(null=True, verbose_name='Тело ответа')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        unique_together = ['user', 'key']
+
+    def __str__(self):
+        return self.key
+
+
+class OutboxEvent(models.Model):
+    """Событие изменения каталога; пишется в той же транзакции, что и изменение (см. shop/outbox.py)"""
+    SAVE = 'save'
+    DELETE = 'delete'
+    ACTIONS = [(SAVE, 'Сохранение'), (DELETE, 'Удаление')]
+
+    model = models.CharField(max_length=50, verbose_name='Модель')
+    object_id = models.PositiveBigIntegerField(verbose_name='ID объекта')
+    action = models.CharField(max_length=10, choices=ACTIONS, verbose_name='Действие')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Данные')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Событие каталога'
+        verbose_name_plural = 'События каталога'
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"{self.model}:{self.object_id} {self.action}"
+
+    @classmethod
+    def record(cls, model, object_ids, action, payload=None):
+        """Записать события для списка объектов одной модели"""
+        cls.objects.bulk_create(
+            [cls(model=model, object_id=pk, action=action, payload=payload or {}) for pk in object_ids],
+            batch_size=500,
+        )
+
+
+class Job(models.Model):
+    """Фоновая задача в очереди на базе БД (см. shop/jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'В очереди'), (RUNNING, 'Выполняется'), (DONE, 'Выполнена'), (FAILED, 'Ошибка')]
+
+    task = models.CharField(max_length=200, verbose_name='Задача')
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name='Аргументы')
+    priority = models.SmallIntegerField(default=0, verbose_name='Приоритет')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Не раньше')
+    locked_by = models.CharField(max_length=64, blank=True, default='', verbose_name='Воркер')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Занята до')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-priority', 'run_after', 'pk']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='shop_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} [{self.status}]"
+
+
+class Lease(models.Model):
+    """Аренда для процесса, который должен работать в одном экземпляре (см. shop/leases.py)"""
+    name = models.CharField(max_length=100, primary_key=True, verbose_name='Имя')
+    owner = models.CharField(max_length=64, blank=True, default='', verbose_name='Владелец')
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name='Действует до')
+
+    class Meta:
+        verbose_name = 'Аренда'
+        verbose_name_plural = 'Аренды'
+
+    def __str__(self):
+        return self.name
+
+
+class CatalogChange(models.Model):
+    """
+    Журнал изменений каталога для синхронизации клиентов (см. shop/sync.py).
+
+    Для каждого объекта хранится только последнее изменение: при новой записи
+    старая удаляется, поэтому журнал не растет быстрее каталога. pk — номер
+    изменения: он назначается одним процессом доставки outbox и только растет.
+    """
+    model = models.CharField(max_length=50, verbose_name='Модель')
+    object_id = models.PositiveBigIntegerField(verbose_name='ID объекта')
+    deleted = models.BooleanField(default=False, verbose_name='Удален')
+    changed_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Изменение каталога'
+        verbose_name_plural = 'Изменения каталога'
+        ordering = ['pk']
+        unique_together = ['model', 'object_id']
+
+    def __str__(self):
+        return f"#{self.pk} {self.model}:{self.object_id}"
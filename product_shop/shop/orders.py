@@ -0,0 +1,109 @@
+"""
+Оформление заказа из корзины и идемпотентность повторных запросов.
+
+Заказ создается в одной короткой транзакции: позиции корзины читаются одним
+запросом, позиции заказа вставляются одним ``bulk_create``, корзина очищается
+одним удалением. Повтор запроса с тем же заголовком ``Idempotency-Key``
+получает сохраненный ответ вместо второго заказа; устаревшие ключи удаляет
+команда ``purge_carts``.
+"""
+import hashlib
+
+from django.db import transaction
+
+from . import stock
+from .models import CartItem, IdempotencyKey, Order, OrderLine, StockReservation
+
+BATCH_SIZE = 500
+
+
+class EmptyCart(Exception):
+    """В корзине нет позиций"""
+
+
+class IdempotencyConflict(Exception):
+    """Ключ уже использован для другого запроса"""
+
+
+def fingerprint(request):
+    """Отпечаток запроса: повтор с тем же ключом должен совпадать с оригиналом"""
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, request.body):
+        digest.update(part if isinstance(part, bytes) else part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def run_idempotent(user, key, request_fingerprint, handler):
+    """
+    Выполнить handler() -> (status, body) не более одного раза для ключа.
+
+    Возвращает (status, body, replayed). Запись ключа создается в той же
+    транзакции, что и результат, поэтому ошибка handler не оставляет ключ
+    «занятым» и запрос можно повторить.
+    """
+    with transaction.atomic():
+        record, created = IdempotencyKey.objects.get_or_create(
+            user=user, key=key, defaults={'fingerprint': request_fingerprint}
+        )
+        if not created:
+            if record.fingerprint != request_fingerprint:
+                raise IdempotencyConflict('Ключ идемпотентности уже использован для другого запроса')
+            return record.response_status, record.response_body, True
+        status, body = handler()
+        record.response_status = status
+        record.response_body = body
+        record.save(update_fields=['response_status', 'response_body'])
+    return status, body, False
+
+
+def purge_idempotency_keys(before, batch_size=BATCH_SIZE):
+    """Удалить ключи, созданные раньше before, порциями; вернуть их число"""
+    deleted = 0
+    while True:
+        pks = list(
+            IdempotencyKey.objects.filter(created_at__lt=before)
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
+
+
+def checkout(user):
+    """Оформить корзину пользователя в заказ; резервы становятся продажей"""
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.filter(cart__user=user)
+            .select_related('product', 'reservation').order_by('pk')
+        )
+        if not items:
+            raise EmptyCart('Корзина пуста')
+
+        for item in items:
+            reservation = getattr(item, 'reservation', None)
+            held = reservation.quantity if reservation else 0
+            # Резерв мог истечь и быть снят — добираем недостающее
+            if item.quantity > held and not stock.take(item.product_id, item.quantity - held):
+                raise stock.OutOfStock(item.product_id, item.quantity - held)
+            if item.quantity < held:
+                stock.put_back(item.product_id, held - item.quantity)
+
+        order = Order.objects.create(
+            user=user,
+            total_price=sum(item.product.price * item.quantity for item in items),
+        )
+        OrderLine.objects.bulk_create(
+            [
+                OrderLine(
+                    order=order, product_id=item.product_id, name=item.product.name,
+                    price=item.product.price, quantity=item.quantity,
+                )
+                for item in items
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        # Обнуленный резерв при удалении позиции не возвращается на склад
+        StockReservation.objects.filter(cart_item__cart__user=user).update(quantity=0)
+        CartItem.objects.filter(cart__user=user).delete()
+    return order
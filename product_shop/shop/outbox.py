@@ -0,0 +1,146 @@
+"""
+Доставка событий изменения каталога из таблицы ``OutboxEvent``.
+
+События пишутся в транзакции изменения (сигналы и ``CatalogQuerySet``),
+а ``dispatch`` читает их порциями в порядке pk, схлопывает повторные
+изменения одного объекта и передает порцию каждому обработчику из
+``OUTBOX['HANDLERS']``. Строки удаляются только после успеха всех
+обработчиков, поэтому доставка — «хотя бы один раз»: обработчики должны
+быть идемпотентными.
+
+Порядок доставки важен журналу синхронизации, поэтому порции доставляются
+под арендой ``outbox-dispatch`` (см. ``shop/leases.py``): команда
+``dispatch_outbox`` и задача очереди, запущенные одновременно, не
+обрабатывают порции параллельно.
+"""
+import logging
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import leases, metrics
+from .cache import category_cache, product_cache
+from .models import Category, OutboxEvent, Product, ProductImage, SubCategory, subtree_q
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HANDLERS': ['shop.outbox.invalidate_detail_cache', 'shop.sync.record_catalog_changes'],
+    'BATCH_SIZE': 500,
+    'LEASE_TIMEOUT': 60,
+}
+
+LEASE_NAME = 'outbox-dispatch'
+
+LAG_BUCKETS = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+ChangeEvent = namedtuple('ChangeEvent', 'model object_id action payload created_at')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OUTBOX', {})}
+
+
+class HandlerError(Exception):
+    """Обработчик outbox завершился ошибкой; порция будет доставлена повторно"""
+
+
+def get_handlers():
+    return [(path, import_string(path)) for path in get_config()['HANDLERS']]
+
+
+def coalesce(rows):
+    """Одно событие на объект: последнее действие, объединенные slug, время первого изменения"""
+    events = {}
+    for row in rows:
+        key = (row.model, row.object_id)
+        previous = events.get(key)
+        payload = dict(row.payload)
+        if previous:
+            payload = {**previous.payload, **payload}
+            payload['slugs'] = sorted(set(previous.payload.get('slugs', [])) | set(row.payload.get('slugs', [])))
+        created_at = previous.created_at if previous else row.created_at
+        events[key] = ChangeEvent(row.model, row.object_id, row.action, payload, created_at)
+    return list(events.values())
+
+
+def dispatch(batch_size=None, handlers=None):
+    """Доставить одну порцию; вернуть число обработанных строк outbox (0, если доставляет другой процесс)"""
+    config = get_config()
+    with leases.held(LEASE_NAME, config['LEASE_TIMEOUT']) as acquired:
+        if not acquired:
+            metrics.inc('shop_outbox_lease_busy_total')
+            return 0
+        return _dispatch(batch_size or config['BATCH_SIZE'], get_handlers() if handlers is None else handlers)
+
+
+def _dispatch(batch_size, handlers):
+    rows = list(OutboxEvent.objects.order_by('pk')[:batch_size])
+    if not rows:
+        metrics.set_gauge('shop_outbox_lag_seconds', 0)
+        return 0
+
+    events = coalesce(rows)
+    for path, handler in handlers:
+        try:
+            handler(events)
+        except Exception as exc:
+            metrics.inc('shop_outbox_handler_errors_total', handler=path)
+            logger.exception('Обработчик outbox %s завершился ошибкой', path)
+            raise HandlerError(f'Обработчик {path} завершился ошибкой: {exc}') from exc
+
+    OutboxEvent.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    now = timezone.now()
+    for event in events:
+        metrics.observe('shop_outbox_lag_seconds_histogram', (now - event.created_at).total_seconds(), LAG_BUCKETS)
+    metrics.set_gauge('shop_outbox_lag_seconds', (now - rows[0].created_at).total_seconds())
+    metrics.inc('shop_outbox_rows_total', len(rows))
+    metrics.inc('shop_outbox_events_total', len(events))
+    return len(rows)
+
+
+def invalidate_detail_cache(events):
+    """Обработчик: сбросить кэш деталей объектов и всех зависящих от них ответов"""
+    ids = defaultdict(set)
+    product_slugs, category_slugs = set(), set()
+    category_ids = set()
+    for event in events:
+        ids[event.model].add(event.object_id)
+        if event.model == 'product':
+            product_slugs.update(event.payload.get('slugs', []))
+        elif event.model == 'category':
+            category_slugs.update(event.payload.get('slugs', []))
+        elif event.model == 'subcategory' and event.payload.get('category_id'):
+            category_ids.add(event.payload['category_id'])
+        elif event.model == 'productimage' and event.payload.get('product_id'):
+            ids['product'].add(event.payload['product_id'])
+
+    if ids['productimage']:
+        ids['product'].update(
+            ProductImage.objects.filter(pk__in=ids['productimage']).values_list('product_id', flat=True)
+        )
+    products = Q(pk__in=ids['product'])
+    if ids['subcategory']:
+        # В деталях категории — список подкатегорий, в деталях продукта — название подкатегории
+        category_ids.update(
+            SubCategory.objects.filter(pk__in=ids['subcategory']).values_list('category_id', flat=True)
+        )
+        products |= Q(subcategory_id__in=ids['subcategory'])
+    if ids['category']:
+        # В деталях дочерних категорий — slug родителя, в деталях продуктов — название категории
+        for slug, path in Category.objects.filter(pk__in=ids['category']).values_list('slug', 'path'):
+            category_slugs.add(slug)
+            if path:
+                products |= subtree_q(path, field='subcategory__path')
+        category_slugs.update(
+            Category.objects.filter(parent_id__in=ids['category']).values_list('slug', flat=True)
+        )
+    if category_ids:
+        category_slugs.update(Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True))
+
+    product_slugs.update(Product.objects.filter(products).values_list('slug', flat=True))
+    product_cache.invalidate(*product_slugs)
+    category_cache.invalidate(*category_slugs)
@@ -0,0 +1,238 @@
+"""
+Приблизительный счетчик популярности продуктов.
+
+Просмотры и добавления в корзину учитываются в памяти процесса:
+count-min sketch дает оценку частоты, куча top-K хранит кандидатов в
+лидеры. Раз в ``FLUSH_INTERVAL`` секунд фоновый поток процесса
+записывает накопленные оценки лидеров в ``ProductPopularity`` одним
+INSERT ... ON CONFLICT; запросы сброс не ждут.
+
+Вклад события умножается на 2 ** ((t - epoch) / half_life). Чтобы
+множитель не выходил за пределы double, точка отсчета из
+``PopularityEpoch`` переносится вперед, как только показатель степени
+превысит ``RESCALE_EXPONENT``, а сохраненные рейтинги пересчитываются
+одним UPDATE в той же транзакции, что и сброс.
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+
+from . import metrics
+from .models import PopularityEpoch, Product, ProductPopularity
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HALF_LIFE_HOURS': 168,
+    'FLUSH_INTERVAL': 30,
+    'TOP_K': 1000,
+    'SKETCH_WIDTH': 4096,
+    'SKETCH_DEPTH': 4,
+    'VIEW_WEIGHT': 1,
+    'CART_WEIGHT': 5,
+}
+
+# Начальная точка отсчета для прямого затухания (строка PopularityEpoch
+# создается миграцией с этим значением)
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+# Точка отсчета переносится, когда множитель превысит 2 ** RESCALE_EXPONENT:
+# так он остается далеко от переполнения и не теряет точность
+RESCALE_EXPONENT = 32
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POPULARITY', {})}
+
+
+def decay_factor(timestamp=None, half_life_hours=None, epoch=EPOCH):
+    """Множитель вклада события в момент timestamp относительно epoch"""
+    timestamp = time.time() if timestamp is None else timestamp
+    half_life = (half_life_hours or get_config()['HALF_LIFE_HOURS']) * 3600
+    return math.pow(2.0, (timestamp - epoch) / half_life)
+
+
+def lock_epoch(now, half_life_hours=None):
+    """
+    Заблокировать точку отсчета до конца транзакции и вернуть ее.
+
+    Если множитель на момент now превышает 2 ** RESCALE_EXPONENT, точка
+    отсчета переносится на now, а рейтинги пересчитываются одним UPDATE.
+    """
+    half_life = (half_life_hours or get_config()['HALF_LIFE_HOURS']) * 3600
+    PopularityEpoch.objects.get_or_create(pk=1, defaults={'epoch': EPOCH})
+    # UPDATE первым: блокирует строку (в SQLite — запись в БД), поэтому
+    # перенос и сбросы других процессов не пересекаются
+    PopularityEpoch.objects.filter(pk=1).update(updated_at=datetime.now(timezone.utc))
+    epoch = PopularityEpoch.objects.values_list('epoch', flat=True).get(pk=1)
+    if (now - epoch) / half_life > RESCALE_EXPONENT:
+        # Множитель < 1: при большом разрыве старые рейтинги просто обнуляются
+        ProductPopularity.objects.update(score=F('score') * math.pow(2.0, (epoch - now) / half_life))
+        PopularityEpoch.objects.filter(pk=1).update(epoch=now)
+        metrics.inc('shop_popularity_rescaled_total')
+        epoch = now
+    return epoch
+
+
+class CountMinSketch:
+    """Count-min sketch: оценка частоты сверху с ограниченной памятью"""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('d', bytes(8 * width)) for _ in range(depth)]
+
+    def _indexes(self, item):
+        for seed in range(self.depth):
+            yield hash((seed, item)) % self.width
+
+    def add(self, item, weight=1.0):
+        """Учесть событие и вернуть новую оценку"""
+        estimate = math.inf
+        for row, index in zip(self.rows, self._indexes(item)):
+            row[index] += weight
+            estimate = min(estimate, row[index])
+        return estimate
+
+    def estimate(self, item):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(item)))
+
+
+class TopK:
+    """K элементов с наибольшей оценкой (куча с ленивым удалением)"""
+
+    def __init__(self, k):
+        self.k = k
+        self.items = {}
+        self.heap = []
+
+    def offer(self, item, estimate):
+        if item in self.items or len(self.items) < self.k:
+            self.items[item] = estimate
+            heapq.heappush(self.heap, (estimate, item))
+        elif estimate > self._min():
+            _, evicted = heapq.heappop(self.heap)
+            del self.items[evicted]
+            self.items[item] = estimate
+            heapq.heappush(self.heap, (estimate, item))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(estimate, item) for item, estimate in self.items.items()]
+            heapq.heapify(self.heap)
+
+    def _min(self):
+        # Удаляем устаревшие записи, оставшиеся после обновления оценок
+        while self.heap:
+            estimate, item = self.heap[0]
+            if self.items.get(item) == estimate:
+                return estimate
+            heapq.heappop(self.heap)
+        return -math.inf
+
+    def most_common(self):
+        return sorted(self.items.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class PopularityTracker:
+    """Счетчик популярности одного процесса"""
+
+    def __init__(self):
+        self._after_fork()
+        # Счетчики родителя после fork не наследуются: их сбросит родитель
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+        self._reset()
+        self.thread = None
+        self.stop = threading.Event()
+
+    def _reset(self):
+        config = get_config()
+        self.sketch = CountMinSketch(config['SKETCH_WIDTH'], config['SKETCH_DEPTH'])
+        self.top = TopK(config['TOP_K'])
+
+    def record(self, product_id, weight=1.0):
+        """Учесть событие; поток сброса запускается при первом событии процесса"""
+        with self.lock:
+            self.top.offer(product_id, self.sketch.add(product_id, weight))
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        """Запустить фоновый сброс (FLUSH_INTERVAL = 0 — только вручную)"""
+        if not get_config()['FLUSH_INTERVAL']:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='popularity-flush', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stop.wait(get_config()['FLUSH_INTERVAL']):
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Ошибка сброса популярности')
+
+    def flush(self):
+        """Записать накопленные оценки одним выражением; вернуть число строк"""
+        with self.lock:
+            top = self.top
+            self._reset()
+
+        estimates = top.most_common()
+        if not estimates:
+            return 0
+        try:
+            self._write(estimates)
+        except IntegrityError:
+            # Продукт могли удалить между событием и сбросом
+            existing = set(
+                Product.objects.filter(pk__in=[pk for pk, _ in estimates]).values_list('pk', flat=True)
+            )
+            estimates = [(pk, estimate) for pk, estimate in estimates if pk in existing]
+            if estimates:
+                self._write(estimates)
+        metrics.inc('shop_popularity_flushed_total', len(estimates))
+        return len(estimates)
+
+    def _write(self, estimates):
+        now = time.time()
+        with transaction.atomic():
+            factor = decay_factor(now, epoch=lock_epoch(now))
+            self._upsert([(product_id, estimate * factor) for product_id, estimate in estimates])
+
+    def _upsert(self, deltas):
+        table = connection.ops.quote_name(ProductPopularity._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(datetime.now(timezone.utc))
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(deltas))
+        params = [value for pk, score in deltas for value in (pk, score, now)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (product_id, score, updated_at) VALUES {placeholders} '
+                f'ON CONFLICT (product_id) DO UPDATE SET '
+                f'score = {table}.score + excluded.score, updated_at = excluded.updated_at',
+                params,
+            )
+
+
+tracker = PopularityTracker()
+
+
+def record_view(product_id):
+    tracker.record(product_id, get_config()['VIEW_WEIGHT'])
+
+
+def record_cart_add(product_id, quantity=1):
+    tracker.record(product_id, get_config()['CART_WEIGHT'] * quantity)
@@ -0,0 +1,191 @@
+"""
+Профилирование отдельных запросов в продакшене.
+
+Запрос профилируется, если его прислал сотрудник (JWT пользователя с
+``is_staff``) с заголовком ``X-Profile: 1`` или параметром ``?profile=1``,
+либо он попал в выборку «1 из ``SAMPLE_RATE``». Для такого запроса в
+``PROFILING['DIR']`` сохраняются:
+
+- ``<id>.prof`` — статистика cProfile (``pstats``, snakeviz и т.п.);
+- ``<id>.collapsed`` — сэмплы стека в collapsed-формате для flamegraph.pl
+  и speedscope;
+- ``<id>.json`` — маршрут, статус, длительность и время SQL-запросов.
+
+Идентификатор профиля возвращается в заголовке ``X-Profile-Id``. Список,
+сводка и очистка — команда ``profiles``.
+"""
+import cProfile
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import metrics
+
+DEFAULTS = {
+    'DIR': None,
+    'HEADER': 'X-Profile',
+    'QUERY_PARAM': 'profile',
+    'SAMPLE_RATE': 0,
+    'SAMPLE_INTERVAL': 0.001,
+    'KEEP_DAYS': 7,
+}
+
+# Сколько самых долгих SQL-запросов сохранять в метаданных
+TOP_QUERIES = 20
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def get_profiles_dir():
+    path = Path(get_config()['DIR'] or Path(settings.BASE_DIR) / 'var' / 'profiles')
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _staff_user(request):
+    """Сотрудник, аутентифицированный по JWT, или None"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if result and result[0].is_staff:
+        return result[0]
+    return None
+
+
+def should_profile(request):
+    """Причина профилирования запроса ('staff', 'sample') или None"""
+    config = get_config()
+    requested = (
+        request.headers.get(config['HEADER']) == '1' or request.GET.get(config['QUERY_PARAM']) == '1'
+    )
+    if requested and _staff_user(request) is not None:
+        return 'staff'
+    if config['SAMPLE_RATE'] and random.randrange(config['SAMPLE_RATE']) == 0:
+        return 'sample'
+    return None
+
+
+class StackSampler:
+    """Периодические снимки стека одного потока: «кадр;кадр;кадр» -> число сэмплов"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class SQLTimer:
+    """Обертка для execute_wrapper: время каждого SQL-запроса"""
+
+    def __init__(self):
+        self.queries = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            entry = self.queries[sql]
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+    def summary(self):
+        top = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)[:TOP_QUERIES]
+        return {
+            'count': sum(count for count, _ in self.queries.values()),
+            'time_ms': round(sum(total for _, total in self.queries.values()) * 1000, 3),
+            'top': [
+                {'sql': sql[:1000], 'count': count, 'time_ms': round(total * 1000, 3)}
+                for sql, (count, total) in top
+            ],
+        }
+
+
+def profile_request(request, get_response, reason):
+    """Выполнить запрос под профилировщиком и сохранить профиль"""
+    config = get_config()
+    profiler = cProfile.Profile()
+    timer = SQLTimer()
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        sampler = stack.enter_context(StackSampler(threading.get_ident(), config['SAMPLE_INTERVAL']))
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    duration = time.perf_counter() - start
+
+    match = request.resolver_match
+    profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    directory = get_profiles_dir()
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    (directory / f'{profile_id}.collapsed').write_text(sampler.collapsed())
+    meta = {
+        'id': profile_id,
+        'reason': reason,
+        'created_at': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'route': match.view_name if match is not None else 'unmatched',
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'sql': timer.summary(),
+    }
+    (directory / f'{profile_id}.json').write_text(json.dumps(meta, ensure_ascii=False, indent=2))
+    metrics.inc('shop_profiles_saved_total', reason=reason)
+    response['X-Profile-Id'] = profile_id
+    return response
+
+
+def load_profiles(route=None):
+    """Метаданные сохраненных профилей, новые первыми"""
+    profiles = []
+    for path in get_profiles_dir().glob('*.json'):
+        try:
+            meta = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if route is None or meta.get('route') == route:
+            profiles.append(meta)
+    return sorted(profiles, key=lambda meta: meta['created_at'], reverse=True)
@@ -0,0 +1,154 @@
+"""
+«Часто покупают вместе»: офлайн-расчет совместной встречаемости товаров.
+
+Корзинами считаются и текущие корзины, и оформленные заказы: при оформлении
+позиции корзины удаляются, а их состав остается в строках заказа.
+Корзины и заказы читаются порциями по первичному ключу. Для каждой порции пары
+товаров строятся векторно (NumPy), кодируются в один int64
+``i * n_products + j`` и сливаются с накопленными счетчиками, поэтому
+в памяти держится только разреженная матрица встречаемости, а не все
+позиции корзин.
+"""
+import numpy as np
+from django.db import transaction
+
+from .models import Cart, CartItem, Order, OrderLine, Product, RelatedProduct
+
+METRICS = ('lift', 'cosine')
+
+
+class CooccurrenceCounter:
+    """Разреженная матрица совместной встречаемости товаров"""
+
+    def __init__(self, product_ids, max_cart_size=50):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.size = len(self.product_ids)
+        self.max_cart_size = max_cart_size
+        self.item_counts = np.zeros(self.size, dtype=np.int64)
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        self.pair_counts = np.empty(0, dtype=np.int64)
+        self.carts = 0
+
+    def add_chunk(self, cart_ids, product_ids):
+        """Учесть порцию позиций корзин (массивы одинаковой длины)"""
+        if not len(cart_ids) or not self.size:
+            return
+        cart_ids = np.asarray(cart_ids, dtype=np.int64)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        # Товары, удаленные после начала расчета, пропускаются
+        index = np.searchsorted(self.product_ids, product_ids)
+        known = (index < self.size) & (self.product_ids[np.minimum(index, self.size - 1)] == product_ids)
+        cart_ids, index = cart_ids[known], index[known]
+
+        # Уникальные пары (корзина, товар), отсортированные по корзине и товару
+        order = np.lexsort((index, cart_ids))
+        cart_ids, index = cart_ids[order], index[order]
+        distinct = np.ones(len(cart_ids), dtype=bool)
+        distinct[1:] = (cart_ids[1:] != cart_ids[:-1]) | (index[1:] != index[:-1])
+        cart_ids, index = cart_ids[distinct], index[distinct]
+
+        self.item_counts += np.bincount(index, minlength=self.size)
+        carts, starts, sizes = np.unique(cart_ids, return_index=True, return_counts=True)
+        self.carts += len(carts)
+
+        keys = []
+        for cart_size in np.unique(sizes):
+            if cart_size < 2 or cart_size > self.max_cart_size:
+                continue
+            # Все корзины одного размера — матрица (корзины x товары)
+            group_starts = starts[sizes == cart_size]
+            matrix = index[group_starts[:, None] + np.arange(cart_size)]
+            left, right = np.triu_indices(cart_size, k=1)
+            keys.append((matrix[:, left] * self.size + matrix[:, right]).ravel())
+        if keys:
+            chunk_keys, chunk_counts = np.unique(np.concatenate(keys), return_counts=True)
+            self._merge(chunk_keys, chunk_counts)
+
+    def _merge(self, keys, counts):
+        merged, inverse = np.unique(np.concatenate([self.pair_keys, keys]), return_inverse=True)
+        self.pair_counts = np.bincount(
+            inverse, weights=np.concatenate([self.pair_counts, counts]), minlength=len(merged)
+        ).astype(np.int64)
+        self.pair_keys = merged
+
+    def top_neighbours(self, top_n=10, metric='lift', min_support=2):
+        """Топ-N соседей каждого товара: массивы (product_id, related_id, rank, score)"""
+        support = self.pair_counts >= min_support
+        keys, counts = self.pair_keys[support], self.pair_counts[support].astype(np.float64)
+        left, right = np.divmod(keys, self.size)
+        left_counts = self.item_counts[left].astype(np.float64)
+        right_counts = self.item_counts[right].astype(np.float64)
+        if metric == 'cosine':
+            scores = counts / np.sqrt(left_counts * right_counts)
+        else:
+            scores = counts * self.carts / (left_counts * right_counts)
+
+        # Каждая пара дает соседа в обе стороны
+        source = np.concatenate([left, right])
+        target = np.concatenate([right, left])
+        scores = np.concatenate([scores, scores])
+        order = np.lexsort((target, -scores, source))
+        source, target, scores = source[order], target[order], scores[order]
+
+        group_start = np.searchsorted(source, source, side='left')
+        rank = np.arange(len(source)) - group_start
+        keep = rank < top_n
+        return (
+            self.product_ids[source[keep]],
+            self.product_ids[target[keep]],
+            rank[keep],
+            scores[keep],
+        )
+
+
+def _iter_chunks(model, item_model, field, chunk_size):
+    """Пары (id корзины, id товара) порциями по chunk_size родителей (keyset-пагинация по pk)"""
+    last_pk = 0
+    while True:
+        parent_ids = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not parent_ids:
+            return
+        rows = item_model.objects.filter(
+            **{f'{field}__gte': parent_ids[0], f'{field}__lte': parent_ids[-1], 'product_id__isnull': False}
+        ).order_by().values_list(field, 'product_id')
+        data = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+        yield data[:, 0], data[:, 1]
+        last_pk = parent_ids[-1]
+
+
+def iter_cart_chunks(chunk_size=10000):
+    """Позиции корзин порциями по chunk_size корзин"""
+    return _iter_chunks(Cart, CartItem, 'cart_id', chunk_size)
+
+
+def iter_order_chunks(chunk_size=10000):
+    """Строки заказов порциями по chunk_size заказов; заказ — одна корзина"""
+    return _iter_chunks(Order, OrderLine, 'order_id', chunk_size)
+
+
+def build_related_products(top_n=10, metric='lift', min_support=2, chunk_size=10000,
+                           max_cart_size=50, batch_size=1000):
+    """Пересчитать таблицу RelatedProduct; вернуть число записей"""
+    product_ids = np.fromiter(
+        Product.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64
+    )
+    counter = CooccurrenceCounter(product_ids, max_cart_size=max_cart_size)
+    # Порции корзин и заказов не смешиваются, поэтому их pk не пересекаются
+    for chunks in (iter_cart_chunks(chunk_size), iter_order_chunks(chunk_size)):
+        for basket_ids, item_product_ids in chunks:
+            counter.add_chunk(basket_ids, item_product_ids)
+
+    sources, targets, ranks, scores = counter.top_neighbours(top_n, metric, min_support)
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        for start in range(0, len(sources), batch_size):
+            stop = start + batch_size
+            RelatedProduct.objects.bulk_create([
+                RelatedProduct(product_id=int(source), related_id=int(target), rank=int(rank), score=float(score))
+                for source, target, rank, score in zip(
+                    sources[start:stop], targets[start:stop], ranks[start:stop], scores[start:stop]
+                )
+            ])
+    return len(sources)
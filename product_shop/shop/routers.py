@@ -0,0 +1,110 @@
+"""
+Чтения каталога с реплики.
+
+В рамках HTTP-запроса (см. ``DatabaseRoutingMiddleware``) чтения моделей
+каталога идут на ``DB_ROUTING['READ_ALIAS']``, все остальное — на основную
+БД. После первого выполненного изменяющего запроса (его замечает
+execute_wrapper основного соединения, а не ``db_for_write``: Django
+вызывает его и для чтений вроде ``get_or_create``, нашедшего объект)
+запрос до конца читает с основной БД, а клиент
+получает cookie, с которой следующие ``STICKY_SECONDS`` секунд его чтения
+тоже идут на основную БД: он видит свои изменения, даже если реплика
+отстает. Вне запросов (команды, воркеры), внутри транзакций основной БД
+и в блоке ``primary()`` реплика не используется.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'READ_ALIAS': None,
+    'STICKY_SECONDS': 10,
+    'STICKY_COOKIE': 'db_pinned',
+}
+
+# Журнал изменений читается вместе с каталогом, чтобы синхронизация видела один снимок
+ROUTED_MODELS = {'category', 'subcategory', 'product', 'productimage', 'catalogchange'}
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DB_ROUTING', {})}
+
+
+class RoutingScope:
+    """Состояние маршрутизации одного запроса"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+    def detect_write(self, execute, sql, params, many, context):
+        """execute_wrapper: изменяющий запрос привязывает запрос и клиента к основной БД"""
+        result = execute(sql, params, many, context)
+        if not self.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            self.pinned = self.wrote = True
+        return result
+
+
+_scope = ContextVar('db_routing_scope', default=None)
+
+
+@contextmanager
+def request_scope(pinned=False):
+    """Разрешить чтения с реплики до выхода из блока; pinned — сразу читать с основной БД"""
+    scope = RoutingScope(pinned)
+    token = _scope.set(scope)
+    try:
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(scope.detect_write):
+            yield scope
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def primary():
+    """Читать с основной БД до выхода из блока, не привязывая клиента cookie"""
+    scope = _scope.get()
+    if scope is None or scope.pinned:
+        yield
+        return
+    scope.pinned = True
+    try:
+        yield
+    finally:
+        # Запись внутри блока оставляет привязку до конца запроса
+        scope.pinned = scope.wrote
+
+
+class ReadReplicaRouter:
+    """Чтения каталога — на реплику, записи и остальные модели — на основную БД"""
+
+    def db_for_read(self, model, **hints):
+        alias = get_config()['READ_ALIAS']
+        scope = _scope.get()
+        if not alias or scope is None or scope.pinned:
+            return None
+        if model._meta.app_label != 'shop' or model._meta.model_name not in ROUTED_MODELS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Внутри транзакции читается то, что она видит
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия основной БД: объект с реплики можно связать с объектом основной
+        aliases = {DEFAULT_DB_ALIAS, get_config()['READ_ALIAS']}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == get_config()['READ_ALIAS'] and db != DEFAULT_DB_ALIAS:
+            return False
+        return None
@@ -0,0 +1,142 @@
+"""
+Предсобранная схема OpenAPI.
+
+Схема генерируется один раз на версию кода (командой
+``manage.py build_openapi_schema`` при сборке или при первом обращении),
+сохраняется на диск и отдается из памяти процесса вместе с заранее сжатыми
+вариантами тела.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from importlib.metadata import version as package_version
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+
+from . import metrics
+from .compression import precompress
+
+FORMATS = {
+    'json': ('application/vnd.oai.openapi+json', OpenApiJsonRenderer),
+    'yaml': ('application/vnd.oai.openapi', OpenApiYamlRenderer),
+}
+SOURCE_DIRS = ('config', 'shop')
+
+
+def get_schema_dir():
+    """Каталог для файлов схемы"""
+    path = getattr(settings, 'OPENAPI_SCHEMA_DIR', None) or Path(settings.BASE_DIR) / 'var' / 'openapi'
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def code_version():
+    """Версия кода: CODE_VERSION из настроек или хэш исходников"""
+    configured = getattr(settings, 'CODE_VERSION', None)
+    if configured:
+        return configured
+    digest = hashlib.sha256()
+    digest.update(package_version('drf-spectacular').encode())
+    digest.update(repr(sorted(settings.SPECTACULAR_SETTINGS.items())).encode())
+    for directory in SOURCE_DIRS:
+        for path in sorted((Path(settings.BASE_DIR) / directory).rglob('*.py')):
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+class SchemaArtifact:
+    """Отрендеренная схема в одном формате"""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.precompressed = precompress(body)
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def generate():
+    """Сгенерировать схему во всех форматах"""
+    schema = SchemaGenerator().get_schema(request=None, public=True)
+    return {
+        fmt: renderer().render(schema, renderer_context={})
+        for fmt, (content_type, renderer) in FORMATS.items()
+    }
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+
+def build(version=None, force=False):
+    """Сохранить схему текущей версии кода на диск; вернуть пути файлов"""
+    version = version or code_version()
+    directory = get_schema_dir()
+    paths = {fmt: directory / f'schema-{version}.{fmt}' for fmt in FORMATS}
+    if force or not all(path.exists() for path in paths.values()):
+        for fmt, body in generate().items():
+            _write_atomic(paths[fmt], body)
+        for stale in directory.glob('schema-*'):
+            if stale not in paths.values():
+                stale.unlink(missing_ok=True)
+    return paths
+
+
+_artifacts = None
+_lock = threading.Lock()
+
+
+def get_artifacts():
+    """Схема в памяти процесса; при отсутствии на диске генерируется один раз"""
+    global _artifacts
+    if _artifacts is not None:
+        return _artifacts
+    with _lock:
+        if _artifacts is None:
+            paths = build()
+            _artifacts = {
+                fmt: SchemaArtifact(paths[fmt].read_bytes(), FORMATS[fmt][0])
+                for fmt in FORMATS
+            }
+    return _artifacts
+
+
+def reset():
+    """Сбросить схему в памяти (используется в тестах)"""
+    global _artifacts
+    with _lock:
+        _artifacts = None
+
+
+class CachedSchemaView(View):
+    """Схема OpenAPI из предсобранного артефакта с ETag и заранее сжатым телом"""
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format')
+        if fmt not in FORMATS:
+            fmt = 'json' if 'json' in request.headers.get('Accept', '') else 'yaml'
+        cached = _artifacts is not None
+        artifact = get_artifacts()[fmt]
+        metrics.cache_access('openapi_schema', cached)
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match.removeprefix('W/') == artifact.etag:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(artifact.body, content_type=artifact.content_type)
+            response.precompressed = artifact.precompressed
+        response['ETag'] = artifact.etag
+        response['Cache-Control'] = 'public, max-age=300'
+        patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+        return response
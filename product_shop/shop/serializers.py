@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Category, SubCategory, Product, ProductImage, Cart, CartItem
+from .models import Category, SubCategory, Product, ProductImage, Cart, CartItem, Order, OrderLine
+from . import carts, popularity, stock
 
 
 class SubCategorySerializer(serializers.ModelSerializer):
@@ -15,11 +16,21 @@ class CategorySerializer(serializers.ModelSerializer):
     """Сериализатор категории с подкатегориями"""
     subcategories = SubCategorySerializer(many=True, read_only=True)
     image = serializers.ImageField(required=False)
+    parent = serializers.SlugRelatedField(slug_field='slug', read_only=True)
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'image', 'subcategories']
-        read_only_fields = ['id']
+        fields = ['id', 'name', 'slug', 'image', 'parent', 'depth', 'subcategories']
+        read_only_fields = ['id', 'depth']
+
+
+class CategoryTreeSerializer(serializers.ModelSerializer):
+    """Сериализатор узла дерева категорий (без вложенных запросов)"""
+    
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'image', 'depth']
+        read_only_fields = fields
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -104,16 +115,12 @@ class CartItemCreateUpdateSerializer(serializers.ModelSerializer):
         except Product.DoesNotExist:
             raise serializers.ValidationError("Продукт не найден")
         
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        try:
+            cart_item = carts.run(carts.add_item, cart, product, quantity)
+        except stock.OutOfStock:
+            raise serializers.ValidationError("Недостаточно товара на складе")
         
+        popularity.record_cart_add(product.id, quantity)
         return cart_item
     
     def update(self, instance, validated_data):
@@ -123,11 +130,12 @@ class CartItemCreateUpdateSerializer(serializers.ModelSerializer):
         
         quantity = validated_data.get('quantity', instance.quantity)
         if quantity <= 0:
-            instance.delete()
-            return instance
+            return carts.run(carts.remove_item, instance)
         
-        instance.quantity = quantity
-        instance.save()
+        try:
+            carts.run(carts.set_quantity, instance, quantity)
+        except stock.OutOfStock:
+            raise serializers.ValidationError("Недостаточно товара на складе")
         return instance
 
 
@@ -143,3 +151,52 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'total_items', 'total_price']
 
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    """Сериализатор позиции заказа"""
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'product', 'name', 'price', 'quantity', 'total_price']
+        read_only_fields = fields
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    """Сериализатор заказа"""
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'total_price', 'created_at', 'lines']
+        read_only_fields = fields
+
+
+class SyncCategorySerializer(serializers.ModelSerializer):
+    """Категория для синхронизации: связи — по id, без вложенных объектов"""
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'image', 'parent', 'depth', 'updated_at']
+        read_only_fields = fields
+
+
+class SyncSubCategorySerializer(serializers.ModelSerializer):
+    """Подкатегория для синхронизации"""
+
+    class Meta:
+        model = SubCategory
+        fields = ['id', 'name', 'slug', 'image', 'category', 'updated_at']
+        read_only_fields = fields
+
+
+class SyncProductSerializer(serializers.ModelSerializer):
+    """Продукт для синхронизации: подкатегория по id, названия категорий приходят своими изменениями"""
+    images = ProductImageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'slug', 'subcategory', 'price', 'description', 'images',
+            'is_available', 'updated_at'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import events, jobs
+from .cache import category_cache, product_cache
+from .models import CartItem, Category, SubCategory, Product, ProductImage, OutboxEvent, StockReservation
+from .stock import put_back
+
+
+def _previous_slug(sender, instance):
+    """Slug объекта в БД до сохранения (для обработки переименований)"""
+    if instance.pk is None:
+        return None
+    return sender.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+
+
+def _slugs(instance):
+    return sorted({slug for slug in (instance.slug, getattr(instance, '_previous_slug', None)) if slug})
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=SubCategory)
+def remember_slug(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._previous_slug = _previous_slug(sender, instance)
+
+
+@receiver(pre_save, sender=ProductImage)
+def remember_image(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._previous_large = sender.objects.filter(pk=instance.pk).values_list(
+            'image_large', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=ProductImage)
+def enqueue_resize(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Новое большое изображение — задача пересборки производных после коммита"""
+    if raw or not instance.image_large:
+        return
+    if update_fields is not None and 'image_large' not in update_fields:
+        return
+    if not created and instance.image_large.name == getattr(instance, '_previous_large', None):
+        return
+    image_id = instance.pk
+    transaction.on_commit(lambda: jobs.enqueue('shop.tasks.resize_product_image', image_id=image_id))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver([post_save, post_delete], sender=ProductImage)
+def record_catalog_change(sender, instance, signal, **kwargs):
+    """
+    Событие в outbox в транзакции изменения.
+
+    Зависимые записи кэша (продукты подкатегории, поддерево категории и т.п.)
+    сбрасывает обработчик outbox, а не сохранение в админке.
+    """
+    if sender is ProductImage:
+        payload = {'product_id': instance.product_id}
+    else:
+        payload = {'slugs': _slugs(instance)}
+        if sender is SubCategory:
+            payload['category_id'] = instance.category_id
+    action = OutboxEvent.DELETE if signal is post_delete else OutboxEvent.SAVE
+    OutboxEvent.record(sender._meta.model_name, [instance.pk], action, payload)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    product_cache.invalidate_on_commit(*_slugs(instance))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    category_cache.invalidate_on_commit(*_slugs(instance))
+
+
+@receiver(post_delete, sender=StockReservation)
+def release_reservation(sender, instance, **kwargs):
+    """Резерв возвращается на склад при любом удалении: позиции, корзины, по сроку"""
+    if instance.quantity:
+        put_back(instance.product_id, instance.quantity)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def publish_cart_change(sender, instance, signal, **kwargs):
+    """Изменение позиции корзины — подписчикам SSE после коммита"""
+    message = {'event': 'item_removed', 'id': instance.pk, 'product_id': instance.product_id}
+    if signal is post_save:
+        message.update(event='item_updated', quantity=instance.quantity)
+    channel = events.cart_channel(instance.cart_id)
+    transaction.on_commit(lambda: events.publish(channel, message))
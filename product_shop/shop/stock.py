@@ -0,0 +1,112 @@
+"""
+Остатки и резервы под корзины.
+
+Резерв берется одним условным ``UPDATE ... SET stock = stock - n WHERE
+stock >= n``: проверка и списание атомарны в самой БД, поэтому параллельные
+добавления одного и того же продукта не могут продать больше остатка и не
+требуют блокировки таблицы. Просроченные резервы возвращает на склад
+``sweep_expired`` (команда ``release_expired_reservations``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .cache import product_cache
+from .models import OutboxEvent, Product, StockReservation
+
+DEFAULTS = {
+    'RESERVATION_TTL': 900,
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'STOCK', {})}
+
+
+class OutOfStock(Exception):
+    """Остатка недостаточно для резерва"""
+
+    def __init__(self, product_id, quantity):
+        super().__init__(f'Недостаточно товара на складе: продукт {product_id}, запрошено {quantity}')
+        self.product_id = product_id
+        self.quantity = quantity
+
+
+def take(product_id, quantity):
+    """Списать quantity с остатка, если его хватает; вернуть успех"""
+    taken = Product.objects.without_outbox().filter(pk=product_id, stock__gte=quantity).update(
+        stock=F('stock') - quantity
+    ) == 1
+    metrics.inc('shop_stock_reservations_total', result='ok' if taken else 'out_of_stock')
+    if taken:
+        # Остаток закончился — изменилась доступность
+        _availability_changed(Product.objects.filter(pk=product_id, stock=0))
+    return taken
+
+
+def put_back(product_id, quantity):
+    """Вернуть quantity на остаток"""
+    if Product.objects.without_outbox().filter(pk=product_id).update(stock=F('stock') + quantity):
+        _availability_changed(Product.objects.filter(pk=product_id, stock=quantity))
+
+
+def _availability_changed(queryset):
+    # Само изменение остатка не пишется в outbox; событие нужно только при смене is_available
+    rows = list(queryset.values_list('pk', 'slug'))
+    if rows:
+        product_cache.invalidate_on_commit(*[slug for _, slug in rows])
+        OutboxEvent.record('product', [pk for pk, _ in rows], OutboxEvent.SAVE)
+
+
+def hold(cart_item, quantity):
+    """
+    Зарезервировать под позицию корзины ровно quantity единиц.
+
+    Списывается или возвращается только разница с текущим резервом, срок
+    резерва продлевается. При нехватке остатка — OutOfStock, резерв не меняется.
+    """
+    expires_at = timezone.now() + timedelta(seconds=get_config()['RESERVATION_TTL'])
+    with transaction.atomic():
+        # Блокируется только строка резерва, чтобы ее не снял параллельный sweep_expired
+        reservation = StockReservation.objects.select_for_update().filter(cart_item=cart_item).first()
+        held = reservation.quantity if reservation else 0
+        if quantity > held and not take(cart_item.product_id, quantity - held):
+            raise OutOfStock(cart_item.product_id, quantity - held)
+        if quantity < held:
+            put_back(cart_item.product_id, held - quantity)
+        if reservation:
+            reservation.quantity = quantity
+            reservation.expires_at = expires_at
+            reservation.save(update_fields=['quantity', 'expires_at'])
+        else:
+            StockReservation.objects.create(
+                cart_item=cart_item, product_id=cart_item.product_id,
+                quantity=quantity, expires_at=expires_at
+            )
+
+
+def sweep_expired(now=None, batch_size=None):
+    """Вернуть на склад просроченные резервы; вернуть число снятых резервов"""
+    now = now or timezone.now()
+    batch_size = batch_size or get_config()['SWEEP_BATCH_SIZE']
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Остаток возвращает сигнал post_delete резерва (см. shop/signals.py)
+            batch = list(
+                StockReservation.objects.select_for_update(skip_locked=skip_locked)
+                .filter(expires_at__lt=now).order_by('expires_at')[:batch_size]
+            )
+            for reservation in batch:
+                reservation.delete()
+        released += len(batch)
+        if len(batch) < batch_size:
+            break
+    metrics.inc('shop_stock_reservations_expired_total', released)
+    return released
@@ -0,0 +1,308 @@
+"""
+Подсказки при вводе по префиксу названий продуктов и подкатегорий.
+
+Индекс живет в памяти процесса: отсортированный список ключей —
+нормализованное название (регистр сложен, «ё» приведена к «е»,
+пунктуация убрана) и его окончания с начала каждого слова, чтобы «galaxy»
+находило «Смартфон Samsung Galaxy». Префикс — это диапазон списка,
+найденный двоичным поиском; результаты упорядочены по популярности.
+Ответы для коротких префиксов с большим диапазоном запоминаются.
+
+Индекс строится фоновым потоком, который запускается первым запросом
+процесса (``start`` из прогрева ``config/wsgi.py`` и ``config/asgi.py``,
+то есть после fork воркера); этот же поток раз в ``REFRESH_INTERVAL`` секунд
+применяет новые записи журнала ``CatalogChange`` и раз в
+``SCORES_INTERVAL`` секунд перечитывает рейтинги. Поиск к БД не обращается.
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections
+from django.db.models import Sum
+
+from . import metrics
+from .models import CatalogChange, Product, ProductPopularity, SubCategory
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'REFRESH_INTERVAL': 5,
+    'SCORES_INTERVAL': 300,
+    'SCAN_LIMIT': 500,
+}
+
+# Сколько слов названия дают собственные ключи
+MAX_WORDS = 8
+
+_NON_WORD = re.compile(r'[\W_]+')
+_MAX_CHAR = '\U0010ffff'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SUGGEST', {})}
+
+
+def normalize(text):
+    """Нижний регистр, «ё» → «е», слова через один пробел"""
+    return ' '.join(_NON_WORD.sub(' ', text.casefold().replace('ё', 'е')).split())
+
+
+def keys_for(name):
+    """Ключи индекса: нормализованное название и его окончания с начала слов"""
+    words = normalize(name).split(' ')
+    return {' '.join(words[i:]) for i in range(min(len(words), MAX_WORDS)) if words[i]}
+
+
+class Entry:
+    """Объект в индексе"""
+
+    __slots__ = ('ref', 'keys', 'score', 'data')
+
+    def __init__(self, kind, object_id, name, slug, score):
+        self.ref = (kind, object_id)
+        self.keys = keys_for(name)
+        self.score = score
+        self.data = {'type': kind, 'id': object_id, 'name': name, 'slug': slug}
+
+    def rank(self):
+        return (-self.score, self.data['name'])
+
+
+class SuggestIndex:
+    """Префиксный индекс одного процесса"""
+
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self.lock = threading.RLock()
+        # Отдельно от lock: пока один поток строит индекс, поиск не блокируется
+        self.build_lock = threading.Lock()
+        self.keys = []
+        self.entries = {}
+        self.memo = {}
+        self.cursor = 0
+        self.built = False
+        self.autostart = False
+        self._reset_thread()
+
+    def _reset_thread(self):
+        self.thread = None
+        self.stop = threading.Event()
+
+    def _after_fork(self):
+        # Поток обновления родителя в дочернем процессе не существует, а его
+        # блокировки могли остаться захваченными в момент fork
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self._reset_thread()
+
+    # Построение и обновление
+
+    def build(self):
+        """Загрузить весь каталог и рейтинги"""
+        cursor = CatalogChange.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        scores = self._product_scores()
+        subcategory_scores = self._subcategory_scores()
+        entries = [
+            Entry('product', pk, name, slug, scores.get(pk, 0.0))
+            for pk, name, slug in Product.objects.values_list('pk', 'name', 'slug').iterator()
+        ]
+        entries += [
+            Entry('subcategory', pk, name, slug, subcategory_scores.get(pk, 0.0))
+            for pk, name, slug in SubCategory.objects.values_list('pk', 'name', 'slug')
+        ]
+        keys = sorted((key, *entry.ref) for entry in entries for key in entry.keys)
+        with self.lock:
+            self.entries = {entry.ref: entry for entry in entries}
+            self.keys = keys
+            self.memo = {}
+            self.cursor = max(self.cursor, cursor)
+            self.built = True
+        metrics.set_gauge('shop_suggest_entries', len(entries))
+        return len(entries)
+
+    def ensure_built(self, wait=True):
+        """Построить индекс, если его еще нет; строит один поток, остальные ждут или получают False"""
+        if self.built:
+            return True
+        if not self.build_lock.acquire(blocking=wait):
+            return False
+        try:
+            if not self.built:
+                self.build()
+        finally:
+            self.build_lock.release()
+        return True
+
+    def refresh(self, batch_size=1000):
+        """Применить изменения каталога из журнала; вернуть число изменений"""
+        applied = 0
+        while True:
+            rows = list(
+                CatalogChange.objects.filter(pk__gt=self.cursor, model__in=['product', 'subcategory'])
+                .order_by('pk').values_list('pk', 'model', 'object_id', 'deleted')[:batch_size]
+            )
+            if not rows:
+                return applied
+            wanted = defaultdict(list)
+            for _, model, object_id, deleted in rows:
+                if not deleted:
+                    wanted[model].append(object_id)
+            scores = self._product_scores(wanted['product']) if wanted['product'] else {}
+            loaded = {
+                ('product', pk): Entry('product', pk, name, slug, scores.get(pk, 0.0))
+                for pk, name, slug in Product.objects.filter(pk__in=wanted['product']).values_list(
+                    'pk', 'name', 'slug'
+                )
+            }
+            for pk, name, slug in SubCategory.objects.filter(pk__in=wanted['subcategory']).values_list(
+                'pk', 'name', 'slug'
+            ):
+                previous = self.entries.get(('subcategory', pk))
+                loaded[('subcategory', pk)] = Entry(
+                    'subcategory', pk, name, slug, previous.score if previous else 0.0
+                )
+            with self.lock:
+                for _, model, object_id, _ in rows:
+                    ref = (model, object_id)
+                    self._remove(ref)
+                    if ref in loaded:
+                        self._add(loaded[ref])
+                self.cursor = rows[-1][0]
+            applied += len(rows)
+            metrics.inc('shop_suggest_changes_total', len(rows))
+
+    def refresh_scores(self):
+        """Перечитать рейтинги популярности"""
+        scores = self._product_scores()
+        subcategory_scores = self._subcategory_scores()
+        with self.lock:
+            for (kind, object_id), entry in self.entries.items():
+                entry.score = (scores if kind == 'product' else subcategory_scores).get(object_id, 0.0)
+            self.memo = {}
+
+    def _product_scores(self, ids=None):
+        queryset = ProductPopularity.objects.all()
+        if ids is not None:
+            queryset = queryset.filter(product_id__in=ids)
+        return dict(queryset.values_list('product_id', 'score'))
+
+    def _subcategory_scores(self):
+        # Рейтинг подкатегории — сумма рейтингов ее продуктов
+        return dict(
+            ProductPopularity.objects.values('product__subcategory_id').annotate(total=Sum('score'))
+            .values_list('product__subcategory_id', 'total')
+        )
+
+    def _add(self, entry):
+        self.entries[entry.ref] = entry
+        for key in entry.keys:
+            insort(self.keys, (key, *entry.ref))
+        self._forget(entry.keys)
+
+    def _remove(self, ref):
+        entry = self.entries.pop(ref, None)
+        if entry is None:
+            return
+        for key in entry.keys:
+            index = bisect_left(self.keys, (key, *ref))
+            if index < len(self.keys) and self.keys[index] == (key, *ref):
+                del self.keys[index]
+        self._forget(entry.keys)
+
+    def _forget(self, keys):
+        # Сбросить запомненные ответы префиксов, под которые попадают ключи
+        stale = [prefix for prefix in self.memo if any(key.startswith(prefix) for key in keys)]
+        for prefix in stale:
+            del self.memo[prefix]
+
+    # Поиск
+
+    def search(self, query, limit=None):
+        """До limit подсказок по префиксу query, самые популярные первыми"""
+        config = get_config()
+        limit = max(1, min(limit or config['LIMIT'], config['MAX_LIMIT']))
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if self.autostart and self.thread is None:
+            # Процесс создан fork после start: свой поток обновления
+            self.start()
+        if not self.ensure_built(wait=False):
+            # Индекс строит другой запрос или фоновый поток: не строим второй раз
+            metrics.inc('shop_suggest_not_ready_total')
+            return []
+        with self.lock:
+            refs = self.memo.get(prefix)
+            if refs is None:
+                refs = self._top(prefix, config['MAX_LIMIT'], config['SCAN_LIMIT'])
+            return [self.entries[ref].data for ref in refs[:limit]]
+
+    def _top(self, prefix, limit, scan_limit):
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + _MAX_CHAR,), start)
+        refs = {(kind, object_id) for _, kind, object_id in self.keys[start:end]}
+        top = heapq.nsmallest(limit, refs, key=lambda ref: self.entries[ref].rank())
+        if end - start > scan_limit:
+            self.memo[prefix] = top
+        return top
+
+    # Фоновое обновление
+
+    def start(self):
+        """Построить индекс и запустить поток обновления (один раз на процесс)"""
+        with self.lock:
+            self.autostart = True
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='suggest-refresh', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        config = get_config()
+        scores_due = config['SCORES_INTERVAL']
+        try:
+            self.ensure_built()
+            while not self.stop.wait(config['REFRESH_INTERVAL']):
+                close_old_connections()
+                try:
+                    self.refresh()
+                    scores_due -= config['REFRESH_INTERVAL']
+                    if scores_due <= 0:
+                        self.refresh_scores()
+                        scores_due = config['SCORES_INTERVAL']
+                except Exception:
+                    logger.exception('Ошибка обновления индекса подсказок')
+        except Exception:
+            logger.exception('Не удалось построить индекс подсказок')
+
+
+index = SuggestIndex()
+
+
+def _start_on_request(sender, **kwargs):
+    if index.autostart and index.thread is None:
+        index.start()
+
+
+def start():
+    """
+    Построить индекс и запускать обновление в фоне с первого запроса процесса.
+
+    Поток не запускается сразу: с gunicorn --preload прогрев идет в мастере,
+    и поток, державший блокировку или курсор БД в момент fork, оставил бы
+    их захваченными в воркере.
+    """
+    index.autostart = True
+    request_started.connect(_start_on_request, dispatch_uid='suggest_start_on_request')
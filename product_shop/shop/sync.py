@@ -0,0 +1,93 @@
+"""
+Дельта-синхронизация каталога для офлайн-клиентов.
+
+Журнал ``CatalogChange`` пополняет обработчик outbox: номера изменений
+назначает единственный процесс доставки (аренда в ``shop/outbox.py``)
+уже после коммита, поэтому клиент, прочитавший изменения до номера N, не
+пропустит изменение с меньшим номером, закоммиченное позже. Удаления хранятся как tombstone.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import loaders
+from .models import CatalogChange, Category, OutboxEvent, Product, ProductImage, SubCategory
+from .serializers import SyncCategorySerializer, SyncProductSerializer, SyncSubCategorySerializer
+
+SYNC_MODELS = {
+    'category': (Category.objects.all(), SyncCategorySerializer),
+    'subcategory': (SubCategory.objects.all(), SyncSubCategorySerializer),
+    'product': (Product.objects.prefetch_related('images'), SyncProductSerializer),
+}
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+
+
+def record_catalog_changes(events):
+    """Обработчик outbox: записать изменения в журнал, вытеснив прежние записи тех же объектов"""
+    changes = {}
+    image_ids = [event.object_id for event in events if event.model == 'productimage']
+    image_products = dict(ProductImage.objects.filter(pk__in=image_ids).values_list('pk', 'product_id'))
+    for event in events:
+        if event.model == 'productimage':
+            # Изменение изображения — это изменение продукта
+            product_id = event.payload.get('product_id') or image_products.get(event.object_id)
+            if product_id:
+                changes.setdefault(('product', product_id), False)
+        elif event.model in SYNC_MODELS:
+            changes.pop((event.model, event.object_id), None)
+            changes[(event.model, event.object_id)] = event.action == OutboxEvent.DELETE
+    if not changes:
+        return
+
+    by_model = defaultdict(list)
+    for model, object_id in changes:
+        by_model[model].append(object_id)
+    with transaction.atomic():
+        for model, object_ids in by_model.items():
+            CatalogChange.objects.filter(model=model, object_id__in=object_ids).delete()
+        CatalogChange.objects.bulk_create(
+            [
+                CatalogChange(model=model, object_id=object_id, deleted=deleted)
+                for (model, object_id), deleted in changes.items()
+            ],
+            batch_size=500,
+        )
+
+
+def changes_since(cursor, limit=DEFAULT_LIMIT, context=None):
+    """
+    Страница изменений после cursor.
+
+    Возвращает (changes, next_cursor, has_more). Объекты каждой модели
+    загружаются одним запросом; объект, удаленный после записи в журнал,
+    отдается как tombstone.
+    """
+    rows = list(CatalogChange.objects.filter(pk__gt=cursor).order_by('pk')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    wanted = defaultdict(list)
+    for row in rows:
+        if not row.deleted:
+            wanted[row.model].append(row.object_id)
+    data = {}
+    with loaders.scope():
+        for model, object_ids in wanted.items():
+            queryset, serializer_class = SYNC_MODELS[model]
+            objects = list(queryset.filter(pk__in=object_ids))
+            for obj, item in zip(objects, serializer_class(objects, many=True, context=context).data):
+                data[(model, obj.pk)] = item
+
+    changes = []
+    for row in rows:
+        item = data.get((row.model, row.object_id))
+        changes.append({
+            'seq': row.pk,
+            'type': row.model,
+            'id': row.object_id,
+            'deleted': item is None,
+            'data': item,
+        })
+    return changes, rows[-1].pk if rows else cursor, has_more
@@ -0,0 +1,55 @@
+"""
+Фоновые задачи для очереди ``shop.jobs``.
+
+Ставятся в очередь по dotted path, например::
+
+    jobs.enqueue('shop.tasks.resize_product_image', image_id=image.pk)
+"""
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from PIL import Image
+
+from .models import ProductImage
+
+# Размеры (по большей стороне) для производных изображений продукта
+IMAGE_SIZES = {
+    'image_medium': 600,
+    'image_small': 200,
+}
+
+
+def resize_product_image(image_id):
+    """Пересобрать среднее и маленькое изображения из большого; прежние файлы удаляются"""
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is None or not product_image.image_large:
+        return
+    with product_image.image_large.open('rb') as source:
+        original = Image.open(source)
+        original.load()
+    name = os.path.basename(product_image.image_large.name)
+    previous = {field: getattr(product_image, field).name for field in IMAGE_SIZES}
+    for field, size in IMAGE_SIZES.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format=original.format or 'JPEG')
+        getattr(product_image, field).save(name, ContentFile(buffer.getvalue()), save=False)
+    product_image.save(update_fields=list(IMAGE_SIZES))
+    # Новые файлы получают свободные имена, поэтому старые удаляются только после сохранения ссылок
+    for field, old_name in previous.items():
+        file = getattr(product_image, field)
+        if old_name and old_name != file.name:
+            file.storage.delete(old_name)
+
+
+def purge_carts(**options):
+    """Очистка заброшенных и пустых корзин (см. команду purge_carts)"""
+    call_command('purge_carts', **options)
+
+
+def dispatch_outbox():
+    """Доставить накопленные события каталога"""
+    call_command('dispatch_outbox')
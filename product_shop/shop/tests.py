@@ -1,8 +1,68 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest.mock
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import Category, SubCategory, Product, Cart, CartItem
+from rest_framework_simplejwt.tokens import RefreshToken
+from PIL import Image
+from .models import (
+    Category, SubCategory, Product, ProductImage, Cart, CartItem, CatalogChange, IdempotencyKey, Job, Lease, Order, OrderLine,
+    OutboxEvent, PopularityEpoch, ProductPopularity, RelatedProduct, StockReservation, path_segment
+)
+from . import carts, events, jobs, leases, loaders, metrics, outbox, routers, schema, suggest, warmup
+from .cache import category_cache, product_cache
+from .routers import ReadReplicaRouter
+from .stock import OutOfStock, sweep_expired, take
+from .popularity import EPOCH, RESCALE_EXPONENT, CountMinSketch, PopularityTracker, TopK, decay_factor
+from .benchmarks import SCENARIOS, BenchmarkContext, BenchRequest, ClientTransport, percentile, summarize, _product_page
+from .compression import is_compressible, negotiate
+from .middleware import CompressionMiddleware
+from .renderers import FastJSONParser, FastJSONRenderer
+from rest_framework.renderers import JSONRenderer
+
+_metrics_dir = None
+_metrics_override = None
+
+
+def setUpModule():
+    """
+    Метрики тестов пишутся во временный каталог, а не в var/metrics проекта;
+    фоновый сброс популярности выключен, тесты вызывают flush сами
+    """
+    global _metrics_dir, _metrics_override
+    _metrics_dir = tempfile.TemporaryDirectory()
+    _metrics_override = override_settings(
+        METRICS_DIR=_metrics_dir.name,
+        POPULARITY={**settings.POPULARITY, 'FLUSH_INTERVAL': 0},
+    )
+    _metrics_override.enable()
+    metrics.reset()
+
+
+def tearDownModule():
+    metrics.reset()
+    _metrics_override.disable()
+    _metrics_dir.cleanup()
 
 
 class CategoryAPITestCase(APITestCase):
@@ -36,8 +96,8 @@ class CategoryAPITestCase(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['name'], 'Тестовая категория')
-        self.assertIn('subcategories', response.data)
+        self.assertEqual(response.json()['name'], 'Тестовая категория')
+        self.assertIn('subcategories', response.json())
 
 
 class ProductAPITestCase(APITestCase):
@@ -78,9 +138,647 @@ class ProductAPITestCase(APITestCase):
         response = self.client.get(url)
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['name'], 'Тестовый продукт')
-        self.assertIn('category', response.data)
-        self.assertIn('subcategory', response.data)
+        self.assertEqual(response.json()['name'], 'Тестовый продукт')
+        self.assertIn('category', response.json())
+        self.assertIn('subcategory', response.json())
+
+
+class CategoryTreeTestCase(APITestCase):
+    """Тесты дерева категорий произвольной глубины"""
+
+    def setUp(self):
+        """Дерево: root > middle > leaf, у каждого уровня своя подкатегория"""
+        self.root = Category.objects.create(name='Корень', slug='root')
+        self.middle = Category.objects.create(name='Середина', slug='middle', parent=self.root)
+        self.leaf = Category.objects.create(name='Лист', slug='leaf', parent=self.middle)
+        self.other = Category.objects.create(name='Другая', slug='other')
+        for category in (self.root, self.middle, self.leaf, self.other):
+            subcategory = SubCategory.objects.create(
+                category=category, name=f'Подкатегория {category.slug}', slug=f'sub-{category.slug}'
+            )
+            Product.objects.create(
+                subcategory=subcategory, name=f'Продукт {category.slug}',
+                slug=f'product-{category.slug}', price=10
+            )
+
+    def test_paths(self):
+        """Тест вычисления материализованных путей"""
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertEqual(self.leaf.path, self.middle.path + path_segment(self.leaf.pk))
+        self.assertTrue(SubCategory.objects.get(slug='sub-leaf').path.startswith(self.leaf.path))
+
+    def test_filter_products_by_subtree(self):
+        """Тест фильтрации продуктов по всему поддереву категории"""
+        response = self.client.get('/api/v1/products/?category=middle')
+        slugs = {product['slug'] for product in response.data['results']}
+        self.assertEqual(slugs, {'product-middle', 'product-leaf'})
+
+        response = self.client.get('/api/v1/products/?category=root')
+        self.assertEqual(response.data['count'], 3)
+
+    def test_move_subtree(self):
+        """Тест переноса поддерева в другую ветку"""
+        self.middle.parent = self.other
+        self.middle.save()
+
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertTrue(self.leaf.path.startswith(self.other.path))
+        response = self.client.get('/api/v1/products/?category=other')
+        self.assertEqual(response.data['count'], 3)
+
+    def test_cycle_is_rejected(self):
+        """Тест запрета вложения категории в своего потомка"""
+        self.root.parent = self.leaf
+        with self.assertRaises(ValueError):
+            self.root.save()
+
+    def test_tree_queries(self):
+        """Тест получения всего дерева с подкатегориями двумя запросами"""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/categories/tree/')
+        self.assertEqual([node['slug'] for node in response.data], ['other', 'root'])
+        root = response.data[1]
+        self.assertEqual(root['children'][0]['slug'], 'middle')
+        self.assertEqual(root['children'][0]['children'][0]['slug'], 'leaf')
+        self.assertEqual([item['slug'] for item in root['subcategories']], ['sub-root'])
+        self.assertEqual(root['children'][0]['children'][0]['subcategories'][0]['slug'], 'sub-leaf')
+
+    def test_tree_with_stale_paths(self):
+        """Тест: родитель с устаревшим путем, идущий после потомков, не ломает дерево"""
+        Category.objects.filter(pk__in=[self.root.pk, self.middle.pk]).update(path='~')
+        response = self.client.get('/api/v1/categories/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([node['slug'] for node in response.data], ['other', 'root'])
+        self.assertEqual(response.data[1]['children'][0]['children'][0]['slug'], 'leaf')
+
+    def test_rebuild_paths(self):
+        """Тест пересчета путей после массовой загрузки"""
+        Category.objects.update(path='', depth=0)
+        SubCategory.objects.update(path='')
+        Category.rebuild_paths()
+        self.assertEqual(Category.objects.get(slug='leaf').depth, 2)
+        response = self.client.get('/api/v1/products/?category=root')
+        self.assertEqual(response.data['count'], 3)
+
+
+class DetailCacheTestCase(APITestCase):
+    """Тесты кэша детальных ответов по slug"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.subcategory = SubCategory.objects.create(
+            category=self.category, name='Подкатегория', slug='subcategory'
+        )
+        self.product = Product.objects.create(
+            subcategory=self.subcategory, name='Продукт', slug='product', price=10
+        )
+
+    def test_second_request_hits_cache(self):
+        """Тест отдачи повторного запроса без обращения к БД"""
+        self.client.get('/api/v1/products/product/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/products/product/')
+        self.assertEqual(response.json()['name'], 'Продукт')
+
+    def test_hit_is_precompressed(self):
+        """Тест: попадание отдаёт готовое тело, сжатое при заполнении кэша"""
+        Product.objects.filter(pk=self.product.pk).update(description='Описание ' * 50)
+        self.client.get('/api/v1/products/product/')
+        with unittest.mock.patch('shop.middleware.compress') as compress:
+            response = self.client.get('/api/v1/products/product/', HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['slug'], 'product')
+
+    def test_browsable_api_on_hit(self):
+        """Тест: для browsable API попадание рендерится обычным Response"""
+        self.client.get('/api/v1/products/product/')
+        response = self.client.get('/api/v1/products/product/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Продукт')
+
+    def test_invalidation_on_save(self):
+        """Тест инвалидации при изменении продукта и подкатегории"""
+        self.client.get('/api/v1/products/product/')
+        self.product.name = 'Новое название'
+        self.product.save()
+        self.assertEqual(self.client.get('/api/v1/products/product/').json()['name'], 'Новое название')
+
+        # Зависимые записи сбрасывает обработчик outbox
+        self.subcategory.name = 'Новая подкатегория'
+        self.subcategory.save()
+        outbox.dispatch()
+        response = self.client.get('/api/v1/products/product/')
+        self.assertEqual(response.json()['subcategory'], 'Новая подкатегория')
+
+    def test_invalidation_after_commit(self):
+        """Тест: ответ, закэшированный читателем до коммита записи, сбрасывается после коммита"""
+        request = RequestFactory().get('/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Новое название'
+            self.product.save()
+            # Параллельный читатель успел закэшировать строку до коммита
+            product_cache.get_or_set('product', request, lambda: {'name': 'Продукт'})
+            self.assertEqual(product_cache.get_or_set('product', request, dict).data['name'], 'Продукт')
+        self.assertEqual(self.client.get('/api/v1/products/product/').json()['name'], 'Новое название')
+
+    def test_slug_rename(self):
+        """Тест переименования slug"""
+        self.client.get('/api/v1/products/product/')
+        self.product.slug = 'renamed'
+        self.product.save()
+
+        self.assertEqual(self.client.get('/api/v1/products/product/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/v1/products/renamed/').status_code, status.HTTP_200_OK)
+
+    def test_invalidation_on_delete(self):
+        """Тест инвалидации при удалении"""
+        self.client.get('/api/v1/products/product/')
+        self.product.delete()
+        self.assertEqual(self.client.get('/api/v1/products/product/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OutboxTestCase(APITestCase):
+    """Тесты outbox изменений каталога"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.subcategory = SubCategory.objects.create(category=self.category, name='Подкатегория', slug='sub')
+        self.products = [
+            Product.objects.create(subcategory=self.subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            for i in range(3)
+        ]
+        OutboxEvent.objects.all().delete()
+
+    def test_bulk_update_and_coalescing(self):
+        """Тест: массовое изменение пишет события, повторы схлопываются"""
+        Product.objects.filter(slug__in=['p-0', 'p-1']).update(price=20)
+        product = self.products[0]
+        product.slug = 'renamed'
+        product.save()
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+
+        received = []
+        self.assertEqual(outbox.dispatch(handlers=[('test', received.extend)]), 3)
+        self.assertEqual(sorted(event.object_id for event in received), [self.products[0].pk, self.products[1].pk])
+        renamed = next(event for event in received if event.object_id == product.pk)
+        self.assertEqual(renamed.payload['slugs'], ['p-0', 'renamed'])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failed_handler_redelivers(self):
+        """Тест: при ошибке обработчика события остаются в outbox"""
+        self.products[0].delete()
+
+        def failing(events):
+            raise RuntimeError('нет связи')
+
+        with self.assertRaises(outbox.HandlerError), self.assertLogs('shop.outbox', 'ERROR'):
+            outbox.dispatch(handlers=[('failing', failing)])
+        self.assertEqual(OutboxEvent.objects.get().action, OutboxEvent.DELETE)
+
+        call_command('dispatch_outbox', stdout=io.StringIO())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_single_dispatcher(self):
+        """Тест: пока аренду держит другой процесс доставки, порция не обрабатывается"""
+        self.products[0].delete()
+        received = []
+        self.assertTrue(leases.acquire(outbox.LEASE_NAME, 'other', ttl=60))
+        self.assertFalse(leases.acquire(outbox.LEASE_NAME, 'third', ttl=60))
+        self.assertEqual(outbox.dispatch(handlers=[('test', received.extend)]), 0)
+        self.assertEqual(received, [])
+        self.assertTrue(OutboxEvent.objects.exists())
+
+        # Аренда упавшего процесса истекает
+        Lease.objects.filter(name=outbox.LEASE_NAME).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.dispatch(handlers=[('test', received.extend)]), 1)
+        self.assertEqual(Lease.objects.get(name=outbox.LEASE_NAME).expires_at, None)
+
+    def test_stock_changes_are_not_recorded(self):
+        """Тест: резерв остатка не пишет событий, пока не меняется доступность"""
+        Product.objects.filter(pk=self.products[0].pk).update(stock=2)
+        OutboxEvent.objects.all().delete()
+        take(self.products[0].pk, 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+        take(self.products[0].pk, 1)
+        self.assertEqual(OutboxEvent.objects.get().object_id, self.products[0].pk)
+
+    def test_category_change_invalidates_subtree(self):
+        """Тест: обработчик кэша сбрасывает детали продуктов в поддереве категории"""
+        self.client.get('/api/v1/products/p-1/')
+        self.category.name = 'Новая категория'
+        self.category.save()
+        outbox.dispatch()
+        self.assertEqual(self.client.get('/api/v1/products/p-1/').json()['category'], 'Новая категория')
+
+
+JOB_CALLS = []
+
+
+def record_job_call(value):
+    """Тестовая задача"""
+    JOB_CALLS.append(value)
+
+
+def failing_job():
+    """Тестовая задача, которая всегда падает"""
+    raise RuntimeError('ошибка задачи')
+
+
+class JobQueueTestCase(TestCase):
+    """Тесты очереди фоновых задач"""
+
+    def setUp(self):
+        JOB_CALLS.clear()
+
+    def test_priority_and_claim(self):
+        """Тест: задачи берутся по приоритету, взятую задачу не берет другой воркер"""
+        jobs.enqueue('shop.tests.record_job_call', value='low')
+        high = jobs.enqueue('shop.tests.record_job_call', priority=10, value='high')
+        jobs.enqueue('shop.tests.record_job_call', delay=3600, value='later')
+
+        first = jobs.claim('w1')
+        self.assertEqual(first.pk, high.pk)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(jobs.claim('w2').kwargs, {'value': 'low'})
+        self.assertIsNone(jobs.claim('w3'))
+
+    def test_visibility_timeout(self):
+        """Тест: задача упавшего воркера снова доступна после таймаута"""
+        job = jobs.enqueue('shop.tests.record_job_call', value=1)
+        stale = jobs.claim('w1')
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        retaken = jobs.claim('w2')
+        self.assertEqual(retaken.attempts, 2)
+
+        # Результат от воркера, потерявшего задачу, не записывается
+        jobs.execute(stale)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+        jobs.execute(retaken)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+
+    def test_expired_last_attempt(self):
+        """Тест: задача с истекшим сроком последней попытки не берется снова, а помечается как failed"""
+        job = jobs.enqueue('shop.tests.record_job_call', max_attempts=1, value=1)
+        jobs.claim('x' * 80)
+        # Длинное имя воркера обрезается, случайная часть токена остается
+        self.assertRegex(Job.objects.get(pk=job.pk).locked_by, r'^[0-9a-f]{8}:x+$')
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(jobs.claim('w2'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('истек', job.last_error)
+
+    def test_retries(self):
+        """Тест повторов с задержкой и окончательной ошибки"""
+        job = jobs.enqueue('shop.tests.failing_job', max_attempts=2)
+        with self.assertLogs('shop.jobs', 'WARNING'):
+            self.assertEqual(jobs.execute(jobs.claim('w1')), 'retry')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('ошибка задачи', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('shop.jobs', 'WARNING'):
+            self.assertEqual(jobs.execute(jobs.claim('w1')), 'failed')
+
+    def test_run_workers_burst(self):
+        """Тест команды воркеров"""
+        for i in range(3):
+            jobs.enqueue('shop.tests.record_job_call', value=i)
+        out = io.StringIO()
+        call_command('run_workers', workers=1, burst=True, stdout=out)
+        self.assertEqual(sorted(JOB_CALLS), [0, 1, 2])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+        self.assertIn('Выполнено задач: 3', out.getvalue())
+
+    def test_image_resize_enqueued(self):
+        """Тест: сохранение нового большого изображения ставит пересборку, старые файлы удаляются"""
+        def png(size):
+            buffer = io.BytesIO()
+            Image.new('RGB', (size, size)).save(buffer, format='PNG')
+            return ContentFile(buffer.getvalue(), name='photo.png')
+
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        product = Product.objects.create(subcategory=subcategory, name='Продукт', slug='product', price=10)
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.objects.create(product=product, image_large=png(1000))
+            self.assertEqual(jobs.execute(jobs.claim('w1')), 'done')
+            image.refresh_from_db()
+            old_small = image.image_small.path
+            self.assertEqual(Image.open(old_small).size, (200, 200))
+
+            # Сохранение без смены большого изображения и сама пересборка задач не ставят
+            with self.captureOnCommitCallbacks(execute=True):
+                image.is_main = True
+                image.save()
+            self.assertIsNone(jobs.claim('w1'))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                image.image_large = png(400)
+                image.save()
+            self.assertEqual(jobs.execute(jobs.claim('w1')), 'done')
+            image.refresh_from_db()
+            self.assertFalse(os.path.exists(old_small))
+            self.assertEqual(Image.open(image.image_small.path).size, (200, 200))
+            self.assertEqual(Image.open(image.image_medium.path).size, (400, 400))
+
+
+class SuggestTestCase(APITestCase):
+    """Тесты подсказок по префиксу"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        self.subcategory = SubCategory.objects.create(category=category, name='Ёлочные украшения', slug='decor')
+        names = ['Ёлка искусственная', 'Елочный шар', 'Смартфон Samsung Galaxy', 'Гирлянда «Ёлочка»']
+        self.products = [
+            Product.objects.create(subcategory=self.subcategory, name=name, slug=f'p-{i}', price=10)
+            for i, name in enumerate(names)
+        ]
+        ProductPopularity.objects.create(product=self.products[1], score=5)
+        ProductPopularity.objects.create(product=self.products[0], score=1)
+        outbox.dispatch()
+        self.index = suggest.SuggestIndex()
+        self.index.build()
+
+    def names(self, query, limit=None):
+        return [item['name'] for item in self.index.search(query, limit)]
+
+    def test_prefix_folding_and_ranking(self):
+        """Тест: ё/е и регистр не важны, слово внутри названия находится, популярные первыми"""
+        self.assertEqual(
+            self.names('ЕЛ'),
+            ['Ёлочные украшения', 'Елочный шар', 'Ёлка искусственная', 'Гирлянда «Ёлочка»']
+        )
+        self.assertEqual(self.names('ёлоч', limit=2), ['Ёлочные украшения', 'Елочный шар'])
+        self.assertEqual(self.names('galax'), ['Смартфон Samsung Galaxy'])
+        self.assertEqual(self.names('samsung gal'), ['Смартфон Samsung Galaxy'])
+        self.assertEqual(self.names('  '), [])
+        self.assertEqual(self.names('шарик'), [])
+
+    def test_incremental_refresh(self):
+        """Тест: переименование, добавление и удаление применяются из журнала изменений"""
+        self.names('е')
+        self.products[2].name = 'Ель живая'
+        self.products[2].save()
+        self.products[0].delete()
+        Product.objects.create(subcategory=self.subcategory, name='Еловая ветка', slug='branch', price=10)
+        outbox.dispatch()
+        self.assertEqual(self.index.refresh(), 3)
+
+        names = self.names('е', limit=50)
+        self.assertIn('Ель живая', names)
+        self.assertIn('Еловая ветка', names)
+        self.assertNotIn('Ёлка искусственная', names)
+        self.assertEqual(self.names('galax'), [])
+        self.assertEqual(self.index.refresh(), 0)
+
+    def test_endpoint_without_queries(self):
+        """Тест эндпоинта: ответ из индекса без запросов к БД"""
+        with unittest.mock.patch.object(suggest, 'index', self.index), self.assertNumQueries(0):
+            response = self.client.get('/api/v1/products/suggest/', {'q': 'гирл'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'type': 'product', 'id': self.products[3].pk, 'name': 'Гирлянда «Ёлочка»', 'slug': 'p-3'}
+        ])
+        response = self.client.get('/api/v1/products/suggest/', {'q': 'ел', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with unittest.mock.patch.object(suggest, 'index', self.index):
+            response = self.client.get('/api/v1/products/suggest/', {'q': 'ел', 'limit': '-5'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_single_build(self):
+        """Тест: пока индекс строит один поток, поиск не строит его второй раз"""
+        index = suggest.SuggestIndex()
+        index.build_lock.acquire()
+        try:
+            with unittest.mock.patch.object(index, 'build') as build:
+                self.assertEqual(index.search('ел'), [])
+            build.assert_not_called()
+        finally:
+            index.build_lock.release()
+        self.assertEqual(len(index.search('ел')), 4)
+
+
+class ProductBulkTestCase(APITestCase):
+    """Тесты получения нескольких продуктов одним запросом"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.products = [
+            Product.objects.create(subcategory=subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            for i in range(3)
+        ]
+
+    def test_by_ids_in_request_order(self):
+        """Тест порядка, ненайденных id и числа запросов"""
+        ids = [self.products[2].pk, 999, self.products[0].pk]
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/products/bulk/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['slug'] for p in response.data['results']], ['p-2', 'p-0'])
+        self.assertEqual(response.data['missing'], [999])
+
+    def test_post_slugs(self):
+        """Тест POST со списком slug"""
+        response = self.client.post('/api/v1/products/bulk/', {'slugs': ['p-1', 'nope', 'p-1']}, format='json')
+        self.assertEqual([p['slug'] for p in response.data['results']], ['p-1'])
+        self.assertEqual(response.data['missing'], ['nope'])
+
+    def test_validation(self):
+        """Тест ошибок запроса"""
+        self.assertEqual(
+            self.client.get('/api/v1/products/bulk/', {'ids': 'a,b'}).status_code, status.HTTP_400_BAD_REQUEST
+        )
+        response = self.client.post('/api/v1/products/bulk/', {'ids': list(range(501))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogSyncTestCase(APITestCase):
+    """Тесты дельта-синхронизации каталога"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        self.subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.products = [
+            Product.objects.create(subcategory=self.subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            for i in range(3)
+        ]
+        outbox.dispatch()
+
+    def sync(self, since, limit=100):
+        response = self.client.get('/api/v1/catalog/changes/', {'since': since, 'limit': limit})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_and_delta_sync(self):
+        """Тест первой синхронизации, изменений и tombstone"""
+        data = self.sync(0)
+        self.assertEqual(
+            [change['type'] for change in data['changes']], ['category', 'subcategory', 'product', 'product', 'product']
+        )
+        self.assertEqual(data['changes'][2]['data']['subcategory'], self.subcategory.pk)
+        cursor = data['cursor']
+        self.assertEqual(self.sync(cursor)['changes'], [])
+
+        self.products[0].name = 'Новое название'
+        self.products[0].save()
+        deleted_pk = self.products[1].pk
+        self.products[1].delete()
+        outbox.dispatch()
+
+        with self.assertNumQueries(3):
+            data = self.sync(cursor)
+        self.assertEqual(
+            [(c['id'], c['deleted']) for c in data['changes']],
+            [(self.products[0].pk, False), (deleted_pk, True)]
+        )
+        self.assertEqual(data['changes'][0]['data']['name'], 'Новое название')
+        self.assertIsNone(data['changes'][1]['data'])
+
+    def test_pagination(self):
+        """Тест постраничной выдачи по курсору"""
+        first = self.sync(0, limit=2)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['cursor'], limit=10)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 5)
+        self.assertEqual(
+            self.client.get('/api/v1/catalog/changes/', {'since': 'x'}).status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+
+class PopularityTestCase(APITestCase):
+    """Тесты рейтинга популярности"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.products = [
+            Product.objects.create(subcategory=subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            for i in range(3)
+        ]
+
+    def test_sketch_and_top_k(self):
+        """Тест оценки частоты и вытеснения из top-K"""
+        sketch = CountMinSketch(width=64, depth=4)
+        top = TopK(2)
+        for item, count in ((1, 5), (2, 3), (3, 10)):
+            for _ in range(count):
+                top.offer(item, sketch.add(item))
+        self.assertGreaterEqual(sketch.estimate(3), 10)
+        self.assertEqual([item for item, _ in top.most_common()], [3, 1])
+
+    def test_flush_and_popular_endpoint(self):
+        """Тест сброса счетчиков одним выражением и выдачи популярных"""
+        tracker = PopularityTracker()
+        for product, weight in zip(self.products, (1, 7, 3)):
+            tracker.record(product.id, weight)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tracker.flush(), 3)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT')]), 1)
+        tracker.record(self.products[0].id, 10)
+        tracker.flush()
+
+        self.assertEqual(ProductPopularity.objects.count(), 3)
+        response = self.client.get('/api/v1/products/popular/')
+        self.assertEqual([p['slug'] for p in response.data['results']], ['p-0', 'p-1', 'p-2'])
+
+    def test_decay(self):
+        """Тест затухания: более позднее событие весит больше"""
+        self.assertAlmostEqual(
+            decay_factor(EPOCH + 7200, half_life_hours=1) / decay_factor(EPOCH + 3600, half_life_hours=1),
+            2.0
+        )
+        self.assertEqual(decay_factor(EPOCH + 3600, half_life_hours=1, epoch=EPOCH + 3600), 1.0)
+
+    def test_rescale(self):
+        """Тест переноса точки отсчета: короткий период полураспада не переполняет множитель"""
+        ProductPopularity.objects.create(product=self.products[0], score=1e30)
+        ProductPopularity.objects.create(product=self.products[1], score=2e30)
+        tracker = PopularityTracker()
+        tracker.record(self.products[2].id, 4)
+        with override_settings(POPULARITY={**settings.POPULARITY, 'HALF_LIFE_HOURS': 12, 'FLUSH_INTERVAL': 0}):
+            self.assertEqual(tracker.flush(), 1)
+
+        epoch = PopularityEpoch.objects.get().epoch
+        self.assertGreater(epoch, EPOCH + RESCALE_EXPONENT * 12 * 3600)
+        scores = dict(ProductPopularity.objects.values_list('product__slug', 'score'))
+        self.assertAlmostEqual(scores['p-2'], 4, places=3)
+        # С 2024 года прошли сотни периодов полураспада: старые рейтинги затухли
+        self.assertLessEqual(scores['p-0'], scores['p-1'])
+        self.assertLess(scores['p-1'], 1e-6)
+
+        # Повторный сброс не переносит точку отсчета
+        tracker.record(self.products[2].id, 4)
+        with override_settings(POPULARITY={**settings.POPULARITY, 'HALF_LIFE_HOURS': 12, 'FLUSH_INTERVAL': 0}):
+            tracker.flush()
+        self.assertEqual(PopularityEpoch.objects.get().epoch, epoch)
+        self.assertAlmostEqual(ProductPopularity.objects.get(product=self.products[2]).score, 8, places=3)
+
+    def test_record_does_not_flush(self):
+        """Тест: событие не пишет в БД, сброс выполняет фоновый поток"""
+        tracker = PopularityTracker()
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                tracker.record(self.products[0].id)
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(tracker.thread)
+
+
+class RelatedProductsTestCase(APITestCase):
+    """Тесты «часто покупают вместе»"""
+
+    def setUp(self):
+        """Корзины: abc, ab, ac, bd"""
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.products = {
+            slug: Product.objects.create(subcategory=subcategory, name=slug, slug=slug, price=10)
+            for slug in 'abcd'
+        }
+        for i, contents in enumerate(['abc', 'ab', 'ac', 'bd']):
+            cart = Cart.objects.create(user=User.objects.create_user(username=f'user{i}', password='x'))
+            for slug in contents:
+                CartItem.objects.create(cart=cart, product=self.products[slug])
+
+    def test_build_and_serve(self):
+        """Тест расчета по порциям и выдачи связанных продуктов"""
+        call_command('build_related_products', chunk_size=1, stdout=io.StringIO())
+
+        response = self.client.get('/api/v1/products/a/related/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['slug'] for p in response.data], ['c', 'b'])
+        self.assertEqual([p['slug'] for p in self.client.get('/api/v1/products/d/related/').data], [])
+
+    def test_cosine_top_n(self):
+        """Тест ограничения числа соседей"""
+        call_command('build_related_products', top=1, metric='cosine', min_support=1, stdout=io.StringIO())
+        response = self.client.get('/api/v1/products/b/related/')
+        self.assertEqual(len(response.data), 1)
+
+    def test_orders_are_baskets(self):
+        """Тест: строки оформленного заказа учитываются как корзина"""
+        user = User.objects.create_user(username='buyer', password='x')
+        for _ in range(2):
+            order = Order.objects.create(user=user, total_price=20)
+            for slug in 'cd':
+                OrderLine.objects.create(order=order, product=self.products[slug], name=slug, price=10, quantity=1)
+        OrderLine.objects.create(order=order, product=None, name='удален', price=10, quantity=1)
+        call_command('build_related_products', chunk_size=1, stdout=io.StringIO())
+
+        response = self.client.get('/api/v1/products/d/related/')
+        self.assertEqual([p['slug'] for p in response.data], ['c'])
 
 
 class CartAPITestCase(APITestCase):
@@ -105,7 +803,8 @@ class CartAPITestCase(APITestCase):
             subcategory=self.subcategory,
             name='Тестовый продукт',
             slug='test-product',
-            price=99.99
+            price=99.99,
+            stock=10
         )
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
@@ -178,6 +877,591 @@ class CartAPITestCase(APITestCase):
         self.assertEqual(CartItem.objects.count(), 0)
 
 
+class RelationLoaderTestCase(APITestCase):
+    """Тесты пакетной загрузки связей"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='buyer')
+        self.cart = Cart.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def fill(self, count, start=0):
+        for i in range(start, start + count):
+            category = Category.objects.create(name=f'Категория {i}', slug=f'c-{i}')
+            subcategory = SubCategory.objects.create(category=category, name=f'Подкатегория {i}', slug=f's-{i}')
+            product = Product.objects.create(subcategory=subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            ProductImage.objects.create(product=product)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=i + 1)
+
+    def cart_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
+    def test_cart_queries_do_not_grow_with_items(self):
+        """Тест: число запросов корзины не зависит от числа позиций, ответ тот же"""
+        self.fill(2)
+        _, few = self.cart_queries()
+        self.fill(4, start=2)
+        response, many = self.cart_queries()
+        self.assertEqual(few, many)
+        with override_settings(RELATION_LOADER={'ENABLED': False}):
+            lazy, lazy_queries = self.cart_queries()
+        self.assertEqual(response.json(), lazy.json())
+        self.assertGreater(lazy_queries, many + 10)
+
+    def test_chains_and_memo(self):
+        """Тест: цепочка связей — по запросу на уровень, повторно загруженное берется из области"""
+        self.fill(3)
+        with loaders.scope():
+            with self.assertNumQueries(4):
+                items = list(CartItem.objects.all())
+                self.assertEqual([item.product.category.name for item in items], [f'Категория {i}' for i in range(3)])
+            with self.assertNumQueries(2):
+                images = list(ProductImage.objects.all())
+                self.assertEqual(str(images[0]), 'Изображение для Продукт 0')
+                [str(subcategory) for subcategory in SubCategory.objects.all()]
+
+            # Сохраненный объект забывается
+            Product.objects.filter(pk=items[0].product_id).get().save()
+            with self.assertNumQueries(2):
+                self.assertEqual(list(CartItem.objects.all())[0].product.name, 'Продукт 0')
+
+        # Вне области — обычная ленивая загрузка
+        with self.assertNumQueries(4):
+            [str(subcategory) for subcategory in SubCategory.objects.all()]
+
+    def test_bulk_update_forgets_model(self):
+        """Тест: после массового update (списание остатка, перенос поддерева) запомненные объекты перечитываются"""
+        self.fill(2)
+        with loaders.scope():
+            items = list(CartItem.objects.all())
+            self.assertEqual(items[0].product.stock, 0)
+            Product.objects.filter(pk=items[0].product_id).update(stock=5)
+            self.assertTrue(take(items[0].product_id, 2))
+            with self.assertNumQueries(2):
+                self.assertEqual(list(CartItem.objects.all())[0].product.stock, 3)
+
+            subcategories = list(SubCategory.objects.all())
+            self.assertEqual(subcategories[0].category.name, 'Категория 0')
+            Category.objects.bulk_update([Category(pk=subcategories[0].category_id, name='Новая')], ['name'])
+            self.assertEqual(list(SubCategory.objects.all())[0].category.name, 'Новая')
+
+    def test_fast_delete_kept(self):
+        """Тест: объекты забываются только для запоминаемых моделей, остальные удаляются без выборки"""
+        self.fill(2)
+        with loaders.scope() as current:
+            item = CartItem.objects.first()
+            self.assertEqual(item.cart.user.username, 'buyer')
+            self.assertIn(('auth.User', 'default', 'id', self.user.pk), current.objects)
+            self.user.save()
+            self.assertNotIn(('auth.User', 'default', 'id', self.user.pk), current.objects)
+        products = list(Product.objects.all())
+        RelatedProduct.objects.create(product=products[0], related=products[1], rank=0, score=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(RelatedProduct.objects.all().delete()[0], 1)
+
+    def test_admin_choices(self):
+        """Тест: форма продукта в админке не делает запрос на каждую подкатегорию"""
+        self.fill(5)
+        admin_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/shop/product/add/')
+        self.assertContains(response, 'Категория 4 &gt; Подкатегория 4')
+        self.assertLess(len(queries), 10)
+
+
+class StockTestCase(APITestCase):
+    """Тесты остатков и резервов"""
+
+    def setUp(self):
+        """Продукт с остатком 3 и авторизованный пользователь"""
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.product = Product.objects.create(
+            subcategory=subcategory, name='Продукт', slug='product', price=10, stock=3
+        )
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(user=self.user)
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).stock
+
+    def test_take_is_conditional(self):
+        """Тест: списание не уводит остаток в минус, доступность выводится из остатка"""
+        self.assertTrue(take(self.product.pk, 2))
+        self.assertFalse(take(self.product.pk, 2))
+        self.assertTrue(take(self.product.pk, 1))
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.stock, 0)
+        self.assertFalse(product.is_available)
+
+    def test_cart_reserves_stock(self):
+        """Тест резерва при добавлении, изменении и удалении позиции"""
+        response = self.client.post('/api/v1/cart/items/', {'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(), 1)
+
+        response = self.client.post('/api/v1/cart/items/', {'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        item = CartItem.objects.get()
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(self.stock(), 1)
+
+        self.client.patch(f'/api/v1/cart/items/{item.pk}/', {'quantity': 1})
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(StockReservation.objects.get().quantity, 1)
+
+        self.client.delete(f'/api/v1/cart/items/{item.pk}/')
+        self.assertEqual(self.stock(), 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_sweep_expired(self):
+        """Тест возврата просроченных резервов на склад"""
+        self.client.post('/api/v1/cart/items/', {'product_id': self.product.pk, 'quantity': 3})
+        self.assertFalse(Product.objects.get(pk=self.product.pk).is_available)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(sweep_expired(batch_size=1), 1)
+        self.assertEqual(self.stock(), 3)
+        self.assertTrue(CartItem.objects.exists())
+
+        # Позиция без резерва резервируется заново при изменении количества
+        item = CartItem.objects.get()
+        self.client.patch(f'/api/v1/cart/items/{item.pk}/', {'quantity': 2})
+        self.assertEqual(self.stock(), 1)
+
+
+class GroupCommitTestCase(TransactionTestCase):
+    """Тесты групповой фиксации изменений корзин"""
+
+    def setUp(self):
+        """Продукт с остатком 5 и корзины восьми пользователей"""
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.product = Product.objects.create(
+            subcategory=subcategory, name='Продукт', slug='product', price=10, stock=5
+        )
+        self.carts = [
+            Cart.objects.create(user=User.objects.create(username=f'buyer{i}'))
+            for i in range(8)
+        ]
+        self.writer = carts.GroupCommitWriter(max_wait=0.2)
+        self.commits = []
+        commit = self.writer.commit
+        self.writer.commit = lambda batch: (self.commits.append(len(batch)), commit(batch))
+        patcher = unittest.mock.patch.object(carts, '_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.writer.close)
+
+    @override_settings(CART_WRITER={'ENABLED': True})
+    def test_concurrent_adds_share_commit(self):
+        """Тест: параллельные добавления фиксируются порцией, нехватка остатка откатывает только свое изменение"""
+        results = []
+
+        def add(cart):
+            try:
+                results.append(carts.run(carts.add_item, cart, self.product, 1))
+            except OutOfStock as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=add, args=(cart,)) for cart in self.carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(isinstance(result, CartItem) for result in results), 5)
+        self.assertEqual(sum(isinstance(result, OutOfStock) for result in results), 3)
+        self.assertLess(len(self.commits), 8)
+        self.assertEqual(sum(self.commits), 8)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 0)
+        self.assertEqual(CartItem.objects.count(), 5)
+        self.assertEqual(StockReservation.objects.count(), 5)
+
+    @override_settings(CART_WRITER={'ENABLED': True, 'TIMEOUT': 0.05})
+    def test_timeout_cancels_pending_mutation(self):
+        """Тест: изменение, не дождавшееся писателя, отменяется с ошибкой 503"""
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait()
+
+        future = self.writer.submit(slow)
+        started.wait()
+        with self.assertRaises(carts.Overloaded):
+            carts.run(carts.add_item, self.carts[0], self.product, 1)
+        release.set()
+        future.result()
+        self.writer.close()
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+
+
+class DatabaseRoutingTestCase(APITestCase):
+    """Тесты маршрутизации чтений каталога на реплику"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.product = Product.objects.create(
+            subcategory=subcategory, name='Продукт', slug='product', price=10, stock=5
+        )
+        self.router = ReadReplicaRouter()
+
+    @override_settings(DB_ROUTING={'READ_ALIAS': 'replica'})
+    def test_router(self):
+        """Тест: реплика только для каталога внутри запроса и до первой записи"""
+        self.assertIsNone(self.router.db_for_read(Product))
+        with routers.request_scope():
+            # Тест целиком выполняется в транзакции
+            self.assertIsNone(self.router.db_for_read(Product))
+            with unittest.mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(self.router.db_for_read(Product), 'replica')
+                self.assertEqual(self.router.db_for_read(CatalogChange), 'replica')
+                self.assertIsNone(self.router.db_for_read(Cart))
+                self.assertIsNone(self.router.db_for_read(User))
+                self.assertEqual(self.router.db_for_write(Product), 'default')
+                # Выбор БД для записи еще не запись
+                self.assertEqual(self.router.db_for_read(Product), 'replica')
+                User.objects.filter(pk=0).update(is_active=False)
+                self.assertIsNone(self.router.db_for_read(Product))
+        with routers.request_scope(pinned=True), unittest.mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertIsNone(self.router.db_for_read(Category))
+        self.assertFalse(self.router.allow_migrate('replica', 'shop'))
+
+    @override_settings(DB_ROUTING={'READ_ALIAS': 'replica'})
+    def test_primary_block(self):
+        """Тест: в блоке primary() чтения идут на основную БД без привязки клиента"""
+        with routers.request_scope() as scope, unittest.mock.patch.object(connection, 'in_atomic_block', False):
+            with routers.primary():
+                self.assertIsNone(self.router.db_for_read(Product))
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertFalse(scope.wrote)
+
+    @override_settings(DB_ROUTING={'READ_ALIAS': 'replica'})
+    def test_cache_fill_reads_primary(self):
+        """Тест: промах кэша деталей заполняется с основной БД"""
+        product_cache.clear_local()
+        request = RequestFactory().get('/')
+        aliases = []
+
+        def loader():
+            aliases.append(self.router.db_for_read(Product))
+            return {'slug': 'product'}
+
+        with routers.request_scope(), unittest.mock.patch.object(connection, 'in_atomic_block', False):
+            product_cache.invalidate('product')
+            product_cache.get_or_set('product', request, loader)
+        self.assertEqual(aliases, [None])
+
+    @override_settings(DB_ROUTING={'READ_ALIAS': 'default', 'STICKY_SECONDS': 7, 'STICKY_COOKIE': 'db_pinned'})
+    def test_sticky_cookie_after_write(self):
+        """Тест: после записи клиент получает cookie привязки к основной БД"""
+        response = self.client.get('/api/v1/products/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('db_pinned', response.cookies)
+
+        self.client.force_authenticate(user=User.objects.create_user(username='buyer', password='x'))
+        response = self.client.post('/api/v1/cart/items/', {'product_id': self.product.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.cookies['db_pinned']['max-age'], 7)
+
+    @override_settings(DB_ROUTING={'READ_ALIAS': 'default', 'STICKY_COOKIE': 'db_pinned'})
+    def test_read_only_get_or_create_does_not_pin(self):
+        """Тест: просмотр существующей корзины (get_or_create без вставки) не привязывает клиента"""
+        user = User.objects.create_user(username='buyer', password='x')
+        Cart.objects.create(user=user)
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/v1/cart/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('db_pinned', response.cookies)
+
+
+class CartEventsTestCase(TestCase):
+    """Тесты потока изменений корзины (SSE)"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.product = Product.objects.create(
+            subcategory=subcategory, name='Продукт', slug='product', price=10, stock=5
+        )
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.cart = Cart.objects.create(user=self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_cart_item_changes_published_on_commit(self):
+        """Тест: изменение и удаление позиции публикуются после коммита"""
+        with unittest.mock.patch.object(events, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+                publish.assert_not_called()
+            item_id = item.pk
+            with self.captureOnCommitCallbacks(execute=True):
+                item.delete()
+        channel = events.cart_channel(self.cart.pk)
+        publish.assert_has_calls([
+            unittest.mock.call(channel, {
+                'event': 'item_updated', 'id': item_id, 'product_id': self.product.pk, 'quantity': 2
+            }),
+            unittest.mock.call(channel, {'event': 'item_removed', 'id': item_id, 'product_id': self.product.pk}),
+        ])
+
+    def test_stream_requires_asgi(self):
+        """Тест: под WSGI поток не открывается, чтобы не занять воркер навсегда"""
+        response = self.client.get('/api/v1/cart/events/', {'token': self.token})
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(events.hub.count(), 0)
+
+    async def test_stream(self):
+        """Тест потока: ready, опубликованное изменение, heartbeat и resync при переполнении"""
+        response = await self.async_client.get('/api/v1/cart/events/')
+        self.assertEqual(response.status_code, 401)
+
+        with override_settings(EVENTS={'HEARTBEAT': 0.05, 'MAX_QUEUE': 1}):
+            response = await self.async_client.get('/api/v1/cart/events/', {'token': self.token})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = aiter(response.streaming_content)
+            self.assertIn(f'"cart_id": {self.cart.pk}', (await anext(stream)).decode())
+
+            events.publish(events.cart_channel(self.cart.pk), {'event': 'item_updated', 'id': 1, 'quantity': 3})
+            chunk = (await asyncio.wait_for(anext(stream), 1)).decode()
+            self.assertEqual(chunk, 'event: item_updated\nid: 1\ndata: {"id": 1, "quantity": 3}\n\n')
+            self.assertEqual(await asyncio.wait_for(anext(stream), 1), b': ping\n\n')
+
+            for i in range(3):
+                events.publish(events.cart_channel(self.cart.pk), {'event': 'item_removed', 'id': i})
+            await asyncio.sleep(0)
+            self.assertIn(b'event: resync', await asyncio.wait_for(anext(stream), 1))
+
+            # Отключение клиента отменяет ожидание в потоке — подписка снимается
+            pending = asyncio.ensure_future(anext(stream))
+            await asyncio.sleep(0)
+            pending.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await pending
+        self.assertEqual(events.hub.count(), 0)
+
+    def test_unix_socket_fanout(self):
+        """Тест доставки между процессами через датаграммные сокеты"""
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = unittest.mock.Mock(), unittest.mock.Mock()
+            delivered = threading.Event()
+            second.deliver.side_effect = lambda channel, message: delivered.set()
+            fanouts = [events.UnixSocketFanout(first, directory), events.UnixSocketFanout(second, directory)]
+            try:
+                fanouts[0].publish('cart:1', {'event': 'item_removed', 'id': 5})
+                self.assertTrue(delivered.wait(1))
+                second.deliver.assert_called_with('cart:1', {'event': 'item_removed', 'id': 5})
+            finally:
+                for fanout in fanouts:
+                    fanout.close()
+
+    def test_unix_socket_fanout_across_processes(self):
+        """Тест: подписка в этом процессе получает событие, опубликованное другим процессом"""
+        script = (
+            'import sys, django; django.setup()\n'
+            'from shop import events\n'
+            'fanout = events.UnixSocketFanout(events.Hub(), sys.argv[1])\n'
+            'fanout.publish("cart:7", {"event": "item_removed", "id": 3})\n'
+            'fanout.close()\n'
+        )
+
+        async def receive(directory):
+            subscription = events.hub.subscribe('cart:7')
+            try:
+                await asyncio.to_thread(
+                    subprocess.run, [sys.executable, '-c', script, directory],
+                    check=True, cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'},
+                )
+                return await subscription.get(timeout=5)
+            finally:
+                subscription.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'FANOUT': 'shop.events.UnixSocketFanout', 'SOCKET_DIR': directory}
+            with override_settings(EVENTS=config), unittest.mock.patch.object(events, '_fanout', None):
+                try:
+                    message = asyncio.run(receive(directory))
+                finally:
+                    events.get_fanout().close()
+        self.assertEqual(message, {'event': 'item_removed', 'id': 3})
+
+    def test_publish_does_not_block(self):
+        """Тест: переполненный сокет получателя не блокирует публикацию"""
+        with tempfile.TemporaryDirectory() as directory:
+            fanout = events.UnixSocketFanout(unittest.mock.Mock(), directory)
+            try:
+                with unittest.mock.patch.object(fanout, 'sender') as sender:
+                    sender.sendto.side_effect = BlockingIOError
+                    fanout.publish('cart:1', {'event': 'item_removed', 'id': 5})
+                self.assertTrue(fanout.path.exists())
+            finally:
+                fanout.close()
+
+
+class CheckoutTestCase(APITestCase):
+    """Тесты оформления заказа"""
+
+    def setUp(self):
+        """Корзина с двумя продуктами"""
+        category = Category.objects.create(name='Категория', slug='category')
+        self.subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.apple = Product.objects.create(
+            subcategory=self.subcategory, name='Яблоко', slug='apple', price='10.50', stock=5
+        )
+        self.pear = Product.objects.create(
+            subcategory=self.subcategory, name='Груша', slug='pear', price='3.00', stock=5
+        )
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/api/v1/cart/items/', {'product_id': self.apple.pk, 'quantity': 2})
+        self.client.post('/api/v1/cart/items/', {'product_id': self.pear.pk, 'quantity': 1})
+
+    def test_checkout(self):
+        """Тест: цены зафиксированы, корзина очищена, резерв стал продажей"""
+        response = self.client.post('/api/v1/orders/checkout/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], '24.00')
+        self.assertEqual([line['name'] for line in response.data['lines']], ['Яблоко', 'Груша'])
+
+        Product.objects.filter(pk=self.apple.pk).update(price='99.00')
+        line = OrderLine.objects.get(product=self.apple)
+        self.assertEqual(str(line.price), '10.50')
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).stock, 3)
+
+        response = self.client.post('/api/v1/orders/checkout/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get('/api/v1/orders/').data['results']), 1)
+
+    def test_idempotent_retry(self):
+        """Тест: повтор с тем же ключом возвращает тот же заказ"""
+        first = self.client.post('/api/v1/orders/checkout/', HTTP_IDEMPOTENCY_KEY='k-1')
+        retry = self.client.post('/api/v1/orders/checkout/', HTTP_IDEMPOTENCY_KEY='k-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        response = self.client.post(
+            '/api/v1/orders/checkout/', {'note': 'другое'}, format='json', HTTP_IDEMPOTENCY_KEY='k-1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_failed_checkout_can_be_retried(self):
+        """Тест: при нехватке остатка ключ не занимается и заказ не создается"""
+        StockReservation.objects.all().delete()
+        Product.objects.filter(pk=self.apple.pk).update(stock=0)
+        response = self.client.post('/api/v1/orders/checkout/', HTTP_IDEMPOTENCY_KEY='k-2')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+
+        Product.objects.filter(pk=self.apple.pk).update(stock=5)
+        response = self.client.post('/api/v1/orders/checkout/', HTTP_IDEMPOTENCY_KEY='k-2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_large_cart_constant_queries(self):
+        """Тест: число запросов не зависит от размера корзины"""
+        CartItem.objects.all().delete()
+        products = Product.objects.bulk_create([
+            Product(subcategory=self.subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=1, stock=1)
+            for i in range(300)
+        ])
+        cart = Cart.objects.get(user=self.user)
+        items = CartItem.objects.bulk_create([CartItem(cart=cart, product=p) for p in products])
+        StockReservation.objects.bulk_create([
+            StockReservation(cart_item=item, product=item.product, quantity=1, expires_at=timezone.now())
+            for item in items
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/orders/checkout/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['lines']), 300)
+        self.assertLess(len(queries), 20)
+
+
+class PurgeCartsTestCase(TestCase):
+    """Тесты очистки заброшенных и пустых корзин"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.product = Product.objects.create(
+            subcategory=subcategory, name='Продукт', slug='product', price=10, stock=10
+        )
+        old = timezone.now() - timedelta(days=60)
+        self.carts = {}
+        for name in ('old_empty', 'fresh_empty', 'abandoned', 'active'):
+            self.carts[name] = Cart.objects.create(user=User.objects.create_user(username=name, password='x'))
+        for name in ('abandoned', 'active'):
+            item = CartItem.objects.create(cart=self.carts[name], product=self.product, quantity=2)
+            StockReservation.objects.create(
+                cart_item=item, product=self.product, quantity=2, expires_at=timezone.now()
+            )
+        Product.objects.filter(pk=self.product.pk).update(stock=6)
+        Cart.objects.exclude(pk=self.carts['fresh_empty'].pk).update(updated_at=old)
+        CartItem.objects.filter(cart=self.carts['abandoned']).update(updated_at=old)
+        for name in ('old_empty', 'active'):
+            IdempotencyKey.objects.create(user=self.carts[name].user, key=name, fingerprint='x')
+        IdempotencyKey.objects.filter(key='old_empty').update(created_at=old)
+
+    def test_dry_run(self):
+        """Тест отчета без удаления"""
+        out = io.StringIO()
+        call_command('purge_carts', dry_run=True, batch_size=1, sleep=0, stdout=out)
+        self.assertIn('заброшенных 1, пустых 1', out.getvalue())
+        self.assertIn('ключей идемпотентности: 1', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 4)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+    def test_purge(self):
+        """Тест удаления порциями с возвратом резервов"""
+        call_command('purge_carts', batch_size=1, sleep=0, stdout=io.StringIO())
+        self.assertEqual(
+            set(Cart.objects.values_list('user__username', flat=True)), {'fresh_empty', 'active'}
+        )
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['active'])
+
+    def test_cart_touched_before_write(self):
+        """Тест: старая пустая корзина, в которую добавляют позицию, не удаляется"""
+        client = APIClient()
+        client.force_authenticate(self.carts['old_empty'].user)
+        response = client.post('/api/v1/cart/items/', {'product_id': self.product.pk, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        call_command('purge_carts', batch_size=1, sleep=0, stdout=io.StringIO())
+        self.assertTrue(CartItem.objects.filter(cart=self.carts['old_empty']).exists())
+
+    def test_get_cart_recreates_deleted(self):
+        """Тест: корзина, удаленная между чтением и записью, создается заново"""
+        user = self.carts['old_empty'].user
+        stale = Cart.objects.get(user=user)
+        get_or_create = Cart.objects.get_or_create
+        calls = []
+
+        def racing_get_or_create(**kwargs):
+            # Первый вызов отдает корзину, которую тут же удаляет purge_carts
+            calls.append(kwargs)
+            if len(calls) == 1:
+                Cart.objects.filter(pk=stale.pk).delete()
+                return stale, False
+            return get_or_create(**kwargs)
+
+        with unittest.mock.patch.object(Cart.objects, 'get_or_create', racing_get_or_create):
+            cart = carts.get_cart(user, touch=True)
+        self.assertEqual(len(calls), 2)
+        self.assertNotEqual(cart.pk, stale.pk)
+        self.assertTrue(Cart.objects.filter(pk=cart.pk, user=user).exists())
+
+
 class AuthAPITestCase(APITestCase):
     """Тесты для API авторизации"""
     
@@ -216,3 +1500,358 @@ class AuthAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('access', response.data)
         self.assertIn('refresh', response.data)
+
+
+class MetricsTestCase(APITestCase):
+    """Тесты метрик"""
+
+    def setUp(self):
+        """Отдельный каталог метрик для каждого теста"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(METRICS_DIR=self.tmpdir.name)
+        self.settings_override.enable()
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+    def test_requests_are_counted(self):
+        """Тест учета запросов и латентности по маршрутам"""
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/products/')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn(
+            'shop_http_requests_total{method="GET",route="product-list",status="200"} 2', body
+        )
+        self.assertIn('shop_http_request_duration_seconds_count{route="product-list"} 2', body)
+        self.assertIn('# TYPE shop_http_request_duration_seconds histogram', body)
+
+    def test_values_are_merged_across_files(self):
+        """Тест суммирования счетчиков из файлов разных процессов"""
+        # Файл живого процесса: родитель тестового процесса
+        other = metrics.MetricsFile(metrics.get_metrics_dir() / f'metrics_{os.getppid()}.db')
+        other.inc(metrics.series('shop_test_total', kind='a'), 3)
+        other.set(metrics.series('shop_test_gauge'), 7)
+        other.close()
+        metrics.inc('shop_test_total', 2, kind='a')
+        metrics.set_gauge('shop_test_gauge', 5)
+
+        totals, kinds = metrics.collect()
+        self.assertEqual(totals['shop_test_total{kind="a"}'], 5)
+        self.assertEqual(totals['shop_test_gauge'], 7)
+
+    def test_types_and_long_keys(self):
+        """Тест: тип семейства берется из записи, а не из суффикса; длинное имя серии — ошибка"""
+        metrics.inc('shop_test_retries_count', 2)
+        metrics.observe('shop_test_seconds', 0.2, buckets=(0.5, 0.1))
+        body = metrics.render()
+        self.assertIn('# TYPE shop_test_retries_count counter', body)
+        self.assertIn('# TYPE shop_test_seconds histogram', body)
+        self.assertIn('shop_test_seconds_bucket{le="0.5"} 1', body)
+        self.assertIn('shop_test_seconds_bucket{le="+Inf"} 1', body)
+        self.assertIn('shop_test_seconds_count 1', body)
+        with self.assertRaises(ValueError):
+            metrics.inc('shop_test_total', route='x' * metrics.KEY_SIZE)
+
+    def test_dead_process_files_are_pruned(self):
+        """Тест: файл завершившегося процесса удаляется, счетчики сохраняются в архиве, gauge — нет"""
+        dead_pid = int(subprocess.run(
+            [sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True, check=True
+        ).stdout)
+        path = metrics.get_metrics_dir() / f'metrics_{dead_pid}.db'
+        dead = metrics.MetricsFile(path)
+        dead.inc(metrics.series('shop_test_total'), 3)
+        dead.inc(metrics.series('shop_test_seconds_count'), 4, kind=metrics.HISTOGRAM)
+        dead.set(metrics.series('shop_outbox_lag_seconds'), 120)
+        dead.close()
+        metrics.inc('shop_test_total', 2)
+
+        totals, _ = metrics.collect()
+        self.assertFalse(path.exists())
+        self.assertEqual(totals['shop_test_total'], 5)
+        self.assertNotIn('shop_outbox_lag_seconds', totals)
+        self.assertEqual(metrics.collect()[1]['shop_test_seconds_count'], metrics.HISTOGRAM)
+        # Повторный сбор не считает архив дважды
+        self.assertEqual(metrics.collect()[0]['shop_test_total'], 5)
+
+
+class BenchmarkToolsTestCase(TestCase):
+    """Тесты генератора данных и утилит бенчмарка"""
+
+    def test_seed_benchmark(self):
+        """Тест генерации синтетического каталога"""
+        call_command(
+            'seed_benchmark', categories=2, subcategories=2, products=10,
+            images=1, users=3, cart_items=2, stdout=io.StringIO()
+        )
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(SubCategory.objects.count(), 4)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Cart.objects.count(), 3)
+        self.assertEqual(CartItem.objects.count(), 6)
+
+        call_command('seed_benchmark', products=4, users=1, clear=True, stdout=io.StringIO())
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_summarize(self):
+        """Тест расчета перцентилей"""
+        samples = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(percentile(samples, 50), 0.05)
+        self.assertEqual(percentile(samples, 99), 0.099)
+
+        summary = summarize(samples, 2.0, [2, 4], errors=0, concurrency=4)
+        self.assertEqual(summary['throughput_rps'], 50.0)
+        self.assertEqual(summary['latency_ms']['p95'], 95.0)
+        self.assertEqual(summary['queries_per_request'], 3.0)
+
+    def test_mixed_scenario(self):
+        """Тест смешанного сценария: доля записей и подсчет ошибок сервера без исключений"""
+        call_command('seed_benchmark', products=4, users=2, cart_items=1, stdout=io.StringIO())
+        ctx = BenchmarkContext()
+        rng = random.Random(1)
+        requests = [SCENARIOS['mixed'](ctx, rng) for _ in range(1000)]
+        writes = sum(request.method == 'POST' for request in requests)
+        self.assertTrue(150 < writes < 250)
+
+        transport = ClientTransport()
+        status_code, queries = transport.send(requests[0], ctx.usernames[0])
+        self.assertLess(status_code, 400)
+        self.assertGreater(queries, 0)
+        with unittest.mock.patch('shop.views.ProductViewSet.list', side_effect=RuntimeError), \
+                self.assertLogs('django.request', 'ERROR'):
+            status_code, _ = transport.send(BenchRequest('GET', '/api/v1/products/', None, False), None)
+        self.assertEqual(status_code, 500)
+
+
+class WarmUpTestCase(TestCase):
+    """Тесты прогрева воркера"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        self.products = [
+            Product.objects.create(subcategory=subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+            for i in range(3)
+        ]
+        ProductPopularity.objects.create(product=self.products[2], score=5)
+        product_cache.invalidate(*(product.slug for product in self.products))
+        category_cache.invalidate('category')
+
+    @override_settings(WARMUP={'FILL_CACHES': True, 'PRODUCTS': 1, 'BASE_URL': 'http://testserver'})
+    def test_warm_up(self):
+        """Тест: маршруты разрешены, внутренние запросы выполнены, популярное уже в кэше"""
+        with unittest.mock.patch.object(suggest, 'start') as start, \
+                unittest.mock.patch.object(warmup, 'connections'):
+            report = warmup.warm_up()
+        start.assert_called_once()
+        self.assertGreater(report['patterns'], 0)
+        self.assertGreater(report['serializers'], 0)
+        self.assertEqual(set(report['paths'].values()), {200})
+        self.assertEqual(report['caches'], (1, 1))
+
+        # Ответ из кэша совпадает с обычным, просмотр при прогреве не учитывается
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/products/p-2/')
+        self.assertEqual(cached.json()['name'], 'Продукт 2')
+        self.assertEqual(ProductPopularity.objects.get(product=self.products[2]).score, 5)
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/categories/category/')
+
+    @override_settings(WARMUP={'BASE_URL': 'http://testserver'})
+    def test_caches_are_opt_in(self):
+        """Тест: без FILL_CACHES кэш не заполняется и поток подсказок не запускается"""
+        index = suggest.SuggestIndex()
+        with unittest.mock.patch.object(suggest, 'index', index), \
+                unittest.mock.patch.object(warmup, 'connections'):
+            report = warmup.warm_up()
+            self.assertNotIn('caches', report)
+            self.assertTrue(index.autostart)
+            self.assertIsNone(index.thread)
+            with unittest.mock.patch.object(index, 'start') as start:
+                self.client.get('/api/v1/categories/')
+            start.assert_called_once()
+
+    @override_settings(WARMUP={'ENABLED': False})
+    def test_disabled(self):
+        """Тест: выключенный прогрев ничего не делает"""
+        with unittest.mock.patch.object(suggest, 'start') as start:
+            self.assertIsNone(warmup.warm_up())
+        start.assert_not_called()
+
+    def test_api_settings_profile(self):
+        """Тест: профиль settings_api не загружает админку, сессии и drf_spectacular"""
+        code = (
+            'import sys, django; django.setup()\n'
+            'from django.urls import get_resolver; from shop.warmup import resolve_patterns\n'
+            'resolve_patterns(get_resolver())\n'
+            "print(' '.join(name for name in ['shop.admin', 'drf_spectacular', 'django.contrib.sessions.middleware',"
+            " 'django.contrib.messages.middleware'] if name in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent.parent,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings_api'},
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class ProfilingTestCase(APITestCase):
+    """Тесты профилирования запросов"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        Product.objects.create(subcategory=subcategory, name='Продукт', slug='product', price=10)
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.user = User.objects.create_user(username='user', password='x')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(PROFILING={'DIR': directory.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, user=None, **headers):
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        return self.client.get('/api/v1/products/', **headers)
+
+    def test_staff_trigger(self):
+        """Тест: профиль сохраняется только по просьбе сотрудника"""
+        self.assertNotIn('X-Profile-Id', self.get(HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.get(self.user, HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.get(self.staff))
+
+        response = self.get(self.staff, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+        self.assertTrue((self.directory / f'{profile_id}.prof').exists())
+        self.assertTrue((self.directory / f'{profile_id}.collapsed').exists())
+        meta = json.loads((self.directory / f'{profile_id}.json').read_text())
+        self.assertEqual(meta['route'], 'product-list')
+        self.assertEqual(meta['reason'], 'staff')
+        self.assertGreater(meta['sql']['count'], 0)
+        self.assertEqual(meta['sql']['count'], sum(query['count'] for query in meta['sql']['top']))
+
+    def test_sampling_and_command(self):
+        """Тест выборки 1 из N и команды profiles"""
+        with override_settings(PROFILING={'DIR': str(self.directory), 'SAMPLE_RATE': 1}):
+            ids = [self.get()['X-Profile-Id'] for _ in range(3)]
+
+        output = io.StringIO()
+        call_command('profiles', 'list', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 3)
+        self.assertIn('[sample]', output.getvalue())
+
+        collapsed = self.directory / 'all.collapsed'
+        output = io.StringIO()
+        call_command('profiles', 'aggregate', ids[0], ids[1], collapsed=str(collapsed), stdout=output)
+        self.assertIn('Профилей: 2', output.getvalue())
+        self.assertIn('function calls', output.getvalue())
+        self.assertTrue(collapsed.exists())
+
+        call_command('profiles', 'prune', keep=1, stdout=io.StringIO())
+        self.assertEqual(len(list(self.directory.glob('*.json'))), 1)
+
+
+class SchemaTestCase(APITestCase):
+    """Тесты предсобранной схемы OpenAPI"""
+
+    def setUp(self):
+        """Отдельный каталог схемы для каждого теста"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            OPENAPI_SCHEMA_DIR=self.tmpdir.name, CODE_VERSION='test'
+        )
+        self.settings_override.enable()
+        schema.reset()
+
+    def tearDown(self):
+        schema.reset()
+        self.settings_override.disable()
+        self.tmpdir.cleanup()
+
+    def test_schema_is_served_from_artifact(self):
+        """Тест отдачи схемы с ETag и gzip"""
+        response = self.client.get('/api/schema/?format=json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/api/v1/products/', json.loads(response.content)['paths'])
+        etag = response['ETag']
+
+        response = self.client.get('/api/schema/?format=json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get('/api/schema/?format=json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'"openapi"', gzip.decompress(response.content))
+
+    def test_schema_is_generated_once_per_version(self):
+        """Тест повторного использования файлов для той же версии кода"""
+        paths = schema.build()
+        mtime = paths['json'].stat().st_mtime_ns
+        self.assertEqual(schema.build()['json'].stat().st_mtime_ns, mtime)
+        self.assertTrue(paths['json'].name.startswith('schema-test.'))
+
+
+class RenderingTestCase(APITestCase):
+    """Тесты быстрого JSON и сжатия ответов"""
+
+    def test_fast_renderer_matches_json_renderer(self):
+        """Тест совпадения вывода с JSONRenderer для Decimal, datetime и URL"""
+        data = _product_page(3)
+        data['results'][0]['name'] = 'Строка\u2028с разделителем'
+        body = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), body)
+        self.assertEqual(
+            FastJSONParser().parse(io.BytesIO(body))['results'][1]['created_at'],
+            '2024-01-01T12:30:15.123456Z'
+        )
+
+    def test_fast_renderer_floats(self):
+        """Тест: float в записи orjson, но те же значения после разбора"""
+        data = {'values': [1e16, 1.5e-7, 0.1, -2.0, 123456789.125]}
+        body = JSONRenderer().render(data)
+        fast = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(body))
+        if fast != body:
+            self.assertIn(b'1e16', fast)
+            self.assertIn(b'1e+16', body)
+
+    def test_media_is_not_compressed(self):
+        """Тест: уже сжатые типы не сжимаются повторно"""
+        self.assertTrue(is_compressible('application/json'))
+        self.assertTrue(is_compressible('text/plain; version=0.0.4; charset=utf-8'))
+        self.assertTrue(is_compressible('application/problem+json'))
+        self.assertFalse(is_compressible('image/png'))
+        self.assertFalse(is_compressible('application/zip'))
+        self.assertFalse(is_compressible(''))
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        image = HttpResponse(b'\x89PNG' + b'0' * 1000, content_type='image/png')
+        response = CompressionMiddleware(lambda request: image)(request)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiate(self):
+        """Тест выбора кодировки по Accept-Encoding"""
+        self.assertEqual(negotiate('gzip, deflate', ['br', 'gzip']), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, br', ['br', 'gzip']), 'br')
+        self.assertEqual(negotiate('br;q=0, *', ['br', 'gzip']), 'gzip')
+        self.assertIsNone(negotiate('identity', ['br', 'gzip']))
+        self.assertIsNone(negotiate('', ['gzip']))
+
+    def test_response_is_compressed(self):
+        """Тест сжатия ответа API"""
+        category = Category.objects.create(name='Категория', slug='category')
+        subcategory = SubCategory.objects.create(category=category, name='Подкатегория', slug='sub')
+        for i in range(10):
+            Product.objects.create(subcategory=subcategory, name=f'Продукт {i}', slug=f'p-{i}', price=10)
+
+        response = self.client.get('/api/v1/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 10)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import CategoryViewSet, ProductViewSet, CartViewSet, CartItemViewSet
+from .views import CategoryViewSet, ProductViewSet, CartViewSet, CartItemViewSet, OrderViewSet, cart_events, catalog_changes
 from .auth_views import register
 
 router = DefaultRouter()
@@ -10,9 +10,13 @@ router.register(r'products', ProductViewSet, basename='product')
 # Важно: сначала регистрируем items, потом cart, чтобы избежать конфликтов
 router.register(r'cart/items', CartItemViewSet, basename='cart-item')
 router.register(r'cart', CartViewSet, basename='cart')
+router.register(r'orders', OrderViewSet, basename='order')
 
 urlpatterns = [
+    # До маршрутов роутера: иначе cart/events/ совпадет с cart/{pk}/
+    path('cart/events/', cart_events, name='cart-events'),
     path('', include(router.urls)),
+    path('catalog/changes/', catalog_changes, name='catalog-changes'),
     path('auth/register/', register, name='register'),
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
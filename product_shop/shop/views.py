@@ -1,23 +1,74 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from .models import Category, SubCategory, Product, Cart, CartItem
+from django.db.models import F, Subquery
+from . import carts, events, metrics, orders, popularity, stock, suggest, sync
+from .cache import category_cache, product_cache
+from .models import Category, SubCategory, Product, Cart, CartItem, Order, RelatedProduct, subtree_q
 from .serializers import (
-    CategorySerializer, ProductSerializer, ProductDetailSerializer,
-    CartSerializer, CartItemSerializer, CartItemCreateUpdateSerializer
+    CategorySerializer, CategoryTreeSerializer, SubCategorySerializer, ProductSerializer, ProductDetailSerializer,
+    CartSerializer, CartItemSerializer, CartItemCreateUpdateSerializer, OrderSerializer
 )
 
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для категорий"""
-    queryset = Category.objects.prefetch_related('subcategories').all()
+    queryset = Category.objects.select_related('parent').prefetch_related('subcategories').all()
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
     lookup_field = 'slug'
 
+    def retrieve(self, request, *args, **kwargs):
+        """Детали категории через кэш по slug"""
+        detail = category_cache.get_or_set(
+            kwargs[self.lookup_field], request,
+            lambda: self.get_serializer(self.get_object()).data
+        )
+        return detail.response(request)
+
+    @action(detail=False, pagination_class=None)
+    def tree(self, request):
+        """
+        Все дерево категорий с подкатегориями-листьями двумя запросами.
+
+        Узлы связываются по parent_id, а не по порядку путей, поэтому
+        устаревший path (до rebuild_paths) не ломает дерево; категория с
+        отсутствующим родителем становится корнем.
+        """
+        context = self.get_serializer_context()
+        categories = list(Category.objects.order_by('path'))
+        data = CategoryTreeSerializer(categories, many=True, context=context).data
+        nodes = {}
+        for category, node in zip(categories, data):
+            node['children'] = []
+            node['subcategories'] = []
+            nodes[category.pk] = node
+        subcategories = list(SubCategory.objects.order_by('name'))
+        for subcategory, item in zip(subcategories, SubCategorySerializer(subcategories, many=True, context=context).data):
+            parent = nodes.get(subcategory.category_id)
+            if parent is not None:
+                parent['subcategories'].append(item)
+        roots = []
+        for category in categories:
+            parent = nodes.get(category.parent_id)
+            (parent['children'] if parent is not None else roots).append(nodes[category.pk])
+        for node in [{'children': roots}, *nodes.values()]:
+            node['children'].sort(key=lambda child: child['name'])
+        return Response(roots)
+
+
+# Максимум продуктов в одном запросе /products/bulk/
+BULK_MAX_ITEMS = 500
+
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet для продуктов"""
@@ -30,6 +81,89 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        """Детали продукта через кэш по slug"""
+        detail = product_cache.get_or_set(
+            kwargs[self.lookup_field], request,
+            lambda: self.get_serializer(self.get_object()).data
+        )
+        popularity.record_view(detail.data['id'])
+        return detail.response(request)
+
+    @action(detail=True)
+    def related(self, request, slug=None):
+        """Часто покупают вместе (рассчитывается командой build_related_products)"""
+        product = get_object_or_404(Product.objects.only('id'), slug=slug)
+        links = RelatedProduct.objects.filter(product=product).select_related(
+            'related__subcategory__category'
+        ).prefetch_related('related__images')
+        serializer = ProductSerializer([link.related for link in links], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False)
+    def suggest(self, request):
+        """Подсказки по префиксу названия продукта или подкатегории (индекс в памяти, без запросов к БД)"""
+        try:
+            limit = int(request.query_params.get('limit', 0))
+        except ValueError:
+            return Response({'error': 'limit должен быть целым числом'}, status=status.HTTP_400_BAD_REQUEST)
+        query = request.query_params.get('q', '')
+        # Отрицательный limit иначе стал бы срезом с конца
+        return Response({'query': query, 'results': suggest.index.search(query, max(limit, 1) if limit else None)})
+
+    @action(detail=False, methods=['get', 'post'])
+    def bulk(self, request):
+        """
+        Несколько продуктов одним запросом в порядке запроса.
+
+        GET ?ids=1,2,3 или ?slugs=a,b; POST {"ids": [...]} или {"slugs": [...]} для длинных списков.
+        Ненайденные значения перечисляются в missing.
+        """
+        source = request.data if request.method == 'POST' else request.query_params
+        field = 'slugs' if 'slugs' in source else 'ids'
+        if 'ids' in source and 'slugs' in source:
+            return Response({'error': 'Укажите ids или slugs, но не оба'}, status=status.HTTP_400_BAD_REQUEST)
+        values = source.get(field, [])
+        if isinstance(values, str):
+            values = [value for value in values.split(',') if value]
+        elif not isinstance(values, list):
+            return Response({'error': f'{field} должен быть списком'}, status=status.HTTP_400_BAD_REQUEST)
+        if field == 'ids':
+            try:
+                values = [int(value) for value in values]
+            except (TypeError, ValueError):
+                return Response({'error': 'ids должны быть целыми числами'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            values = [str(value) for value in values]
+        values = list(dict.fromkeys(values))
+        if len(values) > BULK_MAX_ITEMS:
+            return Response(
+                {'error': f'Не больше {BULK_MAX_ITEMS} продуктов в одном запросе'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Один запрос IN и одна предвыборка изображений
+        key = 'id' if field == 'ids' else 'slug'
+        products = {
+            getattr(product, key): product
+            for product in self.get_queryset().filter(**{f'{key}__in': values}).order_by()
+        }
+        serializer = self.get_serializer([products[value] for value in values if value in products], many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': [value for value in values if value not in products],
+        })
+
+    @action(detail=False)
+    def popular(self, request):
+        """Популярные продукты (одно чтение индекса рейтинга)"""
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            popularity__isnull=False
+        ).order_by('-popularity__score')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     def get_queryset(self):
         """Фильтрация по подкатегории и категории"""
@@ -37,10 +171,15 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         subcategory_slug = self.request.query_params.get('subcategory')
         category_slug = self.request.query_params.get('category')
         
+        if self.request.query_params.get('ordering') == 'popular':
+            queryset = queryset.order_by(F('popularity__score').desc(nulls_last=True), 'name')
+
         if subcategory_slug:
             queryset = queryset.filter(subcategory__slug=subcategory_slug)
         elif category_slug:
-            queryset = queryset.filter(subcategory__category__slug=category_slug)
+            # Все поддерево категории любой глубины — диапазон по индексу пути подкатегорий
+            prefix = Subquery(Category.objects.filter(slug=category_slug).values('path')[:1])
+            queryset = queryset.filter(subtree_q(prefix, field='subcategory__path'))
         
         return queryset
 
@@ -104,16 +243,148 @@ class CartItemViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Добавление продукта в корзину"""
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        serializer.save(cart=cart)
+        serializer.save(cart=serializer.context['cart'])
     
     def perform_update(self, serializer):
         """Обновление количества продукта"""
         serializer.save()
     
+    def perform_destroy(self, instance):
+        """Удаление продукта из корзины"""
+        carts.run(carts.remove_item, instance)
+    
     def get_serializer_context(self):
         """Передать корзину в контекст сериализатора"""
         context = super().get_serializer_context()
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        context['cart'] = cart
+        # Перед добавлением позиции корзина «трогается», чтобы purge_carts не удалил ее как пустую
+        context['cart'] = carts.get_cart(self.request.user, touch=self.action == 'create')
         return context
+
+
+class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet для заказов
+
+    GET /api/v1/orders/ - заказы пользователя
+    POST /api/v1/orders/checkout/ - оформить заказ из корзины (заголовок Idempotency-Key необязателен)
+    """
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Пользователь видит только свои заказы"""
+        return Order.objects.filter(user=self.request.user).prefetch_related('lines')
+
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """Оформление заказа; повтор с тем же Idempotency-Key возвращает тот же заказ"""
+        def place_order():
+            order = orders.checkout(request.user)
+            return status.HTTP_201_CREATED, self.get_serializer(order).data
+
+        key = request.headers.get('Idempotency-Key')
+        try:
+            if not key:
+                response_status, body = place_order()
+                return Response(body, status=response_status)
+            if len(key) > 255:
+                return Response(
+                    {'error': 'Ключ идемпотентности длиннее 255 символов'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            response_status, body, replayed = orders.run_idempotent(
+                request.user, key, orders.fingerprint(request), place_order
+            )
+        except orders.EmptyCart as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except stock.OutOfStock:
+            return Response({'error': 'Недостаточно товара на складе'}, status=status.HTTP_409_CONFLICT)
+        except orders.IdempotencyConflict as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = Response(body, status=response_status)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def catalog_changes(request):
+    """
+    Изменения каталога после курсора: GET /api/v1/catalog/changes/?since=<cursor>&limit=<n>
+
+    Первая синхронизация — since=0; дальше клиент передает cursor из ответа,
+    пока has_more не станет false.
+    """
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = min(int(request.query_params.get('limit', sync.DEFAULT_LIMIT)), sync.MAX_LIMIT)
+    except ValueError:
+        return Response({'error': 'since и limit должны быть целыми числами'}, status=status.HTTP_400_BAD_REQUEST)
+    if since < 0 or limit < 1:
+        return Response({'error': 'since и limit должны быть положительными'}, status=status.HTTP_400_BAD_REQUEST)
+    changes, cursor, has_more = sync.changes_since(since, limit, context={'request': request})
+    return Response({'changes': changes, 'cursor': cursor, 'has_more': has_more})
+
+
+def _stream_user(request):
+    """Пользователь по JWT из заголовка Authorization или параметра token"""
+    authentication = JWTAuthentication()
+    try:
+        token = request.GET.get('token')
+        if token is None:
+            result = authentication.authenticate(request)
+            return result[0] if result else None
+        return authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def cart_events(request):
+    """
+    Изменения корзины в формате Server-Sent Events: GET /api/v1/cart/events/
+
+    Работает только под ASGI (config/asgi.py): под WSGI бесконечный поток
+    занял бы воркер навсегда, поэтому там ответ — 501. EventSource не передает
+    заголовки, поэтому токен можно передать параметром ?token=<access>. Первое
+    событие — ready, затем item_updated / item_removed; resync — перечитать корзину.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'Поток событий доступен только под ASGI-сервером'}, status=status.HTTP_501_NOT_IMPLEMENTED,
+            json_dumps_params={'ensure_ascii': False}
+        )
+    user = await sync_to_async(_stream_user)(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Учетные данные не были предоставлены.'}, status=status.HTTP_401_UNAUTHORIZED,
+            json_dumps_params={'ensure_ascii': False}
+        )
+    cart, created = await Cart.objects.aget_or_create(user=user)
+    heartbeat = events.get_config()['HEARTBEAT']
+
+    async def stream():
+        # Подписка в генераторе: если поток так и не начали читать, отписываться не от чего
+        subscription = events.hub.subscribe(events.cart_channel(cart.pk))
+        try:
+            yield events.format_event({'event': 'ready', 'cart_id': cart.pk})
+            event_id = 0
+            while True:
+                message = await subscription.get(timeout=heartbeat)
+                if message is None:
+                    yield ': ping\n\n'
+                    continue
+                event_id += 1
+                yield events.format_event(message, event_id)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics_view(request):
+    """Метрики всех воркеров в формате Prometheus"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,153 @@
+"""
+Прогрев воркера при старте процесса.
+
+Первый запрос нового воркера платит за ленивую инициализацию: компиляцию
+регулярных выражений URL, построение полей сериализаторов, первое
+подключение к БД и пустые кэши. ``warm_up`` (вызывается из
+``config/wsgi.py`` и ``config/asgi.py``) делает это до приема трафика:
+разрешает все маршруты, строит поля сериализаторов и выполняет внутренние
+GET-запросы ``WARMUP['PATHS']``. Заполнение кэша детальных ответов самыми
+популярными продуктами и категориями дорогое и включается отдельно
+(``WARMUP['FILL_CACHES']``). Фоновые потоки здесь не запускаются: прогрев
+может идти в мастер-процессе до fork. Ошибки прогрева только логируются.
+"""
+import io
+import logging
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import connections
+from django.db.models import F
+from django.urls import URLPattern, URLResolver, get_resolver
+from rest_framework.request import Request
+from rest_framework.serializers import BaseSerializer
+
+from . import metrics, serializers, suggest
+from .cache import category_cache, product_cache
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BASE_URL': 'http://localhost',
+    'PATHS': ['/api/v1/products/', '/api/v1/categories/'],
+    'FILL_CACHES': False,
+    'PRODUCTS': 100,
+    'CATEGORIES': 50,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WARMUP', {})}
+
+
+def make_request(path, base_url):
+    """GET-запрос Django к path так, будто он пришел на base_url"""
+    url = urlsplit(base_url)
+    secure = url.scheme == 'https'
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': url.hostname or 'localhost',
+        'SERVER_PORT': str(url.port or (443 if secure else 80)),
+        'HTTP_HOST': url.netloc or 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': url.scheme or 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    return WSGIRequest(environ)
+
+
+def resolve_patterns(resolver=None):
+    """Скомпилировать регулярные выражения всех маршрутов; вернуть их число"""
+    resolver = resolver or get_resolver()
+    count = 0
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            count += resolve_patterns(pattern)
+        elif isinstance(pattern, URLPattern):
+            count += 1
+    return count
+
+
+def build_serializers():
+    """Построить поля всех сериализаторов магазина"""
+    built = 0
+    for cls in vars(serializers).values():
+        if isinstance(cls, type) and issubclass(cls, BaseSerializer) and cls.__module__ == serializers.__name__:
+            try:
+                cls(context={}).fields
+            except Exception:
+                # Сериализаторам с обязательным контекстом поля не построить заранее
+                continue
+            built += 1
+    return built
+
+
+def request_paths(paths, base_url):
+    """Внутренние GET-запросы через обработчик WSGI; вернуть их статусы"""
+    handler = WSGIHandler()
+    return {path: handler.get_response(make_request(path, base_url)).status_code for path in paths}
+
+
+def _fill(viewset_class, cache, slugs, base_url):
+    # Те же сериализатор и контекст, что у retrieve, но без учета просмотров
+    filled = 0
+    for slug in slugs:
+        request = Request(make_request('/', base_url))
+        view = viewset_class(request=request, format_kwarg=None, action='retrieve', kwargs={'slug': slug})
+        cache.get_or_set(slug, request, lambda: view.get_serializer(view.get_object()).data)
+        filled += 1
+    return filled
+
+
+def fill_caches(base_url, products, categories):
+    """Заполнить кэш детальных ответов популярными продуктами и категориями"""
+    from .views import CategoryViewSet, ProductViewSet
+
+    product_slugs = Product.objects.order_by(
+        F('popularity__score').desc(nulls_last=True), 'pk'
+    ).values_list('slug', flat=True)[:products]
+    category_slugs = Category.objects.order_by('path').values_list('slug', flat=True)[:categories]
+    return (
+        _fill(ProductViewSet, product_cache, list(product_slugs), base_url),
+        _fill(CategoryViewSet, category_cache, list(category_slugs), base_url),
+    )
+
+
+def warm_up():
+    """Прогреть процесс перед приемом трафика"""
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    start = time.perf_counter()
+    report = {}
+    steps = [
+        # Индекс подсказок строится в фоне с первого запроса процесса
+        ('suggest', suggest.start),
+        ('patterns', resolve_patterns),
+        ('serializers', build_serializers),
+        ('paths', lambda: request_paths(config['PATHS'], config['BASE_URL'])),
+    ]
+    if config['FILL_CACHES']:
+        steps.append(
+            ('caches', lambda: fill_caches(config['BASE_URL'], config['PRODUCTS'], config['CATEGORIES']))
+        )
+    for name, step in steps:
+        try:
+            report[name] = step()
+        except Exception:
+            logger.exception('Ошибка прогрева: %s', name)
+    # Соединения открыты в главном потоке до fork: воркеры откроют свои
+    connections.close_all()
+    duration = time.perf_counter() - start
+    metrics.set_gauge('shop_warmup_seconds', duration)
+    logger.info('Прогрев за %.0f мс: %s', duration * 1000, report)
+    return report